@@ -7,13 +7,39 @@ import logging
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import Platform
 from homeassistant.core import HomeAssistant
-
-from .const import CONF_PASSWORD, CONF_SERVER_URL, CONF_USERNAME, DOMAIN
+from homeassistant.helpers import config_validation as cv
+from homeassistant.helpers.typing import ConfigType
+
+from .archive import async_remove_archive
+from .attachments import WilmaAttachmentView, async_get_attachment_cache
+from .backfill import async_remove_backfill
+from .client import WilmaSessionCache
+from .const import (
+    CONF_CHANGE_PROBE,
+    CONF_PASSWORD,
+    CONF_SERVER_URL,
+    CONF_USERNAME,
+    DOMAIN,
+)
 from .coordinator import WilmaCoordinator
+from .roles import WilmaRoleCache
+from .services import async_setup_services
+from .store import async_remove_message_stores
+from .websocket_api import async_setup_websocket_api
 
 _LOGGER = logging.getLogger(__name__)
 
-PLATFORMS: list[Platform] = [Platform.SENSOR]
+PLATFORMS: list[Platform] = [Platform.SENSOR, Platform.CALENDAR]
+
+CONFIG_SCHEMA = cv.config_entry_only_config_schema(DOMAIN)
+
+
+async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
+    """Set up the Wilma services."""
+    async_setup_services(hass)
+    async_setup_websocket_api(hass)
+    hass.http.register_view(WilmaAttachmentView())
+    return True
 
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
@@ -27,10 +53,19 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         username=entry.data[CONF_USERNAME],
         password=entry.data[CONF_PASSWORD],
         entry_id=entry.entry_id,
+        options=entry.options,
     )
 
-    # Initial data fetch
-    await coordinator.async_config_entry_first_refresh()
+    # Start from the persisted messages and poll Wilma in the background, so
+    # a slow or unreachable server does not hold up the startup
+    restored = await coordinator.async_restore()
+    if not restored:
+        # Nothing persisted yet, the first poll has to succeed
+        await coordinator.async_config_entry_first_refresh()
+
+        # The schedule is optional, a failure leaves the calendars empty until
+        # its next refresh instead of failing the setup
+        await coordinator.schedule.async_refresh()
 
     # Store coordinator
     hass.data[DOMAIN][entry.entry_id] = coordinator
@@ -38,9 +73,39 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     # Set up all platforms
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
 
+    if restored:
+        entry.async_create_background_task(
+            hass, _async_refresh(coordinator), f"{DOMAIN} refresh {entry.entry_id}"
+        )
+
+    # Check for changed message lists between the polls
+    if entry.options.get(CONF_CHANGE_PROBE, True):
+        entry.async_on_unload(coordinator.probe.async_start())
+
+    # Continue fetching the message history if a restart interrupted it
+    await coordinator.backfill.async_resume(entry)
+
+    # Reload when the options change
+    entry.async_on_unload(entry.add_update_listener(async_reload_entry))
+
     return True
 
 
+async def _async_refresh(coordinator: WilmaCoordinator) -> None:
+    """Poll the messages and the schedule after a restored startup."""
+    await coordinator.async_refresh()
+    if coordinator.roles_changed:
+        _LOGGER.info("The roles of %s changed, reloading", coordinator.username)
+        coordinator.hass.config_entries.async_schedule_reload(coordinator.entry_id)
+        return
+    await coordinator.schedule.async_refresh()
+
+
+async def async_reload_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Reload a config entry after its options changed."""
+    await hass.config_entries.async_reload(entry.entry_id)
+
+
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Unload a config entry."""
     # Unload platforms
@@ -48,6 +113,20 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         # Clean up coordinator
         coordinator = hass.data[DOMAIN][entry.entry_id]
         await coordinator.async_close_client()
+        await coordinator.async_flush()
+        await coordinator.archive.async_close()
         hass.data[DOMAIN].pop(entry.entry_id)
 
     return unload_ok
+
+
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Remove the persisted session, messages and files of a deleted config entry."""
+    await WilmaSessionCache(
+        hass, entry.entry_id, entry.data[CONF_USERNAME], entry.data[CONF_PASSWORD]
+    ).async_clear()
+    await WilmaRoleCache(hass, entry.entry_id).async_clear()
+    await async_remove_backfill(hass, entry.entry_id)
+    await async_remove_archive(hass, entry.entry_id)
+    await async_remove_message_stores(hass, entry.entry_id)
+    await async_get_attachment_cache(hass).async_remove_entry(entry.entry_id)
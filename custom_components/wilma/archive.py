@@ -0,0 +1,316 @@
+"""Full-text searchable message archive for the Wilma integration."""
+
+from __future__ import annotations
+
+import logging
+import os
+import sqlite3
+import threading
+from collections.abc import Iterable, Mapping
+from contextlib import suppress
+from datetime import date, datetime, timedelta
+from typing import Any
+
+from homeassistant.core import HomeAssistant
+from homeassistant.exceptions import HomeAssistantError
+
+from .const import ARCHIVE_FILENAME
+from .store import MessageRecord, format_timestamp, parse_timestamp
+
+_LOGGER = logging.getLogger(__name__)
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY,
+        subject TEXT,
+        sender TEXT,
+        timestamp TEXT,
+        unread INTEGER NOT NULL DEFAULT 0,
+        body TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS messages_timestamp ON messages (timestamp)",
+    # Diacritics are folded, so "retkipaiva" also finds "retkipäivä"
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 (
+        subject, sender, body,
+        content='messages', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts (rowid, subject, sender, body)
+        VALUES (new.id, new.subject, new.sender, new.body);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, subject, sender, body)
+        VALUES ('delete', old.id, old.subject, old.sender, old.body);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, subject, sender, body)
+        VALUES ('delete', old.id, old.subject, old.sender, old.body);
+        INSERT INTO messages_fts (rowid, subject, sender, body)
+        VALUES (new.id, new.subject, new.sender, new.body);
+    END
+    """,
+)
+
+_UPSERT = """
+    INSERT INTO messages (id, subject, sender, timestamp, unread, body)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (id) DO UPDATE SET
+        subject = excluded.subject,
+        sender = excluded.sender,
+        timestamp = excluded.timestamp,
+        unread = excluded.unread,
+        body = excluded.body
+    WHERE messages.body IS NOT excluded.body
+        OR messages.unread IS NOT excluded.unread
+"""
+
+
+class ArchiveError(HomeAssistantError):
+    """Error raised when the archive cannot be queried."""
+
+
+class InvalidSearchQuery(ArchiveError):
+    """Error raised for a search query SQLite cannot parse."""
+
+
+def _row(message: MessageRecord, markdown: str | None) -> tuple[Any, ...]:
+    """Return the archive row of a stored message."""
+    return (
+        message.id,
+        message.subject,
+        message.sender,
+        format_timestamp(message.timestamp),
+        int(message.unread),
+        markdown,
+    )
+
+
+class WilmaMessageArchive:
+    """SQLite FTS5 index over the subject, sender and body of messages.
+
+    The database is opened with a single connection that is only used from
+    executor jobs, one at a time, so queries never block the event loop.
+    """
+
+    def __init__(self, hass: HomeAssistant, entry_id: str) -> None:
+        """Initialize the archive."""
+        self._hass = hass
+        self.path = archive_path(hass, entry_id)
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+
+    def _open(self) -> None:
+        """Open the database and create the schema."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        with conn:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+        self._conn = conn
+        _LOGGER.debug("Opened message archive %s", self.path)
+
+    def _close(self) -> None:
+        """Close the database."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    @property
+    def _connection(self) -> sqlite3.Connection:
+        """Return the open database connection."""
+        if self._conn is None:
+            raise ArchiveError("The message archive is not open")
+        return self._conn
+
+    def _missing(self, message_ids: list[int]) -> list[int]:
+        """Return the ids that are not indexed yet."""
+        with self._lock:
+            rows = self._connection.execute("SELECT id FROM messages")
+            indexed = {row[0] for row in rows}
+        return [message_id for message_id in message_ids if message_id not in indexed]
+
+    def _timestamp(self, message_id: int) -> tuple[str | None] | None:
+        """Return the timestamp row of a message, None if it is not indexed."""
+        with self._lock:
+            return self._connection.execute(
+                "SELECT timestamp FROM messages WHERE id = ?", (message_id,)
+            ).fetchone()
+
+    def _timestamps(self, message_ids: list[int]) -> list[tuple[int, str | None]]:
+        """Return the id and timestamp rows of the indexed messages of ids."""
+        with self._lock:
+            return [
+                (message_id, row[0])
+                for message_id in message_ids
+                if (
+                    row := self._connection.execute(
+                        "SELECT timestamp FROM messages WHERE id = ?", (message_id,)
+                    ).fetchone()
+                )
+                is not None
+            ]
+
+    def _index(self, rows: list[tuple[Any, ...]]) -> None:
+        """Insert or update messages in one transaction."""
+        with self._lock, self._connection as conn:
+            conn.executemany(_UPSERT, rows)
+
+    def _set_unread(self, rows: list[tuple[int, int, int]]) -> None:
+        """Update the read state of messages in one transaction."""
+        with self._lock, self._connection as conn:
+            conn.executemany(
+                "UPDATE messages SET unread = ? WHERE id = ? AND unread IS NOT ?",
+                rows,
+            )
+
+    def _search(
+        self,
+        query: str | None,
+        sender: str | None,
+        start: date | None,
+        end: date | None,
+        limit: int,
+        offset: int,
+    ) -> dict[str, Any]:
+        """Run a search, newest matches first."""
+        where = []
+        params: list[Any] = []
+        if query:
+            where.append("messages_fts MATCH ?")
+            params.append(query)
+        if sender:
+            where.append("m.sender LIKE ?")
+            params.append(f"%{sender}%")
+        # Timestamps are stored as "YYYY-MM-DD HH:MM", so they sort as text
+        if start:
+            where.append("m.timestamp >= ?")
+            params.append(start.isoformat())
+        if end:
+            where.append("m.timestamp < ?")
+            params.append((end + timedelta(days=1)).isoformat())
+
+        source = "messages AS m"
+        snippet = "NULL"
+        if query:
+            source = "messages_fts JOIN messages AS m ON m.id = messages_fts.rowid"
+            snippet = "snippet(messages_fts, 2, '**', '**', '…', 16)"
+        clause = f"WHERE {' AND '.join(where)}" if where else ""
+
+        with self._lock:
+            try:
+                total = self._connection.execute(
+                    f"SELECT COUNT(*) FROM {source} {clause}", params
+                ).fetchone()[0]
+                rows = self._connection.execute(
+                    f"""
+                    SELECT m.id, m.subject, m.sender, m.timestamp, m.unread,
+                        {snippet} AS snippet
+                    FROM {source} {clause}
+                    ORDER BY m.timestamp DESC, m.id DESC
+                    LIMIT ? OFFSET ?
+                    """,
+                    [*params, limit, offset],
+                ).fetchall()
+            except sqlite3.OperationalError as err:
+                if query:
+                    raise InvalidSearchQuery(str(err)) from err
+                raise ArchiveError(str(err)) from err
+
+        return {
+            "total": total,
+            "offset": offset,
+            "messages": [
+                {
+                    "id": row["id"],
+                    "subject": row["subject"],
+                    "sender": row["sender"],
+                    "timestamp": row["timestamp"],
+                    "unread": bool(row["unread"]),
+                    "snippet": row["snippet"],
+                }
+                for row in rows
+            ],
+        }
+
+    async def async_open(self) -> None:
+        """Open the archive database."""
+        await self._hass.async_add_executor_job(self._open)
+
+    async def async_close(self) -> None:
+        """Close the archive database."""
+        await self._hass.async_add_executor_job(self._close)
+
+    async def async_missing(self, message_ids: Iterable[int]) -> list[int]:
+        """Return the ids of messages that are not indexed yet."""
+        return await self._hass.async_add_executor_job(self._missing, list(message_ids))
+
+    async def async_timestamp(self, message_id: int) -> datetime | None:
+        """Return the timestamp of an indexed message, None if it is not indexed.
+
+        Messages without a timestamp have datetime.min, like their sort key.
+        """
+        row = await self._hass.async_add_executor_job(self._timestamp, message_id)
+        return None if row is None else parse_timestamp(row[0])
+
+    async def async_timestamps(self, message_ids: Iterable[int]) -> dict[int, datetime]:
+        """Return the timestamps of the indexed messages among ids, by id."""
+        if not (message_ids := list(message_ids)):
+            return {}
+        rows = await self._hass.async_add_executor_job(self._timestamps, message_ids)
+        return {message_id: parse_timestamp(value) for message_id, value in rows}
+
+    async def async_index(
+        self, messages: Iterable[MessageRecord], markdown: Mapping[int, str]
+    ) -> None:
+        """Index messages, updating ones whose body or read state changed."""
+        if rows := [_row(message, markdown.get(message.id)) for message in messages]:
+            await self._hass.async_add_executor_job(self._index, rows)
+
+    async def async_set_unread(self, states: Mapping[int, bool]) -> None:
+        """Update the read state of indexed messages, by message id."""
+        if rows := [
+            (int(unread), message_id, int(unread))
+            for message_id, unread in states.items()
+        ]:
+            await self._hass.async_add_executor_job(self._set_unread, rows)
+
+    async def async_search(
+        self,
+        query: str | None = None,
+        sender: str | None = None,
+        start: date | None = None,
+        end: date | None = None,
+        limit: int = 20,
+        offset: int = 0,
+    ) -> dict[str, Any]:
+        """Search the archive, returning one page of matches and the total."""
+        return await self._hass.async_add_executor_job(
+            self._search, query, sender, start, end, limit, offset
+        )
+
+
+def archive_path(hass: HomeAssistant, entry_id: str) -> str:
+    """Return the database path of a config entry."""
+    return hass.config.path(".storage", ARCHIVE_FILENAME.format(entry_id=entry_id))
+
+
+async def async_remove_archive(hass: HomeAssistant, entry_id: str) -> None:
+    """Delete the archive of a removed config entry."""
+
+    def _remove() -> None:
+        with suppress(FileNotFoundError):
+            os.unlink(archive_path(hass, entry_id))
+
+    await hass.async_add_executor_job(_remove)
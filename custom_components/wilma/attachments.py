@@ -0,0 +1,316 @@
+"""Files linked from Wilma messages, cached on disk and served to the frontend."""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from html.parser import HTMLParser
+from http import HTTPStatus
+from typing import TYPE_CHECKING, Any
+from urllib.parse import quote
+
+from aiohttp import hdrs, web
+from homeassistant.components.http import KEY_HASS, HomeAssistantView
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.storage import STORAGE_DIR, Store
+from yarl import URL
+
+from .const import (
+    ATTACHMENT_CACHE_SIZE,
+    ATTACHMENT_DIRECTORY,
+    ATTACHMENT_MAX_SIZE,
+    ATTACHMENT_PATH_MARKERS,
+    ATTACHMENT_STORAGE_KEY,
+    ATTACHMENT_STORAGE_VERSION,
+    ATTACHMENT_URL,
+    DATA_ATTACHMENTS,
+    STORAGE_SAVE_DELAY,
+)
+
+if TYPE_CHECKING:
+    from wilhelmina import WilmaClient
+
+_LOGGER = logging.getLogger(__name__)
+
+# Content addressed files never change, browsers may keep them for a year
+CACHE_CONTROL = "private, max-age=31536000, immutable"
+# Types shown in the browser. Any other file, such as an SVG image that can
+# run script in the origin of Home Assistant, is downloaded as plain bytes
+INLINE_CONTENT_TYPES = frozenset(
+    {
+        "application/pdf",
+        "image/bmp",
+        "image/gif",
+        "image/jpeg",
+        "image/png",
+        "image/webp",
+    }
+)
+
+
+class _LinkParser(HTMLParser):
+    """Collect the targets of the links and images of a message body."""
+
+    def __init__(self) -> None:
+        """Initialize the parser."""
+        super().__init__()
+        self.links: list[tuple[str, str]] = []
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        """Record the target of an image or a link."""
+        attributes = dict(attrs)
+        if tag == "img" and (src := attributes.get("src")):
+            self.links.append((tag, src))
+        elif tag == "a" and (href := attributes.get("href")):
+            self.links.append((tag, href))
+
+
+def attachment_links(content_html: str, server_url: str) -> list[str]:
+    """Return the Wilma URLs of the files a message body links or shows.
+
+    Images on the Wilma server are always files. Links on the Wilma server
+    count only if their path looks like a file download, the other links
+    lead to Wilma pages.
+    """
+    parser = _LinkParser()
+    parser.feed(content_html)
+    base = URL(server_url.rstrip("/") + "/")
+    urls = []
+    for tag, target in parser.links:
+        try:
+            url = base.join(URL(target.strip()))
+        except ValueError:
+            continue
+        if url.host != base.host or url.scheme not in ("http", "https"):
+            continue
+        if tag == "a" and not any(
+            marker in url.path.lower() for marker in ATTACHMENT_PATH_MARKERS
+        ):
+            continue
+        if (text := str(url.with_fragment(None))) not in urls:
+            urls.append(text)
+    return urls
+
+
+def _write_file(path: str, body: bytes | bytearray) -> None:
+    """Write a downloaded file, run in the executor."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        return
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(body)
+    os.replace(temp_path, path)
+
+
+def _remove_files(paths: list[str]) -> None:
+    """Remove evicted files, run in the executor."""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class WilmaAttachmentCache:
+    """Files linked from messages, stored once by content digest.
+
+    Every linked URL of an account is downloaded once with the session of
+    the account, and the file is stored under its SHA-256 digest, so a file
+    linked from several messages or accounts is kept once. The index of the
+    files is kept in least recently used order and the oldest files are
+    removed when the files together grow past ATTACHMENT_CACHE_SIZE.
+    """
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        """Initialize the cache."""
+        self._hass = hass
+        self.path = hass.config.path(STORAGE_DIR, ATTACHMENT_DIRECTORY)
+        self._store: Store[dict[str, Any]] = Store(
+            hass, ATTACHMENT_STORAGE_VERSION, ATTACHMENT_STORAGE_KEY
+        )
+        self._files: OrderedDict[str, dict[str, Any]] = OrderedDict()
+        self._sources: dict[str, str] = {}
+        self._load_lock = asyncio.Lock()
+        self._fetch_lock = asyncio.Lock()
+        self._loaded = False
+        self.size = 0
+
+    async def async_load(self) -> None:
+        """Load the index of the cached files once."""
+        async with self._load_lock:
+            if self._loaded:
+                return
+            data = await self._store.async_load() or {}
+            for file in data.get("files", []):
+                self._files[file["digest"]] = file
+                self.size += file["size"]
+            self._sources = {
+                source: digest
+                for source, digest in data.get("sources", {}).items()
+                if digest in self._files
+            }
+            self._loaded = True
+
+    def file_path(self, digest: str) -> str:
+        """Return the path of a cached file."""
+        return os.path.join(self.path, digest)
+
+    @staticmethod
+    def _source(entry_id: str, url: str) -> str:
+        """Return the index key of a URL of an account."""
+        return f"{entry_id} {url}"
+
+    def lookup(self, entry_id: str, url: str) -> str | None:
+        """Return the digest of the cached file of a URL, if it was downloaded."""
+        return self._sources.get(self._source(entry_id, url))
+
+    @callback
+    def async_use(self, digest: str) -> dict[str, Any] | None:
+        """Return a cached file by digest, marking it recently used."""
+        if (file := self._files.get(digest)) is None:
+            return None
+        self._files.move_to_end(digest)
+        self._schedule_save()
+        return file
+
+    async def async_fetch(
+        self, client: WilmaClient, entry_id: str, url: str
+    ) -> str | None:
+        """Download the file of a URL unless it is cached, returning its digest.
+
+        Wilma pages and files larger than ATTACHMENT_MAX_SIZE are not cached.
+        """
+        source = self._source(entry_id, url)
+        async with self._fetch_lock:
+            if (digest := self._sources.get(source)) is not None:
+                return digest
+            response = await client._authenticated_request(URL(url).raw_path_qs)
+            try:
+                if response.content_type == "text/html":
+                    _LOGGER.debug("Not caching %s, it is a Wilma page", url)
+                    return None
+                if (response.content_length or 0) > ATTACHMENT_MAX_SIZE:
+                    _LOGGER.debug("Not caching %s, it is too large", url)
+                    return None
+                body = bytearray()
+                async for chunk in response.content.iter_chunked(65536):
+                    body += chunk
+                    if len(body) > ATTACHMENT_MAX_SIZE:
+                        _LOGGER.debug("Not caching %s, it is too large", url)
+                        return None
+            finally:
+                response.release()
+            digest = hashlib.sha256(body).hexdigest()
+            if digest not in self._files:
+                await self._hass.async_add_executor_job(
+                    _write_file, self.file_path(digest), body
+                )
+                self._files[digest] = {
+                    "digest": digest,
+                    "size": len(body),
+                    "content_type": response.content_type,
+                    "name": os.path.basename(URL(url).path) or digest,
+                }
+                self.size += len(body)
+                _LOGGER.debug("Cached %s bytes from %s", len(body), url)
+            self._files.move_to_end(digest)
+            self._sources[source] = digest
+            await self._async_evict()
+            self._schedule_save()
+            return digest
+
+    async def _async_evict(self) -> None:
+        """Remove the least recently used files until the cache fits its size."""
+        evicted = []
+        while self.size > ATTACHMENT_CACHE_SIZE and len(self._files) > 1:
+            digest, file = self._files.popitem(last=False)
+            self.size -= file["size"]
+            evicted.append(digest)
+        if not evicted:
+            return
+        self._forget(set(evicted))
+        await self._hass.async_add_executor_job(
+            _remove_files, [self.file_path(digest) for digest in evicted]
+        )
+        _LOGGER.debug("Evicted %s cached files", len(evicted))
+
+    def _forget(self, digests: set[str]) -> None:
+        """Drop the URLs pointing to removed files."""
+        self._sources = {
+            source: digest
+            for source, digest in self._sources.items()
+            if digest not in digests
+        }
+
+    async def async_remove_entry(self, entry_id: str) -> None:
+        """Remove the files that only a deleted config entry linked."""
+        await self.async_load()
+        prefix = f"{entry_id} "
+        self._sources = {
+            source: digest
+            for source, digest in self._sources.items()
+            if not source.startswith(prefix)
+        }
+        linked = set(self._sources.values())
+        removed = [digest for digest in self._files if digest not in linked]
+        for digest in removed:
+            self.size -= self._files.pop(digest)["size"]
+        if removed:
+            await self._hass.async_add_executor_job(
+                _remove_files, [self.file_path(digest) for digest in removed]
+            )
+        self._schedule_save()
+
+    def _schedule_save(self) -> None:
+        """Write the index after the save delay."""
+        self._store.async_delay_save(self._data, STORAGE_SAVE_DELAY)
+
+    def _data(self) -> dict[str, Any]:
+        """Return the index in storage form, least recently used first."""
+        return {"files": list(self._files.values()), "sources": self._sources}
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the size of the cache in diagnostics form."""
+        return {"files": len(self._files), "bytes": self.size}
+
+
+@callback
+def async_get_attachment_cache(hass: HomeAssistant) -> WilmaAttachmentCache:
+    """Return the attachment cache shared by all Wilma config entries."""
+    if (cache := hass.data.get(DATA_ATTACHMENTS)) is None:
+        cache = hass.data[DATA_ATTACHMENTS] = WilmaAttachmentCache(hass)
+    return cache
+
+
+class WilmaAttachmentView(HomeAssistantView):
+    """Serve cached attachments to authenticated users."""
+
+    url = ATTACHMENT_URL.format(digest="{digest}")
+    name = "api:wilma:attachment"
+    requires_auth = True
+
+    async def get(self, request: web.Request, digest: str) -> web.StreamResponse:
+        """Return a cached file, honoring range and conditional requests."""
+        cache = async_get_attachment_cache(request.app[KEY_HASS])
+        await cache.async_load()
+        if (file := cache.async_use(digest)) is None:
+            return web.Response(status=HTTPStatus.NOT_FOUND)
+        if (content_type := file["content_type"]) in INLINE_CONTENT_TYPES:
+            disposition = "inline"
+        else:
+            content_type, disposition = "application/octet-stream", "attachment"
+        return web.FileResponse(
+            cache.file_path(digest),
+            headers={
+                hdrs.CACHE_CONTROL: CACHE_CONTROL,
+                hdrs.CONTENT_TYPE: content_type,
+                hdrs.CONTENT_DISPOSITION: (
+                    f"{disposition}; filename*=UTF-8''{quote(file['name'])}"
+                ),
+                "X-Content-Type-Options": "nosniff",
+            },
+        )
@@ -0,0 +1,192 @@
+"""Background download of the message history older than the first sync."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Any
+
+import aiohttp
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
+
+from .client import async_import_wilhelmina
+from .const import (
+    BACKFILL_BATCH_SIZE,
+    BACKFILL_REQUEST_INTERVAL,
+    BACKFILL_STORAGE_KEY,
+    BACKFILL_STORAGE_VERSION,
+    DOMAIN,
+)
+from .roles import WilmaRole, async_list_messages, async_list_role_messages
+from .store import MessageRecord
+
+if TYPE_CHECKING:
+    from wilhelmina import Message
+
+    from .coordinator import WilmaCoordinator
+    from .store import WilmaMessageStore
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _backfill_store(hass: HomeAssistant, entry_id: str) -> Store[dict[str, Any]]:
+    """Return the store of the backfill progress of a config entry."""
+    return Store(hass, BACKFILL_STORAGE_VERSION, f"{BACKFILL_STORAGE_KEY}_{entry_id}")
+
+
+async def async_remove_backfill(hass: HomeAssistant, entry_id: str) -> None:
+    """Remove the backfill progress of a deleted config entry."""
+    await _backfill_store(hass, entry_id).async_remove()
+
+
+class WilmaBackfill:
+    """Resumable download of the messages the polls never reach.
+
+    The first poll only imports the last week. The backfill lists the
+    messages of every role that are older than the sync watermark and not
+    stored yet, and fetches their bodies newest first, one batch at a time,
+    at most one request per BACKFILL_REQUEST_INTERVAL. Every batch is written
+    to the message store before the next one starts, so the store itself is
+    the checkpoint: a backfill interrupted by a restart lists the history
+    again and continues with the messages still missing. Only the headers and
+    the bodies of one batch are held beyond what the store keeps.
+    """
+
+    def __init__(self, hass: HomeAssistant, coordinator: WilmaCoordinator) -> None:
+        """Initialize the backfill."""
+        self._hass = hass
+        self._coordinator = coordinator
+        self._store = _backfill_store(hass, coordinator.entry_id)
+        self._task: asyncio.Task | None = None
+        self._last_request = 0.0
+        self.state: dict[str, Any] = {"active": False}
+
+    @property
+    def running(self) -> bool:
+        """Return True while the backfill task runs."""
+        return self._task is not None and not self._task.done()
+
+    async def async_resume(self, entry: ConfigEntry) -> None:
+        """Continue a backfill that was running when Home Assistant stopped."""
+        self.state = await self._store.async_load() or {"active": False}
+        if self.state.get("active"):
+            _LOGGER.debug("Resuming the message backfill of %s", entry.title)
+            self.async_start(entry)
+
+    @callback
+    def async_start(self, entry: ConfigEntry) -> bool:
+        """Start the backfill in the background, returning False if it runs."""
+        if self.running:
+            return False
+        if not self.state.get("active"):
+            self.state = {
+                "active": True,
+                "started": dt_util.utcnow().isoformat(),
+                "fetched": 0,
+                "remaining": None,
+            }
+        self._task = entry.async_create_background_task(
+            self._hass, self._async_run(), f"{DOMAIN} backfill {entry.entry_id}"
+        )
+        return True
+
+    async def _async_run(self) -> None:
+        """Backfill every role of the account."""
+        wilhelmina = await async_import_wilhelmina(self._hass)
+        await self._store.async_save(self.state)
+        try:
+            self._coordinator.governor.check()
+            await self._coordinator.async_ensure_client()
+            missing = [
+                (role, store, await self._async_list_missing(role, store))
+                for role, store in self._coordinator.stores()
+            ]
+            self.state["remaining"] = sum(len(messages) for _, _, messages in missing)
+            for role, store, messages in missing:
+                for start in range(0, len(messages), BACKFILL_BATCH_SIZE):
+                    await self._async_backfill_batch(
+                        role, store, messages[start : start + BACKFILL_BATCH_SIZE]
+                    )
+        except (wilhelmina.WilmaError, aiohttp.ClientError, TimeoutError) as err:
+            # The progress is kept, the next start continues from here
+            _LOGGER.warning("Message backfill stopped: %s", err)
+            return
+        self.state.update(
+            active=False, remaining=0, finished=dt_util.utcnow().isoformat()
+        )
+        await self._store.async_save(self.state)
+        _LOGGER.info(
+            "Message backfill of %s finished, %s messages fetched",
+            self._coordinator.username,
+            self.state["fetched"],
+        )
+
+    async def _async_list_missing(
+        self, role: WilmaRole | None, store: WilmaMessageStore
+    ) -> list[Message]:
+        """Return the messages of a role older than its watermark, newest first."""
+        if (cursor := store.watermark.cursor) is None:
+            # Not polled yet, the first poll imports the recent messages
+            return []
+        client = await self._coordinator.async_ensure_client()
+        cache = self._coordinator.response_cache
+        await self._async_throttle()
+        if role is None:
+            listed = await async_list_messages(client, cache, None)
+        else:
+            listed = await async_list_role_messages(client, cache, role, None)
+        older = sorted(
+            (
+                message
+                for message in listed
+                if message.timestamp and message.format_timestamp() < cursor
+            ),
+            key=lambda message: message.format_timestamp(),
+            reverse=True,
+        )
+        # Newest first, so the shards of the months are read one after another
+        return [
+            message
+            for message in older
+            if not await store.async_contains(message.id, message.format_timestamp())
+        ]
+
+    async def _async_backfill_batch(
+        self, role: WilmaRole | None, store: WilmaMessageStore, batch: list[Message]
+    ) -> None:
+        """Fetch the bodies of one batch and write it to the store."""
+        wilhelmina = await async_import_wilhelmina(self._hass)
+        records = [MessageRecord.from_message(message) for message in batch]
+        for record in records:
+            await self._async_throttle()
+            try:
+                record.content_html = await self._coordinator.async_get_body(
+                    record.id, role
+                )
+            except wilhelmina.WilmaError as err:
+                # Stored without a body, it is fetched again when it is read
+                _LOGGER.debug("Failed to fetch message %s: %s", record.id, err)
+        added = [record for record in records if store.add(record)]
+        await self._coordinator.async_index(store, added)
+        self._coordinator.async_schedule_attachments(added)
+        await store.async_apply_retention()
+        await store.async_flush()
+        self.state["fetched"] += len(added)
+        self.state["remaining"] -= len(batch)
+        await self._store.async_save(self.state)
+        _LOGGER.debug(
+            "Backfilled %s messages, %s remaining",
+            self.state["fetched"],
+            self.state["remaining"],
+        )
+
+    async def _async_throttle(self) -> None:
+        """Wait until the next request is allowed by the backfill rate."""
+        delay = self._last_request + BACKFILL_REQUEST_INTERVAL - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._last_request = time.monotonic()
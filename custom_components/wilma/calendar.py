@@ -0,0 +1,71 @@
+"""Calendar platform for the Wilma integration."""
+
+from __future__ import annotations
+
+from datetime import datetime
+
+from homeassistant.components.calendar import CalendarEntity, CalendarEvent
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
+from homeassistant.util import dt as dt_util
+
+from .const import DOMAIN
+from .entity import wilma_device_info, wilma_unique_id
+from .roles import WilmaRole
+from .schedule import EventIndex, WilmaScheduleCoordinator
+
+
+async def async_setup_entry(
+    hass: HomeAssistant, entry: ConfigEntry, async_add_entities: AddEntitiesCallback
+) -> None:
+    """Set up the Wilma schedule calendars."""
+    coordinator = hass.data[DOMAIN][entry.entry_id]
+    schedule = coordinator.schedule
+
+    async_add_entities(
+        WilmaScheduleCalendar(schedule, entry, role)
+        for role in [None, *(coordinator.roles or [])]
+    )
+
+
+class WilmaScheduleCalendar(
+    CoordinatorEntity[WilmaScheduleCoordinator], CalendarEntity
+):
+    """Calendar of the lessons and exams of one role."""
+
+    _attr_icon = "mdi:school"
+
+    def __init__(
+        self,
+        coordinator: WilmaScheduleCoordinator,
+        entry: ConfigEntry,
+        role: WilmaRole | None = None,
+    ) -> None:
+        """Initialize the calendar."""
+        super().__init__(coordinator)
+        self._role = role
+        self._attr_unique_id = wilma_unique_id(entry, "schedule", role)
+        self._attr_name = "Schedule" if role is None else f"Schedule ({role.name})"
+        self._attr_device_info = wilma_device_info(entry, role)
+
+    @property
+    def _index(self) -> EventIndex | None:
+        """Return the event index of the role of this calendar."""
+        return self.coordinator.indexes.get(self._role.slug if self._role else None)
+
+    @property
+    def event(self) -> CalendarEvent | None:
+        """Return the current or next upcoming event."""
+        if (index := self._index) is None:
+            return None
+        return index.next_event(dt_util.now())
+
+    async def async_get_events(
+        self, hass: HomeAssistant, start_date: datetime, end_date: datetime
+    ) -> list[CalendarEvent]:
+        """Return the events between two points in time."""
+        if (index := self._index) is None:
+            return []
+        return index.query(start_date, end_date)
@@ -0,0 +1,575 @@
+"""Shared Wilma clients for the Wilma integration."""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import hashlib
+import importlib
+import json
+import logging
+import sys
+import time
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from http import HTTPStatus
+from types import ModuleType
+from typing import TYPE_CHECKING, Any, TypeVar
+
+import aiohttp
+from aiohttp import hdrs
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.aiohttp_client import async_create_clientsession
+from homeassistant.helpers.storage import Store
+from yarl import URL
+
+from .const import (
+    DATA_CLIENT_POOL,
+    GOVERNOR_BURST,
+    GOVERNOR_CONCURRENCY,
+    GOVERNOR_FAILURE_THRESHOLD,
+    GOVERNOR_MAX_RESET_TIMEOUT,
+    GOVERNOR_RATE,
+    GOVERNOR_RESET_TIMEOUT,
+    SESSION_STORAGE_KEY,
+    SESSION_STORAGE_VERSION,
+)
+
+if TYPE_CHECKING:
+    from wilhelmina import WilmaClient
+
+_LOGGER = logging.getLogger(__name__)
+
+_T = TypeVar("_T")
+
+
+async def async_import_wilhelmina(hass: HomeAssistant) -> ModuleType:
+    """Return the wilhelmina library, importing it in the executor the first time.
+
+    The library and its HTML parsers are only needed once the integration
+    talks to Wilma, so setting up from the persisted messages does not wait
+    for the import. Later imports in functions are dictionary lookups.
+    """
+    if (module := sys.modules.get("wilhelmina")) is not None:
+        return module
+    return await hass.async_add_import_executor_job(
+        importlib.import_module, "wilhelmina"
+    )
+
+
+async def async_get_unread_message_ids(client: WilmaClient) -> set[int]:
+    """Return the ids of the unread messages of the logged in role.
+
+    The message list has no read state. The library finds the unread messages
+    with the private WilmaClient._get_unread_message_ids, which renders the
+    messages page in headless Chromium if Playwright is installed and returns
+    an empty set otherwise, so without Playwright every message is read. The
+    method is not public API, a library version without it gets the same
+    empty set.
+    """
+    if (get_unread := getattr(client, "_get_unread_message_ids", None)) is None:
+        _LOGGER.debug("The installed wilhelmina cannot find unread messages")
+        return set()
+    unread: set[int] = await get_unread()
+    return unread
+
+
+class WilmaTrafficCounter:
+    """Requests sent and bytes received over the session of one client."""
+
+    def __init__(self) -> None:
+        """Initialize the counter."""
+        self.requests = 0
+        self.bytes_received = 0
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """Return a trace config that counts the traffic of a session."""
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._async_on_request_start)
+        trace_config.on_response_chunk_received.append(self._async_on_chunk)
+        return trace_config
+
+    async def _async_on_request_start(
+        self,
+        session: aiohttp.ClientSession,
+        context: Any,
+        params: aiohttp.TraceRequestStartParams,
+    ) -> None:
+        """Count a request."""
+        self.requests += 1
+
+    async def _async_on_chunk(
+        self,
+        session: aiohttp.ClientSession,
+        context: Any,
+        params: aiohttp.TraceResponseChunkReceivedParams,
+    ) -> None:
+        """Count the bytes of a response body chunk."""
+        self.bytes_received += len(params.chunk)
+
+
+class WilmaHostUnavailable(aiohttp.ClientConnectionError):
+    """Request refused because the Wilma host is failing."""
+
+    def __init__(self, host: str, retry_in: float) -> None:
+        """Initialize the error."""
+        super().__init__(
+            f"Wilma server {host} is unavailable, retrying in {retry_in:.0f} seconds"
+        )
+        self.host = host
+        self.retry_in = retry_in
+
+
+class WilmaHostGovernor:
+    """Admission of the requests to one Wilma host, shared by every account on it.
+
+    Every session of the host runs its requests through the governor, which
+    caps the requests in flight, spaces them with a token bucket, and trips
+    a circuit breaker after consecutive connection errors, server errors or
+    rate limit answers. While the circuit is open requests fail right away
+    with WilmaHostUnavailable. Once the reset timeout has passed, one request
+    is let through as a probe: it closes the circuit if it succeeds and opens
+    it again, for twice as long, if it fails.
+    """
+
+    def __init__(self, host: str) -> None:
+        """Initialize the governor."""
+        self.host = host
+        self._slots = asyncio.Semaphore(GOVERNOR_CONCURRENCY)
+        self._tokens = float(GOVERNOR_BURST)
+        self._refilled = time.monotonic()
+        self._failures = 0
+        self._reset_timeout = float(GOVERNOR_RESET_TIMEOUT)
+        self._retry_at: float | None = None
+        self._probing = False
+        self.throttled = 0
+        self.rejected = 0
+
+    @property
+    def circuit_open(self) -> bool:
+        """Return True while requests to the host are refused."""
+        return self._retry_at is not None and (
+            self._probing or time.monotonic() < self._retry_at
+        )
+
+    def check(self) -> None:
+        """Raise WilmaHostUnavailable while the circuit is open."""
+        if self.circuit_open:
+            self.rejected += 1
+            assert self._retry_at is not None
+            raise WilmaHostUnavailable(
+                self.host, max(self._retry_at - time.monotonic(), 0)
+            )
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """Return a trace config that governs the requests of a session."""
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._async_on_request_start)
+        trace_config.on_request_end.append(self._async_on_request_end)
+        trace_config.on_request_exception.append(self._async_on_request_exception)
+        return trace_config
+
+    async def _async_on_request_start(
+        self,
+        session: aiohttp.ClientSession,
+        context: Any,
+        params: aiohttp.TraceRequestStartParams,
+    ) -> None:
+        """Wait for a slot and a token, or refuse the request."""
+        self.check()
+        if self._retry_at is not None:
+            # The reset timeout has passed, this request probes the host
+            self._probing = context.probe = True
+        try:
+            await self._slots.acquire()
+            context.slot = True
+            await self._async_take_token()
+        except BaseException:
+            # A request cancelled while it waits must not keep probing
+            self._release(context)
+            raise
+
+    async def _async_take_token(self) -> None:
+        """Wait until the token bucket allows another request."""
+        waited = False
+        while True:
+            now = time.monotonic()
+            self._tokens = min(
+                GOVERNOR_BURST, self._tokens + (now - self._refilled) * GOVERNOR_RATE
+            )
+            self._refilled = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            if not waited:
+                self.throttled += 1
+                waited = True
+            await asyncio.sleep((1 - self._tokens) / GOVERNOR_RATE)
+
+    async def _async_on_request_end(
+        self,
+        session: aiohttp.ClientSession,
+        context: Any,
+        params: aiohttp.TraceRequestEndParams,
+    ) -> None:
+        """Record the answer of the host."""
+        response = params.response
+        if response.status == HTTPStatus.TOO_MANY_REQUESTS:
+            retry_after = response.headers.get(hdrs.RETRY_AFTER, "")
+            self._record_failure(
+                context, float(retry_after) if retry_after.isdigit() else None
+            )
+        elif response.status >= HTTPStatus.INTERNAL_SERVER_ERROR:
+            self._record_failure(context)
+        else:
+            self._record_success(context)
+        self._release(context)
+
+    async def _async_on_request_exception(
+        self,
+        session: aiohttp.ClientSession,
+        context: Any,
+        params: aiohttp.TraceRequestExceptionParams,
+    ) -> None:
+        """Record a request that got no answer."""
+        if isinstance(params.exception, aiohttp.ClientConnectionError | TimeoutError):
+            self._record_failure(context)
+        self._release(context)
+
+    def _release(self, context: Any) -> None:
+        """Free the slot of a finished request, once."""
+        if getattr(context, "probe", False):
+            self._probing = context.probe = False
+        if getattr(context, "slot", False):
+            context.slot = False
+            self._slots.release()
+
+    def _record_success(self, context: Any) -> None:
+        """Close the circuit after an answer from the host."""
+        if self._retry_at is not None:
+            _LOGGER.info("Wilma server %s is answering again", self.host)
+        self._failures = 0
+        self._retry_at = None
+        self._reset_timeout = float(GOVERNOR_RESET_TIMEOUT)
+
+    def _record_failure(self, context: Any, retry_after: float | None = None) -> None:
+        """Count a failed request and open the circuit when the host is down."""
+        self._failures += 1
+        if getattr(context, "probe", False):
+            # Still down, wait twice as long for the next probe
+            self._reset_timeout = min(
+                self._reset_timeout * 2, GOVERNOR_MAX_RESET_TIMEOUT
+            )
+        elif self._retry_at is not None or (
+            retry_after is None and self._failures < GOVERNOR_FAILURE_THRESHOLD
+        ):
+            # Sent before the circuit opened, or not enough failures yet
+            return
+        else:
+            _LOGGER.warning(
+                "Wilma server %s is not answering, pausing requests", self.host
+            )
+        timeout = self._reset_timeout if retry_after is None else retry_after
+        self._retry_at = time.monotonic() + timeout
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the state of the governor in diagnostics form."""
+        return {
+            "circuit_open": self.circuit_open,
+            "consecutive_failures": self._failures,
+            "reset_timeout": self._reset_timeout,
+            "throttled": self.throttled,
+            "rejected": self.rejected,
+        }
+
+
+@dataclass
+class CachedResponse:
+    """Validators, digest and parsed payload of one cached response."""
+
+    etag: str | None
+    last_modified: str | None
+    digest: bytes
+    value: Any
+
+
+class WilmaResponseCache:
+    """Conditional GET requests with the parsed payloads cached per path.
+
+    Requests repeat the ETag and Last-Modified validators of the cached
+    response, so a server that supports them answers an unchanged resource
+    with an empty 304. Servers that do not still send the full body, but a
+    body with the digest of the cached one is not parsed again. Either way
+    the cached parsed value is returned, and callers must not mutate it.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the cache."""
+        self._entries: dict[str, CachedResponse] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def async_get(
+        self, client: WilmaClient, path: str, parse: Callable[[bytes], _T]
+    ) -> _T:
+        """Return the parsed JSON payload of a path, parsing it only if changed."""
+        headers = {}
+        if (entry := self._entries.get(path)) is not None:
+            if entry.etag is not None:
+                headers[hdrs.IF_NONE_MATCH] = entry.etag
+            if entry.last_modified is not None:
+                headers[hdrs.IF_MODIFIED_SINCE] = entry.last_modified
+        response = await client._authenticated_request(path, headers=headers)
+        if response.status == HTTPStatus.NOT_MODIFIED and entry is not None:
+            response.release()
+            self.hits += 1
+            return entry.value  # type: ignore[no-any-return]
+        if response.content_type != "application/json":
+            # Wilma answers a rejected session with its HTML login page
+            response.release()
+            raise aiohttp.ContentTypeError(
+                response.request_info,
+                response.history,
+                status=response.status,
+                message=f"Unexpected content type {response.content_type}",
+                headers=response.headers,
+            )
+        body = await response.read()
+        digest = hashlib.blake2b(body, digest_size=16).digest()
+        etag = response.headers.get(hdrs.ETAG)
+        last_modified = response.headers.get(hdrs.LAST_MODIFIED)
+        if entry is not None and entry.digest == digest:
+            entry.etag, entry.last_modified = etag, last_modified
+            self.hits += 1
+            return entry.value  # type: ignore[no-any-return]
+        value = parse(body)
+        self._entries[path] = CachedResponse(etag, last_modified, digest, value)
+        self.misses += 1
+        return value
+
+    async def async_changed(
+        self, client: WilmaClient, path: str, parse: Callable[[bytes], Any]
+    ) -> bool:
+        """Request a path and return True if its payload changed or was not cached.
+
+        The new payload is cached, so the next async_get of the path is a hit.
+        """
+        cached = self._entries.get(path)
+        await self.async_get(client, path, parse)
+        return self._entries[path] is not cached
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the cache statistics in diagnostics form."""
+        return {"paths": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class WilmaClientPool:
+    """Reference counted WilmaClient instances keyed by server URL and username.
+
+    Every client gets its own cookie jar, so accounts on the same Wilma host
+    never see each other's session cookies, but all of them run on Home
+    Assistant's shared connector and reuse its keep-alive connections, and
+    their requests go through the governor of the host.
+    """
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        """Initialize the pool."""
+        self._hass = hass
+        self._clients: dict[tuple[str, str], WilmaClient] = {}
+        self._sessions: dict[tuple[str, str], aiohttp.ClientSession] = {}
+        self._refs: dict[tuple[str, str], int] = {}
+        self._traffic: dict[tuple[str, str], WilmaTrafficCounter] = {}
+        # Kept after the clients are closed, a reload does not reset a circuit
+        self._governors: dict[str, WilmaHostGovernor] = {}
+
+    @staticmethod
+    def _key(server_url: str, username: str) -> tuple[str, str]:
+        """Return the pool key for an account."""
+        return server_url.rstrip("/").lower(), username
+
+    @callback
+    def async_acquire(self, server_url: str, username: str) -> WilmaClient:
+        """Return the shared client for an account, creating it if needed.
+
+        The wilhelmina library must be imported, see async_import_wilhelmina.
+        """
+        from wilhelmina import WilmaClient
+
+        key = self._key(server_url, username)
+        if (client := self._clients.get(key)) is None:
+            session = async_create_clientsession(
+                self._hass,
+                auto_cleanup=False,
+                cookie_jar=aiohttp.CookieJar(),
+                trace_configs=[
+                    self.governor(server_url).trace_config(),
+                    self.traffic(server_url, username).trace_config(),
+                ],
+            )
+            client = WilmaClient(server_url, session=session)
+            self._clients[key] = client
+            self._sessions[key] = session
+            _LOGGER.debug("Created Wilma client for %s at %s", username, server_url)
+        self._refs[key] = self._refs.get(key, 0) + 1
+        return client
+
+    @asynccontextmanager
+    async def async_private_client(
+        self, server_url: str
+    ) -> AsyncIterator[WilmaClient]:
+        """Yield a new client outside the pool, closing it afterwards.
+
+        Checking credentials must not log in again on the shared client of a
+        configured account, the running entry relies on its session. The
+        requests of the private client still go through the governor of the
+        host. The wilhelmina library must be imported.
+        """
+        from wilhelmina import WilmaClient
+
+        session = async_create_clientsession(
+            self._hass,
+            auto_cleanup=False,
+            cookie_jar=aiohttp.CookieJar(),
+            trace_configs=[self.governor(server_url).trace_config()],
+        )
+        client = WilmaClient(server_url, session=session)
+        try:
+            yield client
+        finally:
+            try:
+                await client.close()
+            finally:
+                session.detach()
+
+    @callback
+    def governor(self, server_url: str) -> WilmaHostGovernor:
+        """Return the governor of the requests to the host of a server URL."""
+        host = URL(server_url).host or server_url
+        if (governor := self._governors.get(host)) is None:
+            governor = self._governors[host] = WilmaHostGovernor(host)
+        return governor
+
+    @callback
+    def traffic(self, server_url: str, username: str) -> WilmaTrafficCounter:
+        """Return the traffic counter of the client of an account."""
+        key = self._key(server_url, username)
+        if (counter := self._traffic.get(key)) is None:
+            counter = self._traffic[key] = WilmaTrafficCounter()
+        return counter
+
+    async def async_release(self, server_url: str, username: str) -> None:
+        """Release a client, closing it when it is no longer used."""
+        key = self._key(server_url, username)
+        if key not in self._refs:
+            return
+        self._refs[key] -= 1
+        if self._refs[key] > 0:
+            return
+        del self._refs[key]
+        self._traffic.pop(key, None)
+        client = self._clients.pop(key)
+        session = self._sessions.pop(key)
+        try:
+            await client.close()
+        finally:
+            # The session shares Home Assistant's connector, so detach it
+            # instead of closing the connections other clients still use
+            session.detach()
+        _LOGGER.debug("Closed Wilma client for %s at %s", username, server_url)
+
+
+@callback
+def async_get_client_pool(hass: HomeAssistant) -> WilmaClientPool:
+    """Return the client pool shared by all Wilma config entries."""
+    if (pool := hass.data.get(DATA_CLIENT_POOL)) is None:
+        pool = hass.data[DATA_CLIENT_POOL] = WilmaClientPool(hass)
+    return pool
+
+
+class WilmaSessionCache:
+    """Encrypted, persisted Wilma session for one config entry.
+
+    Holds the Wilma2SID token, the user id and the cookies of an authenticated
+    client so that a restart can skip the login round-trip. The file is
+    private and the payload is encrypted with a key derived from the account
+    password and the entry id. The password is stored in plain text in the
+    config entries under the same ``.storage`` directory, so the encryption
+    only keeps the session out of copies of this one file, such as a stray
+    backup or a diagnostics upload. Anyone who can read the whole storage
+    directory can decrypt the session, and log in with the password anyway.
+    """
+
+    def __init__(
+        self, hass: HomeAssistant, entry_id: str, username: str, password: str
+    ) -> None:
+        """Initialize the session cache."""
+        self._store: Store[dict[str, Any]] = Store(
+            hass,
+            SESSION_STORAGE_VERSION,
+            f"{SESSION_STORAGE_KEY}_{entry_id}",
+            private=True,
+        )
+        self._username = username
+        self._password = password
+        self._fernet = Fernet(
+            base64.urlsafe_b64encode(
+                HKDF(
+                    algorithm=hashes.SHA256(),
+                    length=32,
+                    salt=entry_id.encode(),
+                    info=b"wilma session",
+                ).derive(password.encode())
+            )
+        )
+        self._saved_sid: str | None = None
+
+    async def async_restore(self, client: WilmaClient) -> bool:
+        """Restore a persisted session into a client, returning True on success."""
+        data = await self._store.async_load()
+        if not data or "token" not in data:
+            return False
+        try:
+            session = json.loads(self._fernet.decrypt(data["token"].encode()))
+        except (InvalidToken, ValueError):
+            _LOGGER.debug("Discarding unreadable Wilma session for %s", self._username)
+            return False
+
+        # The client re-authenticates with these if the server rejects the session
+        client.username = self._username
+        client.password = self._password
+        client.user_id = session["user_id"]
+        client._sid = session["sid"]
+        if client.session is not None:
+            client.session.cookie_jar.update_cookies(
+                session.get("cookies", {}), URL(client.base_url)
+            )
+        self._saved_sid = session["sid"]
+        _LOGGER.debug("Restored Wilma session for %s", self._username)
+        return True
+
+    async def async_save(self, client: WilmaClient) -> None:
+        """Persist the session of a client if it changed."""
+        sid = client._sid
+        if not sid or not client.user_id or sid == self._saved_sid:
+            return
+        cookies = {}
+        if client.session is not None:
+            cookies = {
+                cookie.key: cookie.value
+                for cookie in client.session.cookie_jar.filter_cookies(
+                    URL(client.base_url)
+                ).values()
+            }
+        session = {"sid": sid, "user_id": client.user_id, "cookies": cookies}
+        token = self._fernet.encrypt(json.dumps(session).encode()).decode()
+        await self._store.async_save({"token": token})
+        self._saved_sid = sid
+
+    async def async_clear(self) -> None:
+        """Forget the persisted session."""
+        self._saved_sid = None
+        await self._store.async_remove()
@@ -3,15 +3,39 @@
 import logging
 from typing import Any, Dict, Optional
 
+import aiohttp
 import voluptuous as vol
 from homeassistant import config_entries
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
 from homeassistant.data_entry_flow import FlowResult
 from homeassistant.exceptions import HomeAssistantError
-from homeassistant.helpers.aiohttp_client import async_get_clientsession
-from wilhelmina import AuthenticationError, WilmaClient, WilmaError
-
-from .const import CONF_PASSWORD, CONF_SERVER_URL, CONF_USERNAME, DOMAIN
+from homeassistant.helpers import selector
+from wilhelmina import AuthenticationError, WilmaError
+
+from .client import async_get_client_pool
+from .const import (
+    CONF_ACTIVE_SCAN_INTERVAL,
+    CONF_BODY_FETCH_CONCURRENCY,
+    CONF_CHANGE_PROBE,
+    CONF_COMPRESS_STORAGE,
+    CONF_IDLE_SCAN_INTERVAL,
+    CONF_LEAN_ATTRIBUTES,
+    CONF_PASSWORD,
+    CONF_RETENTION_DAYS,
+    CONF_RETENTION_MESSAGES,
+    CONF_SCHOOL_DAY_END,
+    CONF_SCHOOL_DAY_START,
+    CONF_SERVER_URL,
+    CONF_USERNAME,
+    DEFAULT_ACTIVE_SCAN_INTERVAL,
+    DEFAULT_BODY_FETCH_CONCURRENCY,
+    DEFAULT_IDLE_SCAN_INTERVAL,
+    DEFAULT_RETENTION_DAYS,
+    DEFAULT_RETENTION_MESSAGES,
+    DEFAULT_SCHOOL_DAY_END,
+    DEFAULT_SCHOOL_DAY_START,
+    DOMAIN,
+)
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -29,10 +53,10 @@ async def validate_input(hass: HomeAssistant, data: Dict[str, Any]) -> Dict[str,
 
     Data has the keys from STEP_USER_DATA_SCHEMA with values provided by the user.
     """
+    pool = async_get_client_pool(hass)
     try:
-        async with WilmaClient(
-            data[CONF_SERVER_URL], session=async_get_clientsession(hass)
-        ) as client:
+        # A client of its own, the pooled client of the account may be in use
+        async with pool.async_private_client(data[CONF_SERVER_URL]) as client:
             await client.login(data[CONF_USERNAME], data[CONF_PASSWORD])
 
             # Test fetching messages
@@ -42,7 +66,7 @@ async def validate_input(hass: HomeAssistant, data: Dict[str, Any]) -> Dict[str,
     except AuthenticationError as err:
         _LOGGER.error("Authentication to Wilma failed: %s", err)
         raise InvalidAuth from err
-    except WilmaError as err:
+    except (WilmaError, aiohttp.ClientError, TimeoutError) as err:
         _LOGGER.error("Error communicating with Wilma: %s", err)
         raise CannotConnect from err
     except Exception as err:
@@ -58,6 +82,14 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
 
     VERSION = 1
 
+    @staticmethod
+    @callback
+    def async_get_options_flow(
+        config_entry: config_entries.ConfigEntry,
+    ) -> config_entries.OptionsFlow:
+        """Get the options flow for this handler."""
+        return OptionsFlowHandler()
+
     async def async_step_user(
         self, user_input: Optional[Dict[str, Any]] = None
     ) -> FlowResult:
@@ -81,6 +113,76 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         )
 
 
+class OptionsFlowHandler(config_entries.OptionsFlow):
+    """Handle Wilma options."""
+
+    async def async_step_init(
+        self, user_input: dict[str, Any] | None = None
+    ) -> config_entries.ConfigFlowResult:
+        """Manage the options."""
+        if user_input is not None:
+            return self.async_create_entry(title="", data=user_input)
+
+        options = self.config_entry.options
+        return self.async_show_form(
+            step_id="init",
+            data_schema=vol.Schema(
+                {
+                    vol.Optional(
+                        CONF_BODY_FETCH_CONCURRENCY,
+                        default=options.get(
+                            CONF_BODY_FETCH_CONCURRENCY, DEFAULT_BODY_FETCH_CONCURRENCY
+                        ),
+                    ): vol.All(vol.Coerce(int), vol.Range(min=1, max=10)),
+                    vol.Optional(
+                        CONF_ACTIVE_SCAN_INTERVAL,
+                        default=options.get(
+                            CONF_ACTIVE_SCAN_INTERVAL, DEFAULT_ACTIVE_SCAN_INTERVAL
+                        ),
+                    ): vol.All(vol.Coerce(int), vol.Range(min=5, max=240)),
+                    vol.Optional(
+                        CONF_IDLE_SCAN_INTERVAL,
+                        default=options.get(
+                            CONF_IDLE_SCAN_INTERVAL, DEFAULT_IDLE_SCAN_INTERVAL
+                        ),
+                    ): vol.All(vol.Coerce(int), vol.Range(min=5, max=1440)),
+                    vol.Optional(
+                        CONF_SCHOOL_DAY_START,
+                        default=options.get(
+                            CONF_SCHOOL_DAY_START, DEFAULT_SCHOOL_DAY_START
+                        ),
+                    ): selector.TimeSelector(),
+                    vol.Optional(
+                        CONF_SCHOOL_DAY_END,
+                        default=options.get(CONF_SCHOOL_DAY_END, DEFAULT_SCHOOL_DAY_END),
+                    ): selector.TimeSelector(),
+                    vol.Optional(
+                        CONF_LEAN_ATTRIBUTES,
+                        default=options.get(CONF_LEAN_ATTRIBUTES, False),
+                    ): bool,
+                    vol.Optional(
+                        CONF_COMPRESS_STORAGE,
+                        default=options.get(CONF_COMPRESS_STORAGE, True),
+                    ): bool,
+                    vol.Optional(
+                        CONF_CHANGE_PROBE,
+                        default=options.get(CONF_CHANGE_PROBE, True),
+                    ): bool,
+                    vol.Optional(
+                        CONF_RETENTION_DAYS,
+                        default=options.get(CONF_RETENTION_DAYS, DEFAULT_RETENTION_DAYS),
+                    ): vol.All(vol.Coerce(int), vol.Range(min=30, max=3650)),
+                    vol.Optional(
+                        CONF_RETENTION_MESSAGES,
+                        default=options.get(
+                            CONF_RETENTION_MESSAGES, DEFAULT_RETENTION_MESSAGES
+                        ),
+                    ): vol.All(vol.Coerce(int), vol.Range(min=100, max=100000)),
+                }
+            ),
+        )
+
+
 class CannotConnect(HomeAssistantError):
     """Error to indicate we cannot connect."""
 
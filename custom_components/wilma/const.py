@@ -6,8 +6,40 @@ DOMAIN = "wilma"
 CONF_USERNAME = "username"
 CONF_PASSWORD = "password"
 CONF_SERVER_URL = "server_url"
+CONF_BODY_FETCH_CONCURRENCY = "body_fetch_concurrency"
+CONF_ACTIVE_SCAN_INTERVAL = "active_scan_interval"
+CONF_IDLE_SCAN_INTERVAL = "idle_scan_interval"
+CONF_SCHOOL_DAY_START = "school_day_start"
+CONF_SCHOOL_DAY_END = "school_day_end"
+CONF_LEAN_ATTRIBUTES = "lean_attributes"
+CONF_COMPRESS_STORAGE = "compress_storage"
+CONF_CHANGE_PROBE = "change_probe"
+CONF_RETENTION_DAYS = "retention_days"
+CONF_RETENTION_MESSAGES = "retention_messages"
 
 DEFAULT_SCAN_INTERVAL = timedelta(minutes=30)
+DEFAULT_BODY_FETCH_CONCURRENCY = 3
+ROLE_FETCH_CONCURRENCY = 2
+
+# Adaptive polling, intervals in minutes
+DEFAULT_ACTIVE_SCAN_INTERVAL = 15
+DEFAULT_IDLE_SCAN_INTERVAL = 120
+DEFAULT_SCHOOL_DAY_START = "07:00:00"
+DEFAULT_SCHOOL_DAY_END = "17:00:00"
+RECENT_ACTIVITY_WINDOW = timedelta(hours=1)
+RECENT_ACTIVITY_SCAN_INTERVAL = timedelta(minutes=5)
+BACKOFF_MAX_INTERVAL = timedelta(hours=6)
+SCAN_INTERVAL_JITTER = 0.1
+
+# Cheap checks of the message lists between the polls
+PROBE_INTERVAL = timedelta(minutes=1)
+PROBE_IDLE_INTERVAL = timedelta(minutes=10)
+
+# Lesson schedule and exams
+SCHEDULE_SCAN_INTERVAL = timedelta(hours=6)
+SCHEDULE_WEEK_MAX_AGE = timedelta(days=1)
+SCHEDULE_WEEKS_AHEAD = 3
+SCHEDULE_WEEKS_BEHIND = 1
 
 ATTR_CONTENT = "content"
 ATTR_CONTENT_MARKDOWN = "content_markdown"
@@ -15,8 +47,98 @@ ATTR_SENDER = "sender"
 ATTR_SUBJECT = "subject"
 ATTR_TIMESTAMP = "timestamp"
 ATTR_ID = "id"
+ATTR_UNREAD = "unread"
+ATTR_MESSAGE_ID = "message_id"
+ATTR_CONFIG_ENTRY_ID = "config_entry_id"
+ATTR_ROLE = "role"
+ATTR_QUERY = "query"
+ATTR_START_DATE = "start_date"
+ATTR_END_DATE = "end_date"
+ATTR_LIMIT = "limit"
+ATTR_OFFSET = "offset"
+ATTR_TOP = "top"
+ATTR_ATTACHMENTS = "attachments"
+
+SERVICE_GET_MESSAGE = "get_message"
+SERVICE_SEARCH_MESSAGES = "search_messages"
+SERVICE_PROFILE_POLL = "profile_poll"
+SERVICE_BACKFILL = "backfill"
+
+EVENT_NEW_MESSAGE = f"{DOMAIN}_new_message"
 
 SENSOR_LATEST_MESSAGE = "latest_message"
+SENSOR_LATEST_UNREAD_MESSAGE = "latest_unread_message"
+SENSOR_UNREAD_MESSAGES = "unread_messages"
+SENSOR_MESSAGES_TODAY = "messages_today"
+SENSOR_SENDERS = "senders"
+SENSOR_POLL_DURATION = "poll_duration"
+SENSOR_POLL_REQUESTS = "poll_requests"
+SENSOR_POLL_BYTES = "poll_bytes"
+SENSOR_POLL_NEW_MESSAGES = "poll_new_messages"
+SENSOR_STORED_MESSAGES = "stored_messages"
+
+# Senders listed in the attributes of the senders sensor, by message count
+SENDERS_ATTRIBUTE_LIMIT = 20
+
+SIGNAL_POLLED = f"{DOMAIN}_polled_{{}}"
+
+DATA_CLIENT_POOL = f"{DOMAIN}_client_pool"
+DATA_ATTACHMENTS = f"{DOMAIN}_attachments"
+
+# Requests to one Wilma host, shared by every account on it
+GOVERNOR_CONCURRENCY = 6
+# Requests per second, and the burst the token bucket allows
+GOVERNOR_RATE = 2.0
+GOVERNOR_BURST = 10
+# Consecutive failures that open the circuit, and seconds until a probe
+GOVERNOR_FAILURE_THRESHOLD = 3
+GOVERNOR_RESET_TIMEOUT = 60
+GOVERNOR_MAX_RESET_TIMEOUT = 1800
+
+# Message list of the logged in role, the client fills in the user id
+MESSAGE_LIST_PATH = "{user_id}/messages/list"
+
+MARKDOWN_CACHE_SIZE = 500
+MARKDOWN_BATCH_SIZE = 25
+# HTML bodies at least this long are kept compressed in memory
+MESSAGE_BODY_COMPRESS_MIN = 1024
 
 STORAGE_KEY = f"{DOMAIN}_messages"
-STORAGE_VERSION = 1
+STORAGE_VERSION = 2
+STORAGE_SAVE_DELAY = 30
+# Messages kept in memory, older read messages move to monthly shards
+DEFAULT_RETENTION_DAYS = 365
+DEFAULT_RETENTION_MESSAGES = 2000
+# Shards whose messages stay in memory after they were read
+SHARD_CACHE_SIZE = 2
+
+ARCHIVE_FILENAME = f"{DOMAIN}_archive_{{entry_id}}.db"
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+PROFILE_DEFAULT_TOP = 20
+PROFILE_MAX_TOP = 100
+
+SESSION_STORAGE_KEY = f"{DOMAIN}_session"
+SESSION_STORAGE_VERSION = 1
+
+ROLES_STORAGE_KEY = f"{DOMAIN}_roles"
+ROLES_STORAGE_VERSION = 1
+
+# Files linked from messages, cached on disk by content digest
+ATTACHMENT_DIRECTORY = f"{DOMAIN}_attachments"
+ATTACHMENT_STORAGE_KEY = f"{DOMAIN}_attachments"
+ATTACHMENT_STORAGE_VERSION = 1
+ATTACHMENT_URL = "/api/wilma/attachment/{digest}"
+# Bytes of all cached files, and of one file
+ATTACHMENT_CACHE_SIZE = 200 * 1024 * 1024
+ATTACHMENT_MAX_SIZE = 20 * 1024 * 1024
+# Links on the Wilma server whose path contains one of these are files
+ATTACHMENT_PATH_MARKERS = ("attachment", "/file", "/image")
+
+# History older than the first sync, fetched in the background on request
+BACKFILL_STORAGE_KEY = f"{DOMAIN}_backfill"
+BACKFILL_STORAGE_VERSION = 1
+BACKFILL_BATCH_SIZE = 25
+# Seconds between the requests of the backfill
+BACKFILL_REQUEST_INTERVAL = 2.0
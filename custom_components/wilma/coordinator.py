@@ -1,23 +1,95 @@
 """DataUpdateCoordinator for the Wilma integration."""
 
+from __future__ import annotations
+
+import asyncio
+import cProfile
 import logging
+from collections.abc import Iterable, Mapping
 from datetime import datetime
+from typing import TYPE_CHECKING, Any
 
+import aiohttp
 from homeassistant.core import HomeAssistant
-from homeassistant.helpers.storage import Store
+from homeassistant.helpers.dispatcher import async_dispatcher_send
 from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
 from homeassistant.util import dt as dt_util
-from wilhelmina import AuthenticationError, WilmaClient, WilmaError
 
+from .archive import WilmaMessageArchive
+from .attachments import async_get_attachment_cache, attachment_links
+from .backfill import WilmaBackfill
+from .client import (
+    WilmaResponseCache,
+    WilmaSessionCache,
+    async_get_client_pool,
+    async_get_unread_message_ids,
+    async_import_wilhelmina,
+)
 from .const import (
+    ATTACHMENT_URL,
+    ATTR_ATTACHMENTS,
+    ATTR_CONFIG_ENTRY_ID,
+    ATTR_ID,
+    ATTR_ROLE,
+    ATTR_SENDER,
+    ATTR_SUBJECT,
+    ATTR_TIMESTAMP,
+    CONF_BODY_FETCH_CONCURRENCY,
+    CONF_COMPRESS_STORAGE,
+    CONF_RETENTION_DAYS,
+    CONF_RETENTION_MESSAGES,
+    DEFAULT_BODY_FETCH_CONCURRENCY,
+    DEFAULT_RETENTION_DAYS,
+    DEFAULT_RETENTION_MESSAGES,
     DEFAULT_SCAN_INTERVAL,
     DOMAIN,
-    STORAGE_KEY,
-    STORAGE_VERSION,
+    EVENT_NEW_MESSAGE,
+    ROLE_FETCH_CONCURRENCY,
+    SIGNAL_POLLED,
+)
+from .probe import WilmaChangeProbe
+from .roles import (
+    WilmaRole,
+    WilmaRoleCache,
+    async_get_role_message_content,
+    async_get_roles,
+    async_list_messages,
+    async_list_role_messages,
+)
+from .schedule import WilmaScheduleCoordinator
+from .scheduler import PollScheduler
+from .store import MessageRecord, WilmaMessageStore, format_timestamp
+from .telemetry import (
+    PHASE_BODIES,
+    PHASE_CONVERT,
+    PHASE_LIST,
+    PHASE_LOGIN,
+    PHASE_PERSIST,
+    PollTelemetry,
+    write_profile,
 )
 
+if TYPE_CHECKING:
+    from wilhelmina import Message, WilmaClient
+
 _LOGGER = logging.getLogger(__name__)
 
+CHANGE_TOKENS = (
+    "revision",
+    "unread_count",
+    "messages_today",
+    "latest_id",
+    "latest_unread_id",
+)
+
+
+def _change_tokens(data: dict[str, Any]) -> tuple:
+    """Return the values that change whenever the data of any role changes."""
+    return tuple(data[key] for key in CHANGE_TOKENS), {
+        slug: tuple(role_data[key] for key in CHANGE_TOKENS)
+        for slug, role_data in data["roles"].items()
+    }
+
 
 class WilmaCoordinator(DataUpdateCoordinator):
     """Coordinator for fetching data from Wilma."""
@@ -29,6 +101,7 @@ class WilmaCoordinator(DataUpdateCoordinator):
         username: str,
         password: str,
         entry_id: str,
+        options: Mapping[str, Any] | None = None,
     ) -> None:
         """Initialize the coordinator."""
         super().__init__(
@@ -36,100 +109,612 @@ class WilmaCoordinator(DataUpdateCoordinator):
             _LOGGER,
             name=DOMAIN,
             update_interval=DEFAULT_SCAN_INTERVAL,
+            # Unchanged polls return the previous snapshot and notify no one
+            always_update=False,
         )
         self.server_url = server_url
         self.username = username
         self.password = password
         self.entry_id = entry_id
-        self.client = None
-        self.store = Store(hass, STORAGE_VERSION, f"{STORAGE_KEY}_{entry_id}")
+        self.options = options or {}
+        self.client: WilmaClient | None = None
+        # Held while acquiring and authenticating the client
+        self._client_lock = asyncio.Lock()
+        self.session_cache = WilmaSessionCache(hass, entry_id, username, password)
+        # Shared with the other accounts on the same host
+        self.governor = async_get_client_pool(hass).governor(server_url)
+        self._session_restored = False
+        # Message lists of every role, most polls find them unchanged
+        self.response_cache = WilmaResponseCache()
+        self.messages = self._message_store(entry_id)
+        self.archive = WilmaMessageArchive(hass, entry_id)
+        # Files linked from the messages, shared with the other accounts
+        self.attachments = async_get_attachment_cache(hass)
+        # Other roles of the account, discovered after the first login or
+        # restored from the role cache
+        self.roles: list[WilmaRole] | None = None
+        self.role_name: str | None = None
+        self.role_messages: dict[str, WilmaMessageStore] = {}
+        self.role_cache = WilmaRoleCache(hass, entry_id)
+        self.roles_changed = False
+        self._roles_discovered = False
+        self._role_semaphore = asyncio.Semaphore(ROLE_FETCH_CONCURRENCY)
+        self.schedule = WilmaScheduleCoordinator(hass, self)
+        self.backfill = WilmaBackfill(hass, self)
+        self.probe = WilmaChangeProbe(hass, self)
+        self.scheduler = PollScheduler(entry_id, self.options)
+        self._body_semaphore = asyncio.Semaphore(
+            self.options.get(
+                CONF_BODY_FETCH_CONCURRENCY, DEFAULT_BODY_FETCH_CONCURRENCY
+            )
+        )
         self.last_update_success_time = None
+        self.new_message_ids: list[int] = []
+        self._new_messages = 0
+        self.telemetry = PollTelemetry()
+        self._setup_done = False
 
-    async def _async_update_data(self):
-        """Fetch data from Wilma."""
-        data = await self.store.async_load() or {}
-        stored_messages = data.get("messages", [])
+    async def _async_setup(self) -> None:
+        """Load the persisted messages once, before the first refresh."""
+        if self._setup_done:
+            return
+        self._setup_done = True
+        await self.messages.async_load()
+        await self.archive.async_open()
+        await self.attachments.async_load()
+        await self._async_index_missing(self.messages)
+        await self.messages.async_apply_retention()
 
-        try:
-            if self.client is None:
-                self.client = WilmaClient(self.server_url)
-                _LOGGER.debug(
-                    f"Connecting to Wilma server {self.server_url} as {self.username}"
-                )
-                await self.client.login(self.username, self.password)
-
-            # Get the timestamp of the latest message if available
-            # Otherwise, use one week ago as default
-            after_timestamp = None
-            if stored_messages and stored_messages[0].get("timestamp"):
-                try:
-                    after_timestamp = datetime.fromisoformat(
-                        stored_messages[0]["timestamp"]
-                    )
-                    _LOGGER.debug(f"Fetching messages after: {after_timestamp}")
-                except (ValueError, TypeError) as err:
-                    _LOGGER.error(f"Error parsing timestamp: {err}")
-            else:
-                # If no stored messages, use one week ago as default
-                after_timestamp = dt_util.utcnow() - dt_util.dt.timedelta(days=7)
-                _LOGGER.debug(
-                    f"No stored messages, fetching messages from one week ago: {after_timestamp}"
-                )
-            messages = await self.client.get_messages(
-                with_content=True, after=after_timestamp
+    async def async_restore(self) -> bool:
+        """Set the data from the persisted messages, without contacting Wilma.
+
+        Returns False if nothing was persisted yet, because the account was
+        never polled successfully, and the first refresh has to poll.
+        """
+        await self._async_setup()
+        if self.messages.watermark.timestamp is None:
+            return False
+        if (cached := await self.role_cache.async_load()) is not None:
+            self.role_name, roles = cached
+        else:
+            # Set up before the role cache existed, discovery reloads if needed
+            roles = []
+        await self._async_load_roles(roles)
+        self.async_set_updated_data(await self._async_snapshot())
+        _LOGGER.debug(
+            "Restored %s messages of %s, polling Wilma in the background",
+            sum(len(store) for _, store in self.stores()),
+            self.username,
+        )
+        return True
+
+    def _message_store(self, store_id: str) -> WilmaMessageStore:
+        """Return a message store with the storage options of the entry."""
+        return WilmaMessageStore(
+            self.hass,
+            store_id,
+            compress=self.options.get(CONF_COMPRESS_STORAGE, True),
+            keep_days=self.options.get(CONF_RETENTION_DAYS, DEFAULT_RETENTION_DAYS),
+            keep_messages=self.options.get(
+                CONF_RETENTION_MESSAGES, DEFAULT_RETENTION_MESSAGES
+            ),
+        )
+
+    async def _async_index_missing(self, store: WilmaMessageStore) -> None:
+        """Index messages stored before the archive existed."""
+        missing = [
+            store.get(message_id)
+            for message_id in await self.archive.async_missing(
+                message.id for message in store.range()
             )
+        ]
+        if missing:
+            await self.async_index(store, missing)
 
-            _LOGGER.debug(f"Fetched {len(messages)} messages from Wilma")
+    async def async_index(
+        self, store: WilmaMessageStore, messages: Iterable[MessageRecord | None]
+    ) -> None:
+        """Index messages of a store in the archive, with their Markdown bodies."""
+        records = [message for message in messages if message is not None]
+        with self.telemetry.phase(PHASE_CONVERT):
+            markdown = await store.async_markdown(*records)
+        with self.telemetry.phase(PHASE_PERSIST):
+            await self.archive.async_index(records, markdown)
 
-            # Update stored messages
-            got_new_messages = False
-            for message in messages:
-                msg_dict = message.__dict__
-                # Convert datetime objects to strings for storage
-                if "timestamp" in msg_dict and isinstance(
-                    msg_dict["timestamp"], datetime
-                ):
-                    _LOGGER.debug("Converting timestamp to string")
-                    msg_dict["timestamp"] = msg_dict["timestamp"].isoformat()
+    async def _async_update_data(self):
+        """Fetch data from Wilma and schedule the next poll."""
+        self.telemetry.start(
+            async_get_client_pool(self.hass).traffic(self.server_url, self.username)
+        )
+        try:
+            data = await self._async_poll()
+        except UpdateFailed as err:
+            self.update_interval = self.scheduler.on_failure()
+            _LOGGER.debug(f"Poll failed, next poll in {self.update_interval}")
+            self._finish_poll(0, str(err))
+            raise
+        self.update_interval = self.scheduler.on_success(self._new_messages)
+        _LOGGER.debug(f"Next poll in {self.update_interval}")
+        self._finish_poll(self._new_messages)
+        if self.data and _change_tokens(self.data) == _change_tokens(data):
+            return self.data
+        return data
+
+    def _finish_poll(self, new_messages: int, error: str | None = None) -> None:
+        """Record the telemetry of a poll and tell the diagnostic sensors."""
+        stats = self.telemetry.finish(
+            new_messages, sum(len(store) for _, store in self.stores()), error
+        )
+        if stats is not None and _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug(
+                "Poll took %.3fs (%s), %s requests, %s bytes",
+                stats.duration,
+                ", ".join(f"{name} {value:.3f}s" for name, value in stats.phases.items()),
+                stats.requests,
+                stats.bytes_received,
+            )
+        async_dispatcher_send(self.hass, SIGNAL_POLLED.format(self.entry_id))
+
+    async def _async_poll(self):
+        """Fetch data from Wilma."""
+        wilhelmina = await async_import_wilhelmina(self.hass)
+        try:
+            # Fail fast while the host is down, without even logging in
+            self.governor.check()
+            with self.telemetry.phase(PHASE_LOGIN):
+                client = await self.async_ensure_client()
 
-                _LOGGER.debug("Adding markdown content to message")
-                msg_dict["content_markdown"] = message.content_markdown
-                stored_messages.append(msg_dict)
-                got_new_messages = True
+            with self.telemetry.phase(PHASE_LIST):
+                messages, unread = await self._async_list_messages(
+                    client, self._cursor(self.messages)
+                )
+            _LOGGER.debug(f"Fetched {len(messages)} message headers from Wilma")
+            if not self._roles_discovered:
+                await self._async_discover_roles(client)
+            self.new_message_ids = await self._async_merge(
+                None, self.messages, messages, unread
+            )
 
-            _LOGGER.debug(f"Stored {len(stored_messages)} messages in storage")
+            # The other roles share the client and the session of this poll
+            role_message_ids = await asyncio.gather(
+                *(self._async_poll_role(client, role) for role in self.roles or [])
+            )
 
-            # Save updated messages
-            if got_new_messages:
-                await self.store.async_save({"messages": stored_messages})
+            self._new_messages = len(self.new_message_ids) + sum(
+                len(message_ids) for message_ids in role_message_ids
+            )
 
             # Update last successful update time
             self.last_update_success_time = dt_util.utcnow()
 
-            _LOGGER.debug(f"storing messages: {stored_messages}")
-
-            return {
-                "messages": stored_messages,
-                "latest_message": stored_messages[0] if stored_messages else None,
-                "last_update": dt_util.as_local(self.last_update_success_time),
-            }
+            return await self._async_snapshot()
 
-        except AuthenticationError as err:
-            self.client = None
+        except wilhelmina.AuthenticationError as err:
+            await self.async_close_client()
+            await self.session_cache.async_clear()
             _LOGGER.error("Authentication to Wilma failed: %s", err)
             raise UpdateFailed("Authentication failed") from err
-        except WilmaError as err:
-            _LOGGER.error("Error communicating with Wilma: %s", err)
+        except (wilhelmina.WilmaError, aiohttp.ClientError, TimeoutError) as err:
+            # The coordinator logs the first failure and the recovery, an
+            # outage is not logged again on every poll
+            _LOGGER.debug("Error communicating with Wilma: %s", err)
             raise UpdateFailed(f"Error communicating with Wilma: {err}") from err
         except Exception as err:
             _LOGGER.exception("Unexpected error updating from Wilma: %s", err)
             raise UpdateFailed(f"Unexpected error: {err}") from err
 
+    def _cursor(self, store: WilmaMessageStore) -> datetime:
+        """Return the ``after`` value for the next fetch into a store."""
+        # Fetch from the sync watermark if available
+        # Otherwise, use one week ago as default
+        after_timestamp = store.watermark.cursor
+        if after_timestamp is not None:
+            _LOGGER.debug(f"Fetching messages after: {after_timestamp}")
+        else:
+            # If no stored messages, use one week ago as default
+            after_timestamp = dt_util.utcnow() - dt_util.dt.timedelta(days=7)
+            _LOGGER.debug(
+                f"No stored messages, fetching messages from one week ago: {after_timestamp}"
+            )
+        return after_timestamp
+
+    async def _async_snapshot(self) -> dict[str, Any]:
+        """Return the coordinator data of every role."""
+        return {
+            **await self._async_role_data(self.messages),
+            "roles": {
+                role.slug: {
+                    "name": role.name,
+                    **await self._async_role_data(self.role_messages[role.slug]),
+                }
+                for role in self.roles or []
+            },
+        }
+
+    async def _async_discover_roles(self, client: WilmaClient) -> None:
+        """Find the other roles of the account and load their messages."""
+        roles = await async_get_roles(client)
+        role_name = next(
+            (role.name for role in roles if role.slug == client.user_id), None
+        )
+        discovered = [role for role in roles if role.slug != client.user_id]
+        self._roles_discovered = True
+        if (role_name, discovered) != (self.role_name, self.roles):
+            await self.role_cache.async_save(role_name, discovered)
+            # Set up from restored roles, the devices of the new roles are
+            # created by setting the entry up again
+            self.roles_changed = self.roles is not None
+        self.role_name = role_name
+        await self._async_load_roles(discovered)
+
+    async def _async_load_roles(self, roles: list[WilmaRole]) -> None:
+        """Load the message stores of the other roles of the account."""
+        for role in roles:
+            if role.slug in self.role_messages:
+                continue
+            store = self._message_store(f"{self.entry_id}_{role.slug.lstrip('!')}")
+            await store.async_load()
+            await self._async_index_missing(store)
+            await store.async_apply_retention()
+            self.role_messages[role.slug] = store
+        self.roles = roles
+        if self.roles:
+            _LOGGER.debug(
+                "Polling %s other roles: %s",
+                len(self.roles),
+                ", ".join(role.name for role in self.roles),
+            )
+
+    async def _async_poll_role(self, client: WilmaClient, role: WilmaRole) -> list[int]:
+        """Fetch and merge the new messages of another role."""
+        store = self.role_messages[role.slug]
+        async with self._role_semaphore:
+            with self.telemetry.phase(PHASE_LIST):
+                messages = await async_list_role_messages(
+                    client, self.response_cache, role, self._cursor(store)
+                )
+            _LOGGER.debug(
+                f"Fetched {len(messages)} message headers for {role.name} from Wilma"
+            )
+            return await self._async_merge(role, store, messages)
+
+    async def _async_merge(
+        self,
+        role: WilmaRole | None,
+        store: WilmaMessageStore,
+        messages: list[Message],
+        unread: set[int] | None = None,
+    ) -> list[int]:
+        """Fetch the bodies of unseen messages and merge them into a store.
+
+        ``unread`` holds the ids of every unread message of the role, which
+        updates the read state of all stored messages, also of the ones older
+        than the listed messages. Without it read states are left as they are.
+        """
+        # Only fetch bodies for messages that have not been merged before. The
+        # listed messages are cached for the next polls, records are created
+        # instead of filling in their bodies
+        fresh = [
+            MessageRecord.from_message(message)
+            for message in messages
+            if not store.is_known(message.id, message.timestamp)
+        ]
+        initial_import = store.watermark.timestamp is None
+        with self.telemetry.phase(PHASE_BODIES):
+            await self._async_fetch_bodies(fresh, role)
+
+        with self.telemetry.phase(PHASE_PERSIST):
+            new_message_ids = store.merge(fresh)
+            # Read messages moved to a shard are found by their indexed timestamp
+            read_states = (
+                await store.async_apply_unread(unread, self.archive.async_timestamps)
+                if unread is not None
+                else {}
+            )
+            _LOGGER.debug(
+                f"Merged {len(new_message_ids)} new messages, "
+                f"{len(store)} messages in storage"
+            )
+
+            # Save updated messages, coalesced with other changes
+            store.async_schedule_save()
+            # Search results report the read state as well
+            await self.archive.async_set_unread(read_states)
+        await self.async_index(
+            store, (store.get(message_id) for message_id in new_message_ids)
+        )
+        self.async_schedule_attachments(
+            store.get(message_id) for message_id in new_message_ids
+        )
+        if not initial_import:
+            self._fire_new_message_events(role, store, new_message_ids)
+        with self.telemetry.phase(PHASE_PERSIST):
+            if await store.async_apply_retention():
+                store.async_schedule_save()
+        return new_message_ids
+
+    async def _async_role_data(self, store: WilmaMessageStore) -> dict[str, Any]:
+        """Return the coordinator data of one role."""
+        latest = store.latest()
+        latest_unread = await store.async_latest_unread()
+        with self.telemetry.phase(PHASE_CONVERT):
+            markdown = await store.async_markdown(latest, latest_unread)
+        return {
+            "message_count": len(store),
+            "unread_count": store.unread_count,
+            # Changes at midnight as well, so the first poll of a day updates
+            "messages_today": store.counters.on_day(dt_util.now().date()),
+            "revision": store.revision,
+            "latest_id": latest.id if latest else None,
+            "latest_unread_id": latest_unread.id if latest_unread else None,
+            "latest_message": latest,
+            "latest_unread_message": latest_unread,
+            # Renderings of the bodies of the latest messages, by message id
+            "markdown": markdown,
+        }
+
+    def _fire_new_message_events(
+        self,
+        role: WilmaRole | None,
+        store: WilmaMessageStore,
+        message_ids: list[int],
+    ) -> None:
+        """Fire one event per merged message, oldest first."""
+        messages = sorted(
+            (
+                message
+                for message_id in message_ids
+                if (message := store.get(message_id)) is not None
+            ),
+            key=lambda message: message.sort_key,
+        )
+        for message in messages:
+            self.hass.bus.async_fire(
+                EVENT_NEW_MESSAGE,
+                {
+                    ATTR_CONFIG_ENTRY_ID: self.entry_id,
+                    ATTR_ROLE: role.name if role else self.role_name,
+                    ATTR_ID: message.id,
+                    ATTR_SUBJECT: message.subject,
+                    ATTR_SENDER: message.sender,
+                    ATTR_TIMESTAMP: format_timestamp(message.timestamp),
+                },
+            )
+
+    async def async_ensure_client(self) -> WilmaClient:
+        """Acquire a client, reusing a persisted session when possible.
+
+        The client is only published once its session is restored or it is
+        logged in, callers arriving meanwhile wait for the same login.
+        """
+        if (client := self.client) is not None:
+            return client
+        async with self._client_lock:
+            if (client := self.client) is not None:
+                return client
+            await async_import_wilhelmina(self.hass)
+            pool = async_get_client_pool(self.hass)
+            client = pool.async_acquire(self.server_url, self.username)
+            try:
+                self._session_restored = await self.session_cache.async_restore(
+                    client
+                )
+                if not self._session_restored:
+                    _LOGGER.debug(
+                        f"Connecting to Wilma server {self.server_url} "
+                        f"as {self.username}"
+                    )
+                    await client.login(self.username, self.password)
+            except BaseException:
+                await pool.async_release(self.server_url, self.username)
+                raise
+            self.client = client
+            return client
+
+    async def _async_list_messages(
+        self, client: WilmaClient, after: datetime
+    ) -> tuple[list[Message], set[int]]:
+        """List message headers, without bodies, newer than a cursor.
+
+        Returns the messages and the ids of all unread messages, listed or not.
+        """
+        from wilhelmina import AuthenticationError
+
+        try:
+            messages = await async_list_messages(client, self.response_cache, after)
+        except (AuthenticationError, aiohttp.ContentTypeError):
+            if not self._session_restored:
+                raise
+            # The persisted session was rejected, fall back to a full login
+            _LOGGER.debug("Restored Wilma session rejected, logging in again")
+            self._session_restored = False
+            await client.login(self.username, self.password)
+            messages = await async_list_messages(client, self.response_cache, after)
+        self._session_restored = False
+        await self.session_cache.async_save(client)
+        unread = await async_get_unread_message_ids(client)
+        for message in messages:
+            message.unread = message.id in unread
+        return messages, unread
+
+    async def _async_fetch_body(
+        self, message_id: int, role: WilmaRole | None = None
+    ) -> str | None:
+        """Fetch the HTML body of one message."""
+        async with self._body_semaphore:
+            return await self.async_get_body(message_id, role)
+
+    async def async_get_body(
+        self, message_id: int, role: WilmaRole | None = None
+    ) -> str | None:
+        """Fetch the HTML body of one message, outside the poll's limit."""
+        client = await self.async_ensure_client()
+        if role is None:
+            full_message = await client.get_message_content(message_id)
+        else:
+            full_message = await async_get_role_message_content(
+                client, role, message_id
+            )
+        return full_message.content_html
+
+    async def _async_fetch_bodies(
+        self, messages: list[MessageRecord], role: WilmaRole | None = None
+    ) -> None:
+        """Fetch message bodies in parallel, bounded by the configured limit."""
+        if not messages:
+            return
+        results = await asyncio.gather(
+            *(self._async_fetch_body(message.id, role) for message in messages),
+            return_exceptions=True,
+        )
+        for message, result in zip(messages, results, strict=True):
+            if isinstance(result, BaseException):
+                # Leave the body empty, it is fetched again when it is read
+                _LOGGER.warning(
+                    "Failed to fetch content for message %s: %s", message.id, result
+                )
+                continue
+            message.content_html = result
+
+    def _missing_attachments(
+        self, messages: Iterable[MessageRecord | None]
+    ) -> list[str]:
+        """Return the linked files of messages that are not cached yet."""
+        return [
+            url
+            for message in messages
+            if message is not None and message.has_body
+            for url in attachment_links(message.content_html or "", self.server_url)
+            if self.attachments.lookup(self.entry_id, url) is None
+        ]
+
+    def async_schedule_attachments(
+        self, messages: Iterable[MessageRecord | None]
+    ) -> None:
+        """Download the files linked from messages in the background."""
+        if self.config_entry is None:
+            return
+        if urls := self._missing_attachments(messages):
+            self.config_entry.async_create_background_task(
+                self.hass,
+                self.async_fetch_attachments(urls),
+                f"{DOMAIN} attachments {self.entry_id}",
+            )
+
+    async def async_fetch_attachments(self, urls: list[str]) -> None:
+        """Download linked files into the attachment cache, one at a time."""
+        wilhelmina = await async_import_wilhelmina(self.hass)
+        for url in urls:
+            try:
+                self.governor.check()
+                client = await self.async_ensure_client()
+                await self.attachments.async_fetch(client, self.entry_id, url)
+            except (wilhelmina.WilmaError, aiohttp.ClientError, TimeoutError) as err:
+                # Tried again when the message is read
+                _LOGGER.debug("Failed to fetch attachment %s: %s", url, err)
+
+    def stores(self) -> list[tuple[WilmaRole | None, WilmaMessageStore]]:
+        """Return the message store of every role, the logged in role first."""
+        return [(None, self.messages)] + [
+            (role, self.role_messages[role.slug]) for role in self.roles or []
+        ]
+
+    def get_store(self, role: WilmaRole | None = None) -> WilmaMessageStore:
+        """Return the message store of the logged in role or another role."""
+        if role is None:
+            return self.messages
+        return self.role_messages[role.slug]
+
+    async def async_has_message(self, message_id: int) -> bool:
+        """Return True if any role stores a message with this id."""
+        return any(message_id in store for _, store in self.stores()) or (
+            await self.archive.async_timestamp(message_id) is not None
+        )
+
+    async def _async_get_archived(
+        self, message_id: int
+    ) -> tuple[WilmaRole | None, WilmaMessageStore, MessageRecord] | None:
+        """Find a message moved out of memory, by its timestamp in the archive."""
+        if (timestamp := await self.archive.async_timestamp(message_id)) is None:
+            return None
+        for role, store in self.stores():
+            if (message := await store.async_get_archived(message_id, timestamp)):
+                return role, store, message
+        return None
+
+    async def async_get_message(self, message_id: int) -> dict[str, Any] | None:
+        """Return a stored message, fetching its body if it is missing."""
+        for role, store in self.stores():
+            if (message := store.get(message_id)) is not None:
+                break
+        else:
+            if (archived := await self._async_get_archived(message_id)) is None:
+                return None
+            role, store, message = archived
+        if not message.has_body:
+            await self.async_ensure_client()
+            content_html = await self._async_fetch_body(message_id, role)
+            if content_html is not None:
+                if message_id in store:
+                    store.set_body(message_id, content_html)
+                    store.async_schedule_save()
+                else:
+                    message.content_html = content_html
+                    await store.async_save_archived(message)
+                await self.async_index(store, [message])
+        self.async_schedule_attachments([message])
+        markdown = await store.async_markdown(message)
+        return {
+            **message.as_dict(markdown.get(message_id)),
+            ATTR_ATTACHMENTS: [
+                {
+                    "url": url,
+                    "path": ATTACHMENT_URL.format(digest=digest)
+                    if (digest := self.attachments.lookup(self.entry_id, url))
+                    else None,
+                }
+                for url in attachment_links(
+                    message.content_html or "", self.server_url
+                )
+            ],
+        }
+
+    async def async_profile_poll(self, top: int) -> dict[str, Any]:
+        """Poll now under cProfile and write the profile to the config directory.
+
+        The profile covers everything the event loop runs during the poll,
+        not only this integration, but not the executor jobs of the poll.
+        """
+        path = self.hass.config.path(
+            f"{DOMAIN}_poll_{self.entry_id}_{dt_util.utcnow():%Y%m%d%H%M%S}.prof"
+        )
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            await self.async_refresh()
+        finally:
+            profile.disable()
+        functions = await self.hass.async_add_executor_job(
+            write_profile, profile, path, top
+        )
+        return {
+            "path": path,
+            "poll": self.telemetry.last.as_dict() if self.telemetry.last else None,
+            "functions": functions,
+        }
+
+    async def async_flush(self) -> None:
+        """Write pending message changes of all roles."""
+        for _, store in self.stores():
+            await store.async_flush()
+
     async def async_close_client(self):
-        """Close the Wilma client."""
+        """Release the Wilma client back to the shared pool."""
         if self.client:
             try:
-                await self.client.close()
+                await async_get_client_pool(self.hass).async_release(
+                    self.server_url, self.username
+                )
             except Exception as err:
                 _LOGGER.error("Error closing Wilma client: %s", err)
             finally:
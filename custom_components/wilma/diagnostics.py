@@ -0,0 +1,59 @@
+"""Diagnostics support for the Wilma integration."""
+
+from __future__ import annotations
+
+from typing import Any
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .const import CONF_PASSWORD, CONF_USERNAME, DOMAIN
+from .coordinator import WilmaCoordinator
+from .store import WilmaMessageStore
+
+TO_REDACT = {CONF_PASSWORD, CONF_USERNAME, "title", "unique_id"}
+
+
+def _store_diagnostics(store: WilmaMessageStore) -> dict[str, Any]:
+    """Return the size and sync state of a message store, without messages."""
+    return {
+        "messages": len(store),
+        "in_memory": store.in_memory,
+        "shards": store.shards,
+        "unread": store.unread_count,
+        "revision": store.revision,
+        "watermark": store.watermark.as_dict(),
+        "markdown_cache": len(store.markdown),
+    }
+
+
+async def async_get_config_entry_diagnostics(
+    hass: HomeAssistant, entry: ConfigEntry
+) -> dict[str, Any]:
+    """Return diagnostics for a config entry."""
+    coordinator: WilmaCoordinator = hass.data[DOMAIN][entry.entry_id]
+    scheduler = coordinator.scheduler
+    return {
+        "entry": async_redact_data(entry.as_dict(), TO_REDACT),
+        "telemetry": coordinator.telemetry.as_dict(),
+        "response_cache": coordinator.response_cache.as_dict(),
+        "governor": coordinator.governor.as_dict(),
+        "probe": coordinator.probe.as_dict(),
+        "backfill": coordinator.backfill.state,
+        "attachments": coordinator.attachments.as_dict(),
+        "last_update_success": coordinator.last_update_success,
+        "update_interval": str(coordinator.update_interval),
+        "scheduler": {
+            "consecutive_failures": scheduler.consecutive_failures,
+            "last_new_messages": scheduler.last_new_messages.isoformat()
+            if scheduler.last_new_messages
+            else None,
+        },
+        "store": _store_diagnostics(coordinator.messages),
+        # Role names are the names of the children, the slugs are opaque
+        "roles": {
+            role.slug: _store_diagnostics(coordinator.role_messages[role.slug])
+            for role in coordinator.roles or []
+        },
+    }
@@ -0,0 +1,36 @@
+"""Shared entity helpers for the Wilma integration."""
+
+from __future__ import annotations
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.helpers.device_registry import DeviceInfo
+
+from .const import DOMAIN
+from .roles import WilmaRole
+
+
+def wilma_device_info(entry: ConfigEntry, role: WilmaRole | None = None) -> DeviceInfo:
+    """Return the device of the logged in account, or of another role."""
+    if role is None:
+        return DeviceInfo(
+            identifiers={(DOMAIN, entry.entry_id)},
+            name=f"Wilma ({entry.data.get('username')})",
+            manufacturer="Visma",
+            model="Wilma",
+            sw_version="1.0.0",
+        )
+    return DeviceInfo(
+        identifiers={(DOMAIN, f"{entry.entry_id}_{role.slug}")},
+        name=f"Wilma ({role.name})",
+        manufacturer="Visma",
+        model="Wilma",
+        sw_version="1.0.0",
+        via_device=(DOMAIN, entry.entry_id),
+    )
+
+
+def wilma_unique_id(entry: ConfigEntry, key: str, role: WilmaRole | None = None) -> str:
+    """Return the unique id of an entity of the account or of another role."""
+    if role is None:
+        return f"{entry.entry_id}_{key}"
+    return f"{entry.entry_id}_{role.slug}_{key}"
@@ -0,0 +1,97 @@
+"""HTML to Markdown conversion for Wilma message bodies."""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable
+
+from homeassistant.core import HomeAssistant
+
+from .const import MARKDOWN_BATCH_SIZE, MARKDOWN_CACHE_SIZE
+
+_LOGGER = logging.getLogger(__name__)
+
+# The wilhelmina converter is a shared html2text instance that keeps parser
+# state, so conversions from different executor threads must not overlap
+_CONVERT_LOCK = threading.Lock()
+
+
+def content_digest(content_html: str) -> str:
+    """Return the cache key of an HTML body."""
+    return hashlib.blake2b(content_html.encode(), digest_size=16).hexdigest()
+
+
+def _convert_batch(bodies: list[str]) -> list[str]:
+    """Convert a batch of HTML bodies to Markdown, run in the executor."""
+    # Imported here, in the executor, to keep the parsers off the setup path
+    from wilhelmina.utils import html_to_markdown
+
+    with _CONVERT_LOCK:
+        return [html_to_markdown(body) for body in bodies]
+
+
+class MarkdownCache:
+    """Least recently used cache of Markdown renderings keyed by HTML digest.
+
+    Lookups happen on the event loop, misses are converted in the executor in
+    batches so that large bodies never block the loop. The cache lives in
+    memory only, renderings are converted again from the stored bodies after
+    a restart instead of being stored next to them.
+    """
+
+    def __init__(self, max_size: int = MARKDOWN_CACHE_SIZE) -> None:
+        """Initialize the cache."""
+        self._max_size = max_size
+        self._entries: OrderedDict[str, str] = OrderedDict()
+
+    def __len__(self) -> int:
+        """Return the number of cached renderings."""
+        return len(self._entries)
+
+    def get(self, content_html: str) -> str | None:
+        """Return the cached rendering of a body."""
+        return self._lookup(content_digest(content_html))
+
+    def _lookup(self, digest: str) -> str | None:
+        """Return a cached rendering by digest, marking it recently used."""
+        if (markdown := self._entries.get(digest)) is not None:
+            self._entries.move_to_end(digest)
+        return markdown
+
+    def _put(self, digest: str, markdown: str) -> None:
+        """Cache a rendering, evicting the least recently used one if full."""
+        self._entries[digest] = markdown
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    async def async_convert(
+        self, hass: HomeAssistant, bodies: Iterable[str]
+    ) -> dict[str, str]:
+        """Return the Markdown rendering of each body, keyed by the body."""
+        result: dict[str, str] = {}
+        misses: dict[str, str] = {}
+        for body in bodies:
+            if body in result:
+                continue
+            digest = content_digest(body)
+            if (markdown := self._lookup(digest)) is not None:
+                result[body] = markdown
+            else:
+                misses.setdefault(digest, body)
+
+        pending = list(misses.items())
+        for start in range(0, len(pending), MARKDOWN_BATCH_SIZE):
+            batch = pending[start : start + MARKDOWN_BATCH_SIZE]
+            converted = await hass.async_add_executor_job(
+                _convert_batch, [body for _, body in batch]
+            )
+            for (digest, body), markdown in zip(batch, converted, strict=True):
+                self._put(digest, markdown)
+                result[body] = markdown
+        if misses:
+            _LOGGER.debug("Converted %s message bodies to Markdown", len(misses))
+        return result
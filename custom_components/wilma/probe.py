@@ -0,0 +1,110 @@
+"""Frequent cheap checks for new messages between the full polls."""
+
+from __future__ import annotations
+
+import logging
+from datetime import datetime
+from typing import TYPE_CHECKING, Any
+
+import aiohttp
+from homeassistant.core import CALLBACK_TYPE, HassJob, HomeAssistant, callback
+from homeassistant.helpers.event import async_call_later
+from homeassistant.util import dt as dt_util
+
+from .client import async_import_wilhelmina
+from .const import DOMAIN
+from .roles import async_messages_changed
+
+if TYPE_CHECKING:
+    from .coordinator import WilmaCoordinator
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class WilmaChangeProbe:
+    """Request the message lists often and poll only when one of them changed.
+
+    A full poll lists the messages, looks up the unread messages, downloads
+    new bodies and rebuilds the sensor data. The probe only requests the
+    message lists through the response cache of the coordinator, which asks
+    Wilma for them conditionally and does not parse an unchanged list again,
+    and requests a poll when a list changed. The regular polls remain as a
+    slow sweep that also picks up messages read elsewhere, which do not
+    change the lists.
+    """
+
+    def __init__(self, hass: HomeAssistant, coordinator: WilmaCoordinator) -> None:
+        """Initialize the probe."""
+        self._hass = hass
+        self._coordinator = coordinator
+        self._job = HassJob(self._async_run, f"{DOMAIN} change probe")
+        self._unsub: CALLBACK_TYPE | None = None
+        self._active = False
+        self.probes = 0
+        self.changes = 0
+        self.last_change: datetime | None = None
+
+    @callback
+    def async_start(self) -> CALLBACK_TYPE:
+        """Start probing, returning a callback that stops it."""
+        self._active = True
+        self._schedule()
+        return self.async_stop
+
+    @callback
+    def async_stop(self) -> None:
+        """Stop probing."""
+        self._active = False
+        if self._unsub is not None:
+            self._unsub()
+            self._unsub = None
+
+    @callback
+    def _schedule(self) -> None:
+        """Schedule the next probe."""
+        self._unsub = async_call_later(
+            self._hass, self._coordinator.scheduler.probe_interval(), self._job
+        )
+
+    async def _async_run(self, _now: datetime) -> None:
+        """Probe and schedule the next probe, unless stopped meanwhile."""
+        self._unsub = None
+        try:
+            if await self.async_probe():
+                await self._coordinator.async_request_refresh()
+        finally:
+            if self._active:
+                self._schedule()
+
+    async def async_probe(self) -> bool:
+        """Check the message lists once, returning True if a poll is needed."""
+        coordinator = self._coordinator
+        if not coordinator.last_update_success or coordinator.governor.circuit_open:
+            # The polls back off on their own while Wilma is failing
+            return False
+        wilhelmina = await async_import_wilhelmina(self._hass)
+        self.probes += 1
+        try:
+            client = await coordinator.async_ensure_client()
+            changed = await async_messages_changed(
+                client, coordinator.response_cache, coordinator.roles or []
+            )
+        except (wilhelmina.AuthenticationError, aiohttp.ContentTypeError):
+            # The session expired, the poll logs in again
+            return True
+        except (wilhelmina.WilmaError, aiohttp.ClientError, TimeoutError) as err:
+            _LOGGER.debug("Checking for new messages failed: %s", err)
+            return False
+        if changed:
+            _LOGGER.debug("Message list of %s changed, polling", coordinator.username)
+            self.changes += 1
+            self.last_change = dt_util.utcnow()
+        return changed
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the probe statistics in diagnostics form."""
+        return {
+            "probes": self.probes,
+            "changes": self.changes,
+            "last_change": self.last_change.isoformat() if self.last_change else None,
+        }
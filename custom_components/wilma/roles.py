@@ -0,0 +1,171 @@
+"""Roles of a Wilma account."""
+
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import TYPE_CHECKING, Any
+
+import aiohttp
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+from homeassistant.util.json import json_loads_object
+
+from .const import MESSAGE_LIST_PATH, ROLES_STORAGE_KEY, ROLES_STORAGE_VERSION
+
+if TYPE_CHECKING:
+    from wilhelmina import Message, WilmaClient
+
+    from .client import WilmaResponseCache
+
+_LOGGER = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class WilmaRole:
+    """A student or guardian role that one Wilma login can act for.
+
+    Wilma addresses every role by the slug in its URLs, for example
+    ``/!1234567/messages``, so one session can read the messages of all
+    children of a guardian.
+    """
+
+    slug: str
+    name: str
+
+    @property
+    def messages_path(self) -> str:
+        """Return the path of the message list of the role."""
+        # Not a {user_id} template, so a re-login retry stays on the role
+        return f"{self.slug}/messages/list"
+
+
+class WilmaRoleCache:
+    """Persisted roles of the account of one config entry.
+
+    Lets a restart set up the devices and sensors of every role from disk,
+    before the first login.
+    """
+
+    def __init__(self, hass: HomeAssistant, entry_id: str) -> None:
+        """Initialize the role cache."""
+        self._store: Store[dict[str, Any]] = Store(
+            hass, ROLES_STORAGE_VERSION, f"{ROLES_STORAGE_KEY}_{entry_id}"
+        )
+
+    async def async_load(self) -> tuple[str | None, list[WilmaRole]] | None:
+        """Return the name of the logged in role and the other roles."""
+        if (data := await self._store.async_load()) is None:
+            return None
+        return data.get("name"), [
+            WilmaRole(role["slug"], role["name"]) for role in data.get("roles", [])
+        ]
+
+    async def async_save(self, name: str | None, roles: list[WilmaRole]) -> None:
+        """Persist the name of the logged in role and the other roles."""
+        await self._store.async_save(
+            {
+                "name": name,
+                "roles": [{"slug": role.slug, "name": role.name} for role in roles],
+            }
+        )
+
+    async def async_clear(self) -> None:
+        """Forget the persisted roles."""
+        await self._store.async_remove()
+
+
+async def async_get_roles(client: WilmaClient) -> list[WilmaRole]:
+    """Return the roles of the logged in account.
+
+    Accounts without roles, or servers that do not list them, return an
+    empty list and are polled as the role they logged in as.
+    """
+    from wilhelmina import WilmaError
+
+    try:
+        response = await client._authenticated_request("index_json")
+        data = await response.json(content_type=None)
+    except (WilmaError, aiohttp.ClientError, ValueError) as err:
+        _LOGGER.debug("Could not list the roles of the Wilma account: %s", err)
+        return []
+    roles = []
+    for role in data.get("Roles") or []:
+        slug = (role.get("Slug") or "").strip("/")
+        if slug.startswith("!"):
+            roles.append(WilmaRole(slug, role.get("Name") or slug))
+    return roles
+
+
+def _parse_message_list(body: bytes) -> list[tuple[datetime | None, Message]]:
+    """Parse a message list response into messages and their timestamps."""
+    from wilhelmina import Message
+
+    messages = []
+    listed = json_loads_object(body).get("Messages")
+    for item in listed if isinstance(listed, list) else []:
+        if not isinstance(item, dict):
+            continue
+        message = Message.from_dict(item)
+        timestamp = message.format_timestamp() if message.timestamp else None
+        messages.append((timestamp, message))
+    return messages
+
+
+async def async_list_messages(
+    client: WilmaClient,
+    cache: WilmaResponseCache,
+    after: datetime | None,
+    path: str = MESSAGE_LIST_PATH,
+) -> list[Message]:
+    """List the message headers newer than ``after``, like WilmaClient.get_messages.
+
+    An unchanged list is not parsed again, the messages come from the cache
+    and are shared with later polls. Unread flags are not part of the list.
+    """
+    listed = await cache.async_get(client, path, _parse_message_list)
+    if after and after.tzinfo is not None:
+        after = after.replace(tzinfo=None)
+    return [
+        message
+        for timestamp, message in listed
+        if not (after and timestamp and timestamp <= after)
+    ]
+
+
+async def async_list_role_messages(
+    client: WilmaClient,
+    cache: WilmaResponseCache,
+    role: WilmaRole,
+    after: datetime | None,
+) -> list[Message]:
+    """List the message headers of a role newer than ``after``."""
+    return await async_list_messages(client, cache, after, role.messages_path)
+
+
+async def async_messages_changed(
+    client: WilmaClient, cache: WilmaResponseCache, roles: list[WilmaRole]
+) -> bool:
+    """Return True if the message list of the account or of any role changed.
+
+    The lists are cached as a poll would cache them, so the poll that
+    follows a change finds them in the cache.
+    """
+    changed = False
+    for path in [MESSAGE_LIST_PATH, *(role.messages_path for role in roles)]:
+        changed |= await cache.async_changed(client, path, _parse_message_list)
+    return changed
+
+
+async def async_get_role_message_content(
+    client: WilmaClient, role: WilmaRole, message_id: int
+) -> Message:
+    """Fetch one message of a role, including its body."""
+    from wilhelmina import Message
+
+    response = await client._authenticated_request(
+        f"{role.slug}/messages/{message_id}", params={"format": "json"}
+    )
+    data = await response.json()
+    return Message.from_dict(data["messages"][0])
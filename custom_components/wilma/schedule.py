@@ -0,0 +1,336 @@
+"""Lesson schedule and exams for the Wilma integration."""
+
+from __future__ import annotations
+
+import heapq
+import logging
+from bisect import bisect_left
+from collections.abc import Hashable, Iterable
+from datetime import date, datetime, time, timedelta, tzinfo
+from itertools import count
+from typing import TYPE_CHECKING, Any
+
+import aiohttp
+from homeassistant.components.calendar import CalendarEvent
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
+from homeassistant.util import dt as dt_util
+
+from .client import async_import_wilhelmina
+from .const import (
+    DOMAIN,
+    SCHEDULE_SCAN_INTERVAL,
+    SCHEDULE_WEEK_MAX_AGE,
+    SCHEDULE_WEEKS_AHEAD,
+    SCHEDULE_WEEKS_BEHIND,
+)
+from .roles import WilmaRole
+
+if TYPE_CHECKING:
+    from wilhelmina import WilmaClient
+
+    from .coordinator import WilmaCoordinator
+
+_LOGGER = logging.getLogger(__name__)
+
+EXAMS = "exams"
+
+
+def _start_key(entry: tuple[datetime, int, CalendarEvent]) -> datetime:
+    """Return the sort key of an index entry."""
+    return entry[0]
+
+
+class EventIndex:
+    """Calendar events sorted by start time, for overlap queries.
+
+    Events are replaced in groups, one per schedule week plus one for the
+    exams, so a refresh of one week leaves the rest of the index alone. A
+    range query bisects to the first event that can still overlap the range,
+    using the longest event duration, so it costs O(log n + k).
+    """
+
+    def __init__(self) -> None:
+        """Initialize an empty index."""
+        self._entries: list[tuple[datetime, int, CalendarEvent]] = []
+        self._groups: dict[Hashable, list[CalendarEvent]] = {}
+        self._max_duration = timedelta(0)
+        self._sequence = count()
+
+    def __len__(self) -> int:
+        """Return the number of indexed events."""
+        return len(self._entries)
+
+    def groups(self) -> list[Hashable]:
+        """Return the keys of the indexed groups."""
+        return list(self._groups)
+
+    def replace(self, group: Hashable, events: Iterable[CalendarEvent]) -> None:
+        """Replace the events of one group."""
+        events = list(events)
+        old = self._groups.pop(group, None)
+        entries = self._entries
+        if old:
+            removed = {id(event) for event in old}
+            entries = [entry for entry in entries if id(entry[2]) not in removed]
+        added = sorted(
+            (event.start_datetime_local, next(self._sequence), event)
+            for event in events
+        )
+        self._entries = list(heapq.merge(entries, added))
+        if events:
+            self._groups[group] = events
+        if old:
+            self._max_duration = max(
+                (entry[2].end_datetime_local - entry[0] for entry in self._entries),
+                default=timedelta(0),
+            )
+        else:
+            for _, _, event in added:
+                self._max_duration = max(
+                    self._max_duration,
+                    event.end_datetime_local - event.start_datetime_local,
+                )
+
+    def remove(self, group: Hashable) -> None:
+        """Remove the events of one group."""
+        self.replace(group, [])
+
+    def _first_candidate(self, start: datetime) -> int:
+        """Return the position of the first event that may end after start."""
+        return bisect_left(self._entries, start - self._max_duration, key=_start_key)
+
+    def query(self, start: datetime, end: datetime) -> list[CalendarEvent]:
+        """Return the events overlapping start to end, by start time."""
+        high = bisect_left(self._entries, end, key=_start_key)
+        return [
+            event
+            for _, _, event in self._entries[self._first_candidate(start) : high]
+            if event.end_datetime_local > start
+        ]
+
+    def next_event(self, now: datetime) -> CalendarEvent | None:
+        """Return the current event, or the next one if none is ongoing."""
+        for _, _, event in self._entries[self._first_candidate(now) :]:
+            if event.end_datetime_local > now:
+                return event
+        return None
+
+
+def _parse_date(value: Any) -> date | None:
+    """Parse a Wilma date, either ISO or D.M.YYYY."""
+    if not isinstance(value, str):
+        return None
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        pass
+    try:
+        return datetime.strptime(value, "%d.%m.%Y").date()
+    except ValueError:
+        return None
+
+
+def _parse_time(value: Any) -> time | None:
+    """Parse a Wilma clock time, such as 8:15."""
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.strptime(value.strip(), "%H:%M").time()
+    except ValueError:
+        return None
+
+
+def _captions(items: Any, key: str = "Caption") -> list[str]:
+    """Return the captions of a list of Wilma teachers, rooms or groups."""
+    if not isinstance(items, list):
+        return []
+    return [
+        str(item.get("LongCaption") or item.get(key))
+        for item in items
+        if isinstance(item, dict) and (item.get("LongCaption") or item.get(key))
+    ]
+
+
+def parse_schedule(
+    data: dict[str, Any], monday: date, tz: tzinfo, uid_prefix: str
+) -> list[CalendarEvent]:
+    """Return the lessons of one week of a Wilma schedule response.
+
+    Lessons carry the weekday as ``Day``, 1 being Monday, and clock times as
+    ``Start`` and ``End``. Entries that cannot be parsed are skipped.
+    """
+    events = []
+    for lesson in data.get("Schedule") or []:
+        day = lesson.get("Day")
+        start = _parse_time(lesson.get("Start"))
+        end = _parse_time(lesson.get("End"))
+        if not isinstance(day, int) or not 1 <= day <= 7 or not start or not end:
+            continue
+        lesson_date = monday + timedelta(days=day - 1)
+        groups = [
+            group for group in lesson.get("Groups") or [] if isinstance(group, dict)
+        ]
+        summary = ", ".join(
+            str(group.get("Caption") or group.get("ShortCaption"))
+            for group in groups
+            if group.get("Caption") or group.get("ShortCaption")
+        )
+        teachers = [
+            name for group in groups for name in _captions(group.get("Teachers"))
+        ]
+        rooms = [name for group in groups for name in _captions(group.get("Rooms"))]
+        start_time = datetime.combine(lesson_date, start, tz)
+        end_time = datetime.combine(lesson_date, end, tz)
+        if end_time <= start_time:
+            continue
+        events.append(
+            CalendarEvent(
+                start=start_time,
+                end=end_time,
+                summary=summary or "Lesson",
+                description=", ".join(teachers) or None,
+                location=", ".join(rooms) or None,
+                uid=f"{uid_prefix}-{start_time.isoformat()}-{summary}",
+            )
+        )
+    return events
+
+
+def parse_exams(
+    data: dict[str, Any], tz: tzinfo, uid_prefix: str
+) -> list[CalendarEvent]:
+    """Return the exams of a Wilma exams response.
+
+    Exams with a clock time become timed events, others all day events.
+    """
+    events = []
+    for exam in data.get("Exams") or []:
+        exam_date = _parse_date(exam.get("Date"))
+        if exam_date is None:
+            continue
+        course = exam.get("Course") or exam.get("Caption")
+        name = exam.get("Name") or exam.get("Topic")
+        summary = " - ".join(str(part) for part in (course, name) if part) or "Exam"
+        description = exam.get("Info") or exam.get("Description")
+        start = _parse_time(exam.get("Start") or exam.get("Time"))
+        end = _parse_time(exam.get("End"))
+        if start:
+            start_value: date | datetime = datetime.combine(exam_date, start, tz)
+            end_value: date | datetime = (
+                datetime.combine(exam_date, end, tz)
+                if end and end > start
+                else start_value + timedelta(hours=1)
+            )
+        else:
+            start_value, end_value = exam_date, exam_date + timedelta(days=1)
+        events.append(
+            CalendarEvent(
+                start=start_value,
+                end=end_value,
+                summary=f"Exam: {summary}",
+                description=str(description) if description else None,
+                uid=f"{uid_prefix}-exam-{exam_date.isoformat()}-{summary}",
+            )
+        )
+    return events
+
+
+class WilmaScheduleCoordinator(DataUpdateCoordinator[dict[str | None, EventIndex]]):
+    """Coordinator for the lesson schedules and exams of every role.
+
+    Polls far less often than the message coordinator and uses its client.
+    Each refresh fetches the current week, and the other weeks of the window
+    only once they are older than a day, replacing just those weeks in the
+    index of the role.
+    """
+
+    def __init__(self, hass: HomeAssistant, wilma: WilmaCoordinator) -> None:
+        """Initialize the schedule coordinator."""
+        super().__init__(
+            hass,
+            _LOGGER,
+            name=f"{DOMAIN}_schedule",
+            update_interval=SCHEDULE_SCAN_INTERVAL,
+        )
+        self.wilma = wilma
+        self.indexes: dict[str | None, EventIndex] = {}
+        self._fetched: dict[tuple[str | None, date], datetime] = {}
+
+    async def _async_update_data(self) -> dict[str | None, EventIndex]:
+        """Refresh the stale weeks and the exams of every role."""
+        now = dt_util.now()
+        monday = now.date() - timedelta(days=now.weekday())
+        weeks = [
+            monday + timedelta(weeks=offset)
+            for offset in range(-SCHEDULE_WEEKS_BEHIND, SCHEDULE_WEEKS_AHEAD + 1)
+        ]
+        wilhelmina = await async_import_wilhelmina(self.hass)
+        try:
+            self.wilma.governor.check()
+            client = await self.wilma.async_ensure_client()
+            for role in [None, *(self.wilma.roles or [])]:
+                await self._async_refresh_role(client, role, weeks, monday, now)
+        except wilhelmina.AuthenticationError as err:
+            raise UpdateFailed("Authentication failed") from err
+        except (wilhelmina.WilmaError, aiohttp.ClientError, TimeoutError) as err:
+            raise UpdateFailed(f"Error communicating with Wilma: {err}") from err
+        return self.indexes
+
+    async def _async_refresh_role(
+        self,
+        client: WilmaClient,
+        role: WilmaRole | None,
+        weeks: list[date],
+        monday: date,
+        now: datetime,
+    ) -> None:
+        """Refresh the schedule index of one role."""
+        from wilhelmina import WilmaError
+
+        key = role.slug if role else None
+        index = self.indexes.setdefault(key, EventIndex())
+        tz = dt_util.get_default_time_zone()
+        uid_prefix = f"{self.wilma.entry_id}-{role.slug if role else 'account'}"
+
+        for week in weeks:
+            fetched = self._fetched.get((key, week))
+            if week != monday and fetched and now - fetched < SCHEDULE_WEEK_MAX_AGE:
+                continue
+            data = await self._async_request(
+                client,
+                role,
+                "schedule/index_json",
+                {"date": f"{week.day}.{week.month}.{week.year}"},
+            )
+            index.replace(week, parse_schedule(data, week, tz, uid_prefix))
+            self._fetched[(key, week)] = now
+
+        # Weeks that left the window
+        for group in index.groups():
+            if isinstance(group, date) and group < weeks[0]:
+                index.remove(group)
+                self._fetched.pop((key, group), None)
+
+        try:
+            data = await self._async_request(client, role, "exams/index_json")
+        except WilmaError as err:
+            # Not every school publishes exams
+            _LOGGER.debug("Could not fetch exams: %s", err)
+        else:
+            index.replace(EXAMS, parse_exams(data, tz, uid_prefix))
+
+    @staticmethod
+    async def _async_request(
+        client: WilmaClient,
+        role: WilmaRole | None,
+        path: str,
+        params: dict[str, str | int | bool] | None = None,
+    ) -> dict[str, Any]:
+        """Request a JSON document of the logged in role or another role."""
+        prefix = role.slug if role else "{user_id}"
+        response = await client._authenticated_request(
+            f"{prefix}/{path}", params=params
+        )
+        data = await response.json(content_type=None)
+        return data if isinstance(data, dict) else {}
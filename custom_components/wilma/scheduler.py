@@ -0,0 +1,120 @@
+"""Adaptive polling schedule for the Wilma integration."""
+
+from __future__ import annotations
+
+import random
+from collections.abc import Mapping
+from datetime import datetime, time, timedelta
+from typing import Any
+
+from homeassistant.util import dt as dt_util
+
+from .const import (
+    BACKOFF_MAX_INTERVAL,
+    CONF_ACTIVE_SCAN_INTERVAL,
+    CONF_IDLE_SCAN_INTERVAL,
+    CONF_SCHOOL_DAY_END,
+    CONF_SCHOOL_DAY_START,
+    DEFAULT_ACTIVE_SCAN_INTERVAL,
+    DEFAULT_IDLE_SCAN_INTERVAL,
+    DEFAULT_SCHOOL_DAY_END,
+    DEFAULT_SCHOOL_DAY_START,
+    PROBE_IDLE_INTERVAL,
+    PROBE_INTERVAL,
+    RECENT_ACTIVITY_SCAN_INTERVAL,
+    RECENT_ACTIVITY_WINDOW,
+    SCAN_INTERVAL_JITTER,
+)
+
+SCHOOL_DAYS = range(5)
+
+
+class PollScheduler:
+    """Decide how long to wait before the next poll of one config entry.
+
+    School hours on weekdays use the active interval and the rest of the week
+    the idle interval, which never runs past the start of the next school day.
+    New messages shorten the interval for a while, consecutive failures back
+    off exponentially, and every entry is shifted by a stable jitter so that
+    entries do not poll the server in lockstep.
+    """
+
+    def __init__(self, entry_id: str, options: Mapping[str, Any]) -> None:
+        """Initialize the scheduler from the entry options."""
+        self.active_interval = timedelta(
+            minutes=options.get(CONF_ACTIVE_SCAN_INTERVAL, DEFAULT_ACTIVE_SCAN_INTERVAL)
+        )
+        self.idle_interval = timedelta(
+            minutes=options.get(CONF_IDLE_SCAN_INTERVAL, DEFAULT_IDLE_SCAN_INTERVAL)
+        )
+        self.school_day_start = time.fromisoformat(
+            options.get(CONF_SCHOOL_DAY_START, DEFAULT_SCHOOL_DAY_START)
+        )
+        self.school_day_end = time.fromisoformat(
+            options.get(CONF_SCHOOL_DAY_END, DEFAULT_SCHOOL_DAY_END)
+        )
+        # Seeded by the entry id, so an entry keeps its offset across restarts
+        self._jitter = 1 + random.Random(entry_id).uniform(
+            -SCAN_INTERVAL_JITTER, SCAN_INTERVAL_JITTER
+        )
+        self.consecutive_failures = 0
+        self.last_new_messages: datetime | None = None
+
+    def in_school_hours(self, now: datetime) -> bool:
+        """Return True if now is within the active profile."""
+        return (
+            now.weekday() in SCHOOL_DAYS
+            and self.school_day_start <= now.time() < self.school_day_end
+        )
+
+    def _next_school_day_start(self, now: datetime) -> datetime:
+        """Return the start of the next school day after now."""
+        start = now.replace(
+            hour=self.school_day_start.hour,
+            minute=self.school_day_start.minute,
+            second=0,
+            microsecond=0,
+        )
+        if start <= now:
+            start += timedelta(days=1)
+        while start.weekday() not in SCHOOL_DAYS:
+            start += timedelta(days=1)
+        return start
+
+    def _profile_interval(self, now: datetime) -> timedelta:
+        """Return the interval for the activity profile at a point in time."""
+        if self.last_new_messages and now - self.last_new_messages < (
+            RECENT_ACTIVITY_WINDOW
+        ):
+            return min(self.active_interval, RECENT_ACTIVITY_SCAN_INTERVAL)
+        if self.in_school_hours(now):
+            return self.active_interval
+        until_active = self._next_school_day_start(now) - now
+        return max(min(self.idle_interval, until_active), self.active_interval)
+
+    def probe_interval(self, now: datetime | None = None) -> timedelta:
+        """Return the interval to the next check for changed message lists."""
+        now = now or dt_util.now()
+        if self.in_school_hours(now) or (
+            self.last_new_messages
+            and now - self.last_new_messages < RECENT_ACTIVITY_WINDOW
+        ):
+            return PROBE_INTERVAL * self._jitter
+        return PROBE_IDLE_INTERVAL * self._jitter
+
+    def on_success(self, new_messages: int, now: datetime | None = None) -> timedelta:
+        """Record a successful poll and return the interval to the next one."""
+        now = now or dt_util.now()
+        self.consecutive_failures = 0
+        if new_messages:
+            self.last_new_messages = now
+        return self._profile_interval(now) * self._jitter
+
+    def on_failure(self, now: datetime | None = None) -> timedelta:
+        """Record a failed poll and return the backed off interval."""
+        now = now or dt_util.now()
+        self.consecutive_failures += 1
+        interval = self._profile_interval(now) * 2 ** min(
+            self.consecutive_failures, 10
+        )
+        return min(interval, BACKOFF_MAX_INTERVAL) * self._jitter
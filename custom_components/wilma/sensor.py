@@ -3,16 +3,21 @@
 from __future__ import annotations
 
 import logging
+from collections.abc import Callable
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Any, Dict, Optional
+from typing import Any
 
 from homeassistant.components.sensor import (
     SensorDeviceClass,
     SensorEntity,
     SensorEntityDescription,
+    SensorStateClass,
 )
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant
+from homeassistant.const import UnitOfInformation, UnitOfTime
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from homeassistant.helpers.entity import EntityCategory
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 from homeassistant.helpers.typing import StateType
@@ -26,19 +31,148 @@ from .const import (
     ATTR_SENDER,
     ATTR_SUBJECT,
     ATTR_TIMESTAMP,
+    CONF_LEAN_ATTRIBUTES,
     DOMAIN,
+    SENDERS_ATTRIBUTE_LIMIT,
     SENSOR_LATEST_MESSAGE,
+    SENSOR_LATEST_UNREAD_MESSAGE,
+    SENSOR_MESSAGES_TODAY,
+    SENSOR_POLL_BYTES,
+    SENSOR_POLL_DURATION,
+    SENSOR_POLL_NEW_MESSAGES,
+    SENSOR_POLL_REQUESTS,
+    SENSOR_SENDERS,
+    SENSOR_STORED_MESSAGES,
+    SENSOR_UNREAD_MESSAGES,
+    SIGNAL_POLLED,
 )
 from .coordinator import WilmaCoordinator
+from .entity import wilma_device_info, wilma_unique_id
+from .roles import WilmaRole
+from .store import MessageCounters, MessageRecord, format_timestamp
+from .telemetry import PollStats
 
 _LOGGER = logging.getLogger(__name__)
 
-SENSOR_DESCRIPTIONS = [
+
+@dataclass(frozen=True, kw_only=True)
+class WilmaCounterSensorEntityDescription(SensorEntityDescription):
+    """Description of a sensor reporting counts over the stored messages."""
+
+    value_fn: Callable[[MessageCounters], StateType]
+    attributes_fn: Callable[[MessageCounters], dict[str, Any]] | None = None
+
+
+def _sender_attributes(counters: MessageCounters) -> dict[str, Any]:
+    """Return the message counts of the senders with the most messages."""
+    top = counters.senders.most_common(SENDERS_ATTRIBUTE_LIMIT)
+    return {
+        "messages": dict(top),
+        "unread": {
+            sender: counters.unread_senders[sender]
+            for sender, _ in top
+            if sender in counters.unread_senders
+        },
+    }
+
+
+SENSOR_DESCRIPTIONS: list[SensorEntityDescription] = [
     SensorEntityDescription(
         key=SENSOR_LATEST_MESSAGE,
         name="Latest Message",
         icon="mdi:email",
-    )
+    ),
+    SensorEntityDescription(
+        key=SENSOR_LATEST_UNREAD_MESSAGE,
+        name="Latest Unread Message",
+        icon="mdi:email-alert",
+    ),
+    WilmaCounterSensorEntityDescription(
+        key=SENSOR_UNREAD_MESSAGES,
+        name="Unread Messages",
+        icon="mdi:email-mark-as-unread",
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda counters: counters.unread,
+    ),
+    WilmaCounterSensorEntityDescription(
+        key=SENSOR_MESSAGES_TODAY,
+        name="Messages Today",
+        icon="mdi:email-fast",
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda counters: counters.on_day(dt_util.now().date()),
+    ),
+    WilmaCounterSensorEntityDescription(
+        key=SENSOR_SENDERS,
+        name="Senders",
+        icon="mdi:account-multiple",
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda counters: len(counters.senders),
+        attributes_fn=_sender_attributes,
+    ),
+]
+
+# Wilma only reports which messages are unread for the logged in role, the
+# other roles get no unread sensors
+ROLE_SENSOR_DESCRIPTIONS = [
+    description
+    for description in SENSOR_DESCRIPTIONS
+    if description.key not in (SENSOR_LATEST_UNREAD_MESSAGE, SENSOR_UNREAD_MESSAGES)
+]
+
+
+@dataclass(frozen=True, kw_only=True)
+class WilmaTelemetrySensorEntityDescription(SensorEntityDescription):
+    """Description of a sensor reporting the telemetry of the last poll."""
+
+    value_fn: Callable[[PollStats], StateType]
+
+
+TELEMETRY_SENSOR_DESCRIPTIONS = [
+    WilmaTelemetrySensorEntityDescription(
+        key=SENSOR_POLL_DURATION,
+        name="Poll Duration",
+        icon="mdi:timer-outline",
+        device_class=SensorDeviceClass.DURATION,
+        state_class=SensorStateClass.MEASUREMENT,
+        native_unit_of_measurement=UnitOfTime.SECONDS,
+        suggested_display_precision=2,
+        entity_category=EntityCategory.DIAGNOSTIC,
+        value_fn=lambda stats: round(stats.duration, 3),
+    ),
+    WilmaTelemetrySensorEntityDescription(
+        key=SENSOR_POLL_REQUESTS,
+        name="Poll Requests",
+        icon="mdi:swap-vertical",
+        state_class=SensorStateClass.MEASUREMENT,
+        entity_category=EntityCategory.DIAGNOSTIC,
+        value_fn=lambda stats: stats.requests,
+    ),
+    WilmaTelemetrySensorEntityDescription(
+        key=SENSOR_POLL_BYTES,
+        name="Poll Data Received",
+        icon="mdi:download-network",
+        device_class=SensorDeviceClass.DATA_SIZE,
+        state_class=SensorStateClass.MEASUREMENT,
+        native_unit_of_measurement=UnitOfInformation.BYTES,
+        entity_category=EntityCategory.DIAGNOSTIC,
+        value_fn=lambda stats: stats.bytes_received,
+    ),
+    WilmaTelemetrySensorEntityDescription(
+        key=SENSOR_POLL_NEW_MESSAGES,
+        name="Poll New Messages",
+        icon="mdi:email-plus",
+        state_class=SensorStateClass.MEASUREMENT,
+        entity_category=EntityCategory.DIAGNOSTIC,
+        value_fn=lambda stats: stats.new_messages,
+    ),
+    WilmaTelemetrySensorEntityDescription(
+        key=SENSOR_STORED_MESSAGES,
+        name="Stored Messages",
+        icon="mdi:database",
+        state_class=SensorStateClass.MEASUREMENT,
+        entity_category=EntityCategory.DIAGNOSTIC,
+        value_fn=lambda stats: stats.stored_messages,
+    ),
 ]
 
 
@@ -48,9 +182,14 @@ async def async_setup_entry(
     """Set up Wilma sensor platform."""
     coordinator = hass.data[DOMAIN][entry.entry_id]
 
-    entities = []
+    entities: list[SensorEntity] = []
     for description in SENSOR_DESCRIPTIONS:
-        entities.append(WilmaSensor(coordinator, description, entry))
+        entities.append(_create_sensor(coordinator, description, entry))
+
+    # Each other role of the account gets its own device
+    for role in coordinator.roles or []:
+        for description in ROLE_SENSOR_DESCRIPTIONS:
+            entities.append(_create_sensor(coordinator, description, entry, role))
 
     # Add last update status sensor
     entities.append(
@@ -67,76 +206,162 @@ async def async_setup_entry(
         )
     )
 
+    entities.extend(
+        WilmaTelemetrySensor(coordinator, description, entry)
+        for description in TELEMETRY_SENSOR_DESCRIPTIONS
+    )
+
     async_add_entities(entities)
 
 
-class WilmaSensor(CoordinatorEntity, SensorEntity):
+def _create_sensor(
+    coordinator: WilmaCoordinator,
+    description: SensorEntityDescription,
+    entry: ConfigEntry,
+    role: WilmaRole | None = None,
+) -> SensorEntity:
+    """Return the sensor for a description of SENSOR_DESCRIPTIONS."""
+    if isinstance(description, WilmaCounterSensorEntityDescription):
+        return WilmaCounterSensor(coordinator, description, entry, role)
+    return WilmaSensor(coordinator, description, entry, role)
+
+
+class WilmaSensor(CoordinatorEntity[WilmaCoordinator], SensorEntity):
     """Sensor representing Wilma message data."""
 
+    # Message bodies are large, keep them out of the recorder database
+    _unrecorded_attributes = frozenset({ATTR_CONTENT, ATTR_CONTENT_MARKDOWN})
+
     def __init__(
         self,
         coordinator: WilmaCoordinator,
         description: SensorEntityDescription,
         entry: ConfigEntry,
+        role: WilmaRole | None = None,
     ) -> None:
         """Initialize the sensor."""
         super().__init__(coordinator)
         self.entity_description = description
-        self._attr_unique_id = f"{entry.entry_id}_{description.key}"
+        self._role = role
+        self._attr_unique_id = wilma_unique_id(entry, description.key, role)
         self._attr_name = f"{description.name}"
-        self._attr_device_info = {
-            "identifiers": {(DOMAIN, entry.entry_id)},
-            "name": f"Wilma ({entry.data.get('username')})",
-            "manufacturer": "Visma",
-            "model": "Wilma",
-            "sw_version": "1.0.0",
-        }
-        self._message = None
+        if role is not None:
+            self._attr_name = f"{description.name} ({role.name})"
+        self._attr_device_info = wilma_device_info(entry, role)
+        self._message: MessageRecord | None = None
+        self._state_token: tuple | None = None
 
     @property
-    def native_value(self) -> StateType:
-        """Return the value reported by the sensor."""
-        if not self.coordinator.data:
+    def _data(self) -> dict[str, Any] | None:
+        """Return the coordinator data of the role of this sensor."""
+        if not self.coordinator.data or self._role is None:
+            return self.coordinator.data
+        return self.coordinator.data["roles"].get(self._role.slug)
+
+    def _current_message(self) -> MessageRecord | None:
+        """Return the message shown by this sensor."""
+        data = self._data
+        if not data:
             return None
 
         key = self.entity_description.key
         if key == SENSOR_LATEST_MESSAGE:
-            message = self.coordinator.data.get("latest_message")
-        else:
-            return None
+            return data.get("latest_message")
+        if key == SENSOR_LATEST_UNREAD_MESSAGE:
+            return data.get("latest_unread_message")
+        return None
+
+    def _state_key(self) -> tuple:
+        """Return the values that change whenever the state of this sensor does."""
+        message = self._current_message()
+        return (
+            self.available,
+            message.id if message else None,
+            bool(message and message.has_body),
+        )
 
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        """Write the state only if the message of this sensor changed."""
+        token = self._state_key()
+        if token == self._state_token:
+            return
+        self._state_token = token
+        super()._handle_coordinator_update()
+
+    @property
+    def native_value(self) -> StateType:
+        """Return the value reported by the sensor."""
+        message = self._current_message()
         self._message = message
         if not message:
             return None
 
-        return message["subject"]
+        return message.subject
 
     @property
-    def extra_state_attributes(self) -> Optional[Dict[str, Any]]:
+    def extra_state_attributes(self) -> dict[str, Any] | None:
         """Return entity specific state attributes."""
         if not self._message:
             return None
 
         attrs = {
-            ATTR_ID: self._message["id"],
-            ATTR_SUBJECT: self._message["subject"],
-            ATTR_SENDER: self._message["sender"],
-            ATTR_TIMESTAMP: self._message["timestamp"],
+            ATTR_ID: self._message.id,
+            ATTR_SUBJECT: self._message.subject,
+            ATTR_SENDER: self._message.sender,
+            ATTR_TIMESTAMP: format_timestamp(self._message.timestamp),
         }
 
+        # Lean attributes leave the body to the wilma.get_message service
+        if self.coordinator.options.get(CONF_LEAN_ATTRIBUTES, False):
+            return attrs
+
         # Add content if available
-        if "content_html" in self._message and self._message["content_html"]:
-            attrs[ATTR_CONTENT] = self._message["content_html"]
-            try:
-                attrs[ATTR_CONTENT_MARKDOWN] = self._message["content_markdown"]
-            except Exception:
-                pass
+        if content_html := self._message.content_html:
+            attrs[ATTR_CONTENT] = content_html
+            markdown = self._data["markdown"] if self._data else {}
+            if (content_markdown := markdown.get(self._message.id)) is not None:
+                attrs[ATTR_CONTENT_MARKDOWN] = content_markdown
 
         return attrs
 
 
-class WilmaLastUpdateSensor(CoordinatorEntity, SensorEntity):
-    """Sensor for tracking the last successful update time."""
+class WilmaCounterSensor(WilmaSensor):
+    """Sensor reporting counts the message store keeps up to date."""
+
+    entity_description: WilmaCounterSensorEntityDescription
+
+    @property
+    def _counters(self) -> MessageCounters:
+        """Return the counters of the store of the role of this sensor."""
+        return self.coordinator.get_store(self._role).counters
+
+    def _state_key(self) -> tuple:
+        """Return the values that change whenever the counts can change."""
+        data = self._data
+        return (
+            self.available,
+            data["revision"] if data else None,
+            data["messages_today"] if data else None,
+        )
+
+    @property
+    def native_value(self) -> StateType:
+        """Return the value reported by the sensor."""
+        if not self._data:
+            return None
+        return self.entity_description.value_fn(self._counters)
+
+    @property
+    def extra_state_attributes(self) -> dict[str, Any] | None:
+        """Return entity specific state attributes."""
+        if not self._data or self.entity_description.attributes_fn is None:
+            return None
+        return self.entity_description.attributes_fn(self._counters)
+
+
+class WilmaPollSensor(CoordinatorEntity[WilmaCoordinator], SensorEntity):
+    """Sensor of the account that also updates after unchanged polls."""
 
     def __init__(
         self,
@@ -144,24 +369,60 @@ class WilmaLastUpdateSensor(CoordinatorEntity, SensorEntity):
         description: SensorEntityDescription,
         entry: ConfigEntry,
     ) -> None:
-        """Initialize the last update sensor."""
+        """Initialize the sensor."""
         super().__init__(coordinator)
         self.entity_description = description
-        self._attr_unique_id = f"{entry.entry_id}_{description.key}"
+        self._attr_unique_id = wilma_unique_id(entry, description.key)
         self._attr_name = f"{description.name}"
-        self._attr_device_info = {
-            "identifiers": {(DOMAIN, entry.entry_id)},
-            "name": f"Wilma ({entry.data.get('username')})",
-            "manufacturer": "Visma",
-            "model": "Wilma",
-            "sw_version": "1.0.0",
-        }
+        self._attr_device_info = wilma_device_info(entry)
+
+    async def async_added_to_hass(self) -> None:
+        """Also update after polls that did not change the message data."""
+        await super().async_added_to_hass()
+        self.async_on_remove(
+            async_dispatcher_connect(
+                self.hass,
+                SIGNAL_POLLED.format(self.coordinator.entry_id),
+                self.async_write_ha_state,
+            )
+        )
+
+
+class WilmaLastUpdateSensor(WilmaPollSensor):
+    """Sensor for tracking the last successful update time."""
 
     @property
     def native_value(self) -> datetime | None:
         """Return the value reported by the sensor."""
-        if self.coordinator.data and "last_update" in self.coordinator.data:
-            return self.coordinator.data["last_update"]
         if self.coordinator.last_update_success_time:
             return dt_util.as_local(self.coordinator.last_update_success_time)
         return None
+
+
+class WilmaTelemetrySensor(WilmaPollSensor):
+    """Sensor reporting the telemetry of the last poll, failed or not."""
+
+    entity_description: WilmaTelemetrySensorEntityDescription
+
+    @property
+    def available(self) -> bool:
+        """Return True once a poll was timed, even if the poll failed."""
+        return self.coordinator.telemetry.last is not None
+
+    @property
+    def native_value(self) -> StateType:
+        """Return the value reported by the sensor."""
+        if (stats := self.coordinator.telemetry.last) is None:
+            return None
+        return self.entity_description.value_fn(stats)
+
+    @property
+    def extra_state_attributes(self) -> dict[str, Any] | None:
+        """Return the time spent in each phase with the poll duration."""
+        stats = self.coordinator.telemetry.last
+        if stats is None or self.entity_description.key != SENSOR_POLL_DURATION:
+            return None
+        return {
+            f"{name}_duration": round(value, 3)
+            for name, value in stats.phases.items()
+        } | {"error": stats.error}
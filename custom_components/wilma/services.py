@@ -0,0 +1,242 @@
+"""Services for the Wilma integration."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any
+
+import aiohttp
+import voluptuous as vol
+from homeassistant.core import (
+    HomeAssistant,
+    ServiceCall,
+    ServiceResponse,
+    SupportsResponse,
+    callback,
+)
+from homeassistant.exceptions import HomeAssistantError, ServiceValidationError
+from homeassistant.helpers import config_validation as cv
+
+from .archive import InvalidSearchQuery
+from .client import async_import_wilhelmina
+from .const import (
+    ATTR_ATTACHMENTS,
+    ATTR_CONFIG_ENTRY_ID,
+    ATTR_CONTENT,
+    ATTR_CONTENT_MARKDOWN,
+    ATTR_END_DATE,
+    ATTR_ID,
+    ATTR_LIMIT,
+    ATTR_MESSAGE_ID,
+    ATTR_OFFSET,
+    ATTR_QUERY,
+    ATTR_SENDER,
+    ATTR_START_DATE,
+    ATTR_SUBJECT,
+    ATTR_TIMESTAMP,
+    ATTR_TOP,
+    ATTR_UNREAD,
+    DOMAIN,
+    PROFILE_DEFAULT_TOP,
+    PROFILE_MAX_TOP,
+    SEARCH_DEFAULT_LIMIT,
+    SEARCH_MAX_LIMIT,
+    SERVICE_BACKFILL,
+    SERVICE_GET_MESSAGE,
+    SERVICE_PROFILE_POLL,
+    SERVICE_SEARCH_MESSAGES,
+)
+
+if TYPE_CHECKING:
+    from .coordinator import WilmaCoordinator
+
+GET_MESSAGE_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_MESSAGE_ID): vol.Coerce(int),
+        vol.Optional(ATTR_CONFIG_ENTRY_ID): cv.string,
+    }
+)
+
+SEARCH_MESSAGES_SCHEMA = vol.Schema(
+    {
+        vol.Optional(ATTR_QUERY): cv.string,
+        vol.Optional(ATTR_SENDER): cv.string,
+        vol.Optional(ATTR_START_DATE): cv.date,
+        vol.Optional(ATTR_END_DATE): cv.date,
+        vol.Optional(ATTR_LIMIT, default=SEARCH_DEFAULT_LIMIT): vol.All(
+            vol.Coerce(int), vol.Range(min=1, max=SEARCH_MAX_LIMIT)
+        ),
+        vol.Optional(ATTR_OFFSET, default=0): vol.All(
+            vol.Coerce(int), vol.Range(min=0)
+        ),
+        vol.Optional(ATTR_CONFIG_ENTRY_ID): cv.string,
+    }
+)
+
+PROFILE_POLL_SCHEMA = vol.Schema(
+    {
+        vol.Optional(ATTR_TOP, default=PROFILE_DEFAULT_TOP): vol.All(
+            vol.Coerce(int), vol.Range(min=1, max=PROFILE_MAX_TOP)
+        ),
+        vol.Optional(ATTR_CONFIG_ENTRY_ID): cv.string,
+    }
+)
+
+BACKFILL_SCHEMA = vol.Schema({vol.Optional(ATTR_CONFIG_ENTRY_ID): cv.string})
+
+
+def message_response(message: dict[str, Any]) -> dict[str, Any]:
+    """Return a stored message, including its body, as response data."""
+    return {
+        ATTR_ID: message["id"],
+        ATTR_SUBJECT: message.get("subject"),
+        ATTR_SENDER: message.get("sender"),
+        ATTR_TIMESTAMP: message.get("timestamp"),
+        ATTR_UNREAD: message.get("unread", False),
+        ATTR_CONTENT: message.get("content_html"),
+        ATTR_CONTENT_MARKDOWN: message.get("content_markdown"),
+        ATTR_ATTACHMENTS: message.get(ATTR_ATTACHMENTS, []),
+    }
+
+
+@callback
+def async_get_coordinator(
+    hass: HomeAssistant, entry_id: str | None
+) -> WilmaCoordinator:
+    """Return the coordinator of an entry, or the first one."""
+    coordinators: dict[str, WilmaCoordinator] = hass.data.get(DOMAIN, {})
+    if entry_id is not None:
+        if (coordinator := coordinators.get(entry_id)) is None:
+            raise ServiceValidationError(f"Wilma config entry {entry_id} not loaded")
+        return coordinator
+    for coordinator in coordinators.values():
+        return coordinator
+    raise ServiceValidationError("No Wilma config entry loaded")
+
+
+async def _async_find_coordinator(
+    hass: HomeAssistant, entry_id: str | None, message_id: int
+) -> WilmaCoordinator:
+    """Return the coordinator of an entry, or the one storing a message."""
+    if entry_id is not None:
+        return async_get_coordinator(hass, entry_id)
+    coordinators: dict[str, WilmaCoordinator] = hass.data.get(DOMAIN, {})
+    for coordinator in coordinators.values():
+        if await coordinator.async_has_message(message_id):
+            return coordinator
+    raise ServiceValidationError(f"Wilma message {message_id} not found")
+
+
+async def async_get_message(
+    hass: HomeAssistant, entry_id: str | None, message_id: int
+) -> dict[str, Any]:
+    """Return a stored message with its body, fetching the body if needed."""
+    coordinator = await _async_find_coordinator(hass, entry_id, message_id)
+    wilhelmina = await async_import_wilhelmina(hass)
+    try:
+        message = await coordinator.async_get_message(message_id)
+    except (wilhelmina.WilmaError, aiohttp.ClientError, TimeoutError) as err:
+        # Includes WilmaHostUnavailable while the circuit of the host is open
+        raise HomeAssistantError(
+            translation_domain=DOMAIN,
+            translation_key="communication_error",
+            translation_placeholders={"error": str(err)},
+        ) from err
+    if message is None:
+        raise ServiceValidationError(f"Wilma message {message_id} not found")
+    return message_response(message)
+
+
+async def async_search_messages(
+    hass: HomeAssistant, entry_id: str | None, **search: Any
+) -> dict[str, Any]:
+    """Return one page of archived messages matching a search."""
+    coordinator = async_get_coordinator(hass, entry_id)
+    try:
+        return await coordinator.archive.async_search(**search)
+    except InvalidSearchQuery as err:
+        raise ServiceValidationError(f"Invalid search query: {err}") from err
+
+
+async def async_profile_poll(
+    hass: HomeAssistant, entry_id: str | None, top: int
+) -> dict[str, Any]:
+    """Poll once under cProfile and return where the time went."""
+    coordinator = async_get_coordinator(hass, entry_id)
+    try:
+        return await coordinator.async_profile_poll(top)
+    except ValueError as err:
+        # Python allows one profiler at a time, such as the profiler integration
+        raise HomeAssistantError(f"Could not start profiling: {err}") from err
+
+
+@callback
+def async_backfill(hass: HomeAssistant, entry_id: str | None) -> dict[str, Any]:
+    """Start fetching the message history and return the backfill progress."""
+    coordinator = async_get_coordinator(hass, entry_id)
+    entry = hass.config_entries.async_get_entry(coordinator.entry_id)
+    assert entry is not None
+    coordinator.backfill.async_start(entry)
+    return dict(coordinator.backfill.state)
+
+
+@callback
+def async_setup_services(hass: HomeAssistant) -> None:
+    """Register the Wilma services."""
+
+    async def _async_get_message(call: ServiceCall) -> ServiceResponse:
+        """Return one message, including its body."""
+        return await async_get_message(
+            hass, call.data.get(ATTR_CONFIG_ENTRY_ID), call.data[ATTR_MESSAGE_ID]
+        )
+
+    async def _async_search_messages(call: ServiceCall) -> ServiceResponse:
+        """Return archived messages matching a search."""
+        return await async_search_messages(
+            hass,
+            call.data.get(ATTR_CONFIG_ENTRY_ID),
+            query=call.data.get(ATTR_QUERY),
+            sender=call.data.get(ATTR_SENDER),
+            start=call.data.get(ATTR_START_DATE),
+            end=call.data.get(ATTR_END_DATE),
+            limit=call.data[ATTR_LIMIT],
+            offset=call.data[ATTR_OFFSET],
+        )
+
+    async def _async_profile_poll(call: ServiceCall) -> ServiceResponse:
+        """Poll once under cProfile."""
+        return await async_profile_poll(
+            hass, call.data.get(ATTR_CONFIG_ENTRY_ID), call.data[ATTR_TOP]
+        )
+
+    async def _async_backfill(call: ServiceCall) -> ServiceResponse:
+        """Start fetching the message history in the background."""
+        return async_backfill(hass, call.data.get(ATTR_CONFIG_ENTRY_ID))
+
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_GET_MESSAGE,
+        _async_get_message,
+        schema=GET_MESSAGE_SCHEMA,
+        supports_response=SupportsResponse.ONLY,
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_SEARCH_MESSAGES,
+        _async_search_messages,
+        schema=SEARCH_MESSAGES_SCHEMA,
+        supports_response=SupportsResponse.ONLY,
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_PROFILE_POLL,
+        _async_profile_poll,
+        schema=PROFILE_POLL_SCHEMA,
+        supports_response=SupportsResponse.OPTIONAL,
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_BACKFILL,
+        _async_backfill,
+        schema=BACKFILL_SCHEMA,
+        supports_response=SupportsResponse.OPTIONAL,
+    )
@@ -0,0 +1,902 @@
+"""Message store for the Wilma integration."""
+
+from __future__ import annotations
+
+import base64
+import logging
+import os
+import sys
+import zlib
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter, OrderedDict
+from collections.abc import Awaitable, Callable, Iterable, Iterator, Mapping
+from contextlib import suppress
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import TYPE_CHECKING, Any, cast
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.json import json_bytes
+from homeassistant.helpers.storage import STORAGE_DIR, Store
+from homeassistant.util import dt as dt_util
+from homeassistant.util.json import json_loads_array
+
+from .const import (
+    DEFAULT_RETENTION_DAYS,
+    DEFAULT_RETENTION_MESSAGES,
+    MESSAGE_BODY_COMPRESS_MIN,
+    SHARD_CACHE_SIZE,
+    STORAGE_KEY,
+    STORAGE_SAVE_DELAY,
+    STORAGE_VERSION,
+)
+from .formatting import MarkdownCache
+
+if TYPE_CHECKING:
+    from wilhelmina import Message
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def parse_timestamp(value: Any) -> datetime:
+    """Parse a Wilma message timestamp into a naive datetime.
+
+    Wilma reports timestamps as ``YYYY-MM-DD HH:MM`` in local school time.
+    Unparseable values sort before everything else.
+    """
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    try:
+        return datetime.fromisoformat(value).replace(tzinfo=None)
+    except (TypeError, ValueError):
+        return datetime.min
+
+
+def _record_timestamp(value: Any) -> datetime | None:
+    """Parse the timestamp of a record, None if it has none."""
+    timestamp = parse_timestamp(value)
+    return None if timestamp == datetime.min else timestamp
+
+
+def format_timestamp(value: datetime | None) -> str | None:
+    """Return a message timestamp in the ``YYYY-MM-DD HH:MM`` form of Wilma."""
+    if value is None:
+        return None
+    return value.isoformat(" ", "seconds" if value.second else "minutes")
+
+
+def shard_month(timestamp: datetime) -> str:
+    """Return the shard of a message timestamp, as ``YYYYMM``."""
+    return f"{timestamp.year:04}{timestamp.month:02}"
+
+
+class MessageRecord:
+    """One stored message, compact in memory.
+
+    Senders and folders are interned, so all messages of a sender share one
+    string, and the timestamp is parsed once, when the record is created.
+    HTML bodies of MESSAGE_BODY_COMPRESS_MIN characters or more are kept
+    compressed and decompressed when read. The Markdown rendering is not
+    part of the record, the Markdown cache of the store renders it on demand.
+    """
+
+    __slots__ = ("_body", "folder", "id", "sender", "subject", "timestamp", "unread")
+
+    def __init__(
+        self,
+        message_id: int,
+        subject: str | None = None,
+        sender: str | None = None,
+        timestamp: datetime | None = None,
+        folder: str | None = None,
+        unread: bool = False,
+        content_html: str | None = None,
+    ) -> None:
+        """Initialize the record."""
+        self.id = message_id
+        self.subject = subject
+        self.sender = sys.intern(sender) if sender else sender
+        self.timestamp = timestamp
+        self.folder = sys.intern(folder) if folder else folder
+        self.unread = unread
+        self.content_html = content_html
+
+    def __repr__(self) -> str:
+        """Return the id and timestamp of the record."""
+        return f"<MessageRecord {self.id} {format_timestamp(self.timestamp)}>"
+
+    @property
+    def content_html(self) -> str | None:
+        """Return the HTML body."""
+        if isinstance(body := self._body, bytes):
+            return zlib.decompress(body).decode()
+        return body
+
+    @content_html.setter
+    def content_html(self, value: str | None) -> None:
+        """Set the HTML body, compressing a long one."""
+        if value is not None and len(value) >= MESSAGE_BODY_COMPRESS_MIN:
+            self._body: str | bytes | None = zlib.compress(value.encode())
+        else:
+            self._body = value
+
+    @property
+    def has_body(self) -> bool:
+        """Return True if the HTML body was fetched, without decompressing it."""
+        return bool(self._body)
+
+    @property
+    def sort_key(self) -> tuple[datetime, int]:
+        """Return the position of the record in timestamp order."""
+        return self.timestamp or datetime.min, self.id
+
+    @classmethod
+    def from_message(cls, message: Message) -> MessageRecord:
+        """Return the record of a library message, leaving the message unchanged."""
+        return cls(
+            message.id,
+            message.subject,
+            message.sender,
+            _record_timestamp(message.timestamp),
+            message.folder,
+            bool(message.unread),
+            message.content_html,
+        )
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> MessageRecord:
+        """Return a record from the attribute dict of a message."""
+        return cls(
+            data["id"],
+            data.get("subject"),
+            data.get("sender"),
+            _record_timestamp(data.get("timestamp")),
+            data.get("folder"),
+            bool(data.get("unread")),
+            data.get("content_html"),
+        )
+
+    def as_dict(self, content_markdown: str | None = None) -> dict[str, Any]:
+        """Return the message as an attribute dict, with its Markdown body."""
+        return {
+            "id": self.id,
+            "subject": self.subject,
+            "sender": self.sender,
+            "timestamp": format_timestamp(self.timestamp),
+            "folder": self.folder,
+            "unread": self.unread,
+            "content_html": self.content_html,
+            "content_markdown": content_markdown,
+        }
+
+
+@dataclass
+class SyncWatermark:
+    """Newest message timestamp seen and the ids seen at that timestamp.
+
+    Wilma timestamps have minute resolution and the client drops messages at or
+    before the ``after`` cursor, so the cursor backs off one minute and the ids
+    at the watermark are used to dedup the overlap.
+    """
+
+    timestamp: datetime | None = None
+    ids: set[int] = field(default_factory=set)
+
+    @property
+    def cursor(self) -> datetime | None:
+        """Return the ``after`` value for the next incremental fetch."""
+        if self.timestamp is None:
+            return None
+        return self.timestamp - timedelta(minutes=1)
+
+    def seen(self, timestamp: datetime, message_id: int) -> bool:
+        """Return True if a message is at or behind the watermark."""
+        if self.timestamp is None or timestamp > self.timestamp:
+            return False
+        return timestamp < self.timestamp or message_id in self.ids
+
+    def advance(self, timestamp: datetime, message_id: int) -> None:
+        """Move the watermark forward to include a message."""
+        if self.timestamp is None or timestamp > self.timestamp:
+            self.timestamp = timestamp
+            self.ids = {message_id}
+        elif timestamp == self.timestamp:
+            self.ids.add(message_id)
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the watermark in storage form."""
+        return {
+            "timestamp": self.timestamp.isoformat() if self.timestamp else None,
+            "ids": sorted(self.ids),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any] | None) -> SyncWatermark:
+        """Restore a watermark from storage form."""
+        if not data or not data.get("timestamp"):
+            return cls()
+        return cls(parse_timestamp(data["timestamp"]), set(data.get("ids", [])))
+
+
+class MessageCounters:
+    """Aggregate counts over the stored messages.
+
+    The store adjusts the counts on every insert, removal and read state
+    change, so reading them costs O(1) however many messages are stored.
+    Senders and folders without messages are dropped, so their number is the
+    number of distinct senders and folders.
+    """
+
+    def __init__(self) -> None:
+        """Initialize empty counters."""
+        self.unread = 0
+        self.senders: Counter[str] = Counter()
+        self.unread_senders: Counter[str] = Counter()
+        self.folders: Counter[str] = Counter()
+        self.days: Counter[date] = Counter()
+
+    @staticmethod
+    def _adjust(counter: Counter, key: Any, delta: int) -> None:
+        """Change one count, dropping keys that reach zero."""
+        counter[key] += delta
+        if counter[key] <= 0:
+            del counter[key]
+
+    def _count(self, message: MessageRecord, delta: int) -> None:
+        """Add a message to the counts, or remove it with a negative delta."""
+        sender = message.sender or ""
+        self._adjust(self.senders, sender, delta)
+        self._adjust(self.folders, message.folder or "", delta)
+        self._adjust(self.days, message.sort_key[0].date(), delta)
+        if message.unread:
+            self.unread += delta
+            self._adjust(self.unread_senders, sender, delta)
+
+    def add(self, message: MessageRecord) -> None:
+        """Count an inserted message."""
+        self._count(message, 1)
+
+    def remove(self, message: MessageRecord) -> None:
+        """Uncount a removed message."""
+        self._count(message, -1)
+
+    def mark(self, message: MessageRecord, unread: bool) -> None:
+        """Count a read state change, before the message is updated."""
+        if message.unread == unread:
+            return
+        delta = 1 if unread else -1
+        self.unread += delta
+        self._adjust(self.unread_senders, message.sender or "", delta)
+
+    def on_day(self, day: date) -> int:
+        """Return the number of messages sent on a day."""
+        return self.days.get(day, 0)
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the counts in storage form."""
+        return {
+            "unread": self.unread,
+            "senders": dict(self.senders),
+            "unread_senders": dict(self.unread_senders),
+            "folders": dict(self.folders),
+            "days": {day.isoformat(): count for day, count in self.days.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any] | None) -> MessageCounters:
+        """Restore counts from storage form."""
+        counters = cls()
+        if not data:
+            return counters
+        counters.unread = data.get("unread", 0)
+        counters.senders.update(data.get("senders", {}))
+        counters.unread_senders.update(data.get("unread_senders", {}))
+        counters.folders.update(data.get("folders", {}))
+        for day, count in data.get("days", {}).items():
+            counters.days[date.fromisoformat(day)] = count
+        return counters
+
+
+def pack_message(message: MessageRecord) -> dict[str, Any]:
+    """Return a message in the compact storage schema.
+
+    Only the fields the integration reads are kept, under short keys, and
+    empty values are left out. The Markdown rendering is not stored with the
+    message, it lives in the Markdown cache.
+    """
+    record: dict[str, Any] = {"i": message.id}
+    if message.subject is not None:
+        record["s"] = message.subject
+    if message.sender is not None:
+        record["f"] = message.sender
+    if message.timestamp is not None:
+        record["t"] = format_timestamp(message.timestamp)
+    if message.folder is not None:
+        record["d"] = message.folder
+    if message.unread:
+        record["u"] = True
+    if (content_html := message.content_html) is not None:
+        record["h"] = content_html
+    return record
+
+
+def unpack_message(record: dict[str, Any]) -> MessageRecord:
+    """Return a message from the compact storage schema."""
+    return MessageRecord(
+        record["i"],
+        record.get("s"),
+        record.get("f"),
+        _record_timestamp(record.get("t")),
+        record.get("d"),
+        bool(record.get("u")),
+        record.get("h"),
+    )
+
+
+def _encode_messages(messages: list[MessageRecord], compress: bool) -> dict[str, Any]:
+    """Pack messages for storage, run in the executor."""
+    records = [pack_message(message) for message in messages]
+    if not compress:
+        return {"messages": records}
+    return {"compressed": base64.b64encode(zlib.compress(json_bytes(records))).decode()}
+
+
+def _decode_messages(data: dict[str, Any]) -> list[MessageRecord]:
+    """Unpack stored messages, run in the executor."""
+    if (compressed := data.get("compressed")) is not None:
+        records = cast(
+            list[dict[str, Any]],
+            json_loads_array(zlib.decompress(base64.b64decode(compressed))),
+        )
+    else:
+        records = data.get("messages", [])
+    return [unpack_message(record) for record in records]
+
+
+class _WilmaMessageStorage(Store[dict[str, Any]]):
+    """Message Store that migrates older storage formats."""
+
+    async def _async_migrate_func(
+        self, old_major_version: int, old_minor_version: int, old_data: dict
+    ) -> dict[str, Any]:
+        """Migrate the stored messages to the compact schema."""
+        if old_major_version == 1:
+            # Version 1 stored the full attribute dict of each library message,
+            # including its Markdown rendering
+            old_data = {
+                **old_data,
+                "messages": [
+                    pack_message(MessageRecord.from_dict(message))
+                    for message in old_data.get("messages", [])
+                ],
+            }
+        return old_data
+
+
+class _MessageShard:
+    """The messages of one month moved out of memory, read on demand."""
+
+    def __init__(self, hass: HomeAssistant, key: str, compress: bool) -> None:
+        """Initialize the shard."""
+        self._hass = hass
+        self._store = _WilmaMessageStorage(
+            hass, STORAGE_VERSION, key, serialize_in_event_loop=False
+        )
+        self._compress = compress
+        self._data_func: Callable[[], dict[str, Any]] | None = None
+        self.messages: dict[int, MessageRecord] | None = None
+
+    async def async_load(self) -> dict[int, MessageRecord]:
+        """Return the messages of the shard, reading them if not in memory."""
+        if self.messages is None:
+            data = await self._store.async_load() or {}
+            self.messages = {
+                message.id: message
+                for message in await self._hass.async_add_executor_job(
+                    _decode_messages, data
+                )
+            }
+        return self.messages
+
+    @callback
+    def async_schedule_save(self) -> None:
+        """Schedule a delayed write of the messages of the shard."""
+        assert self.messages is not None
+        messages = sorted(self.messages.values(), key=lambda message: message.sort_key)
+        compress = self._compress
+
+        def data_func() -> dict[str, Any]:
+            self._data_func = None
+            return _encode_messages(messages, compress)
+
+        self._data_func = data_func
+        self._store.async_delay_save(data_func, STORAGE_SAVE_DELAY)
+
+    async def async_flush(self) -> None:
+        """Write a pending change now instead of after the save delay."""
+        if (data_func := self._data_func) is None:
+            return
+        data = await self._hass.async_add_executor_job(data_func)
+        await self._store.async_save(data)
+
+
+class WilmaMessageStore:
+    """In-memory, id-indexed view of the persisted Wilma messages.
+
+    The backing Store is read once in async_load. Message records are kept in
+    a dict keyed by message id and in a list of (timestamp, id) pairs sorted by
+    timestamp, so inserts dedup in O(1) and latest/range lookups are O(log n).
+
+    Changes mark the store dirty and async_schedule_save coalesces them into a
+    single delayed write, packed and serialized in the executor.
+
+    Only the newest messages are kept in memory. async_apply_retention moves
+    messages older than ``keep_days`` or beyond the newest ``keep_messages``
+    into one shard Store per month, which is only read when an old message
+    is looked up, and the last SHARD_CACHE_SIZE shards read stay in memory.
+    The counters and the length cover the shards as well. The ids of the
+    unread messages in each shard are kept, so read state changes reach the
+    shards and the latest unread lookup only reads a shard when no unread
+    message is in memory. The other lookups cover only the messages in
+    memory.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        entry_id: str,
+        compress: bool = True,
+        keep_days: int = DEFAULT_RETENTION_DAYS,
+        keep_messages: int = DEFAULT_RETENTION_MESSAGES,
+    ) -> None:
+        """Initialize the message store."""
+        self._hass = hass
+        self._key = f"{STORAGE_KEY}_{entry_id}"
+        self._store = _WilmaMessageStorage(
+            hass,
+            STORAGE_VERSION,
+            self._key,
+            serialize_in_event_loop=False,
+        )
+        self._compress = compress
+        self._keep_days = keep_days
+        self._keep_messages = keep_messages
+        self._messages: dict[int, MessageRecord] = {}
+        self._order: list[tuple[datetime, int]] = []
+        # Sort keys of the unread messages in memory, for the latest unread
+        # lookup
+        self._unread: list[tuple[datetime, int]] = []
+        # Ids of all unread messages, in memory and in shards
+        self._unread_ids: set[int] = set()
+        self._dirty = False
+        self._pending = False
+        self._shards: dict[str, _MessageShard] = {}
+        self._loaded_shards: OrderedDict[str, None] = OrderedDict()
+        # Number of messages in each shard, by month
+        self.shards: dict[str, int] = {}
+        # Ids of the unread messages in each shard, by month. A changed month
+        # gets a new tuple, so a snapshot only copies the dict
+        self.unread_shards: dict[str, tuple[int, ...]] = {}
+        self.archived = MessageCounters()
+        self.revision = 0
+        self.counters = MessageCounters()
+        self.watermark = SyncWatermark()
+        self.markdown = MarkdownCache()
+
+    def __len__(self) -> int:
+        """Return the number of stored messages, including the shards."""
+        return len(self._messages) + sum(self.shards.values())
+
+    @property
+    def in_memory(self) -> int:
+        """Return the number of messages kept in memory."""
+        return len(self._messages)
+
+    @property
+    def unread_count(self) -> int:
+        """Return the number of unread messages."""
+        return self.counters.unread
+
+    def __contains__(self, message_id: object) -> bool:
+        """Return True if a message with this id is kept in memory."""
+        return message_id in self._messages
+
+    async def async_load(self) -> None:
+        """Load the persisted messages into memory, leaving the shards unread."""
+        data = await self._store.async_load() or {}
+        self._messages.clear()
+        self._order.clear()
+        self._unread.clear()
+        self._unread_ids.clear()
+        self.shards = dict(data.get("shards", {}))
+        self.unread_shards = {
+            month: tuple(message_ids)
+            for month, message_ids in data.get("unread_shards", {}).items()
+        }
+        for message_ids in self.unread_shards.values():
+            self._unread_ids.update(message_ids)
+        self.archived = MessageCounters.from_dict(data.get("archived"))
+        self.counters = MessageCounters.from_dict(data.get("archived"))
+        for message in await self._hass.async_add_executor_job(_decode_messages, data):
+            self.add(message)
+        self.watermark = SyncWatermark.from_dict(data.get("watermark"))
+        if self.watermark.timestamp is None and self._order:
+            # Stores written before the watermark existed
+            newest = self._order[-1][0]
+            for message in self.range(newest, newest):
+                self.watermark.advance(newest, message.id)
+        self._dirty = False
+        _LOGGER.debug(
+            "Loaded %s messages from %s", len(self._messages), self._store.key
+        )
+
+    def _snapshot(self) -> Callable[[], dict[str, Any]]:
+        """Return a function building the storage data of the current state.
+
+        The message list and the small watermark and counter dicts are copied
+        on the event loop, the messages are packed when the function runs.
+        """
+        messages = list(self._iter_ascending())
+        watermark = self.watermark.as_dict()
+        shards = dict(self.shards)
+        archived = self.archived.as_dict()
+        unread_shards = dict(self.unread_shards)
+        compress = self._compress
+
+        def data_func() -> dict[str, Any]:
+            self._pending = False
+            return {
+                **_encode_messages(messages, compress),
+                "watermark": watermark,
+                "shards": shards,
+                "archived": archived,
+                "unread_shards": unread_shards,
+            }
+
+        return data_func
+
+    @callback
+    def async_schedule_save(self) -> None:
+        """Schedule a delayed write if anything changed since the last one."""
+        if not self._dirty:
+            return
+        self._dirty = False
+        self._pending = True
+        self._store.async_delay_save(self._snapshot(), STORAGE_SAVE_DELAY)
+
+    async def async_flush(self) -> None:
+        """Write pending changes now instead of after the save delay."""
+        for shard in self._shards.values():
+            await shard.async_flush()
+        if not self._dirty and not self._pending:
+            return
+        self._dirty = False
+        data = await self._hass.async_add_executor_job(self._snapshot())
+        await self._store.async_save(data)
+
+    async def _async_load_shard(self, month: str) -> dict[int, MessageRecord]:
+        """Return the messages of a shard, reading it if it is not in memory."""
+        if (shard := self._shards.get(month)) is None:
+            shard = self._shards[month] = _MessageShard(
+                self._hass, f"{self._key}_{month}", self._compress
+            )
+        messages = await shard.async_load()
+        self._loaded_shards[month] = None
+        self._loaded_shards.move_to_end(month)
+        while len(self._loaded_shards) > SHARD_CACHE_SIZE:
+            evicted, _ = self._loaded_shards.popitem(last=False)
+            self._shards[evicted].messages = None
+        return messages
+
+    async def async_get_archived(
+        self, message_id: int, timestamp: datetime
+    ) -> MessageRecord | None:
+        """Return a message moved to the shard of its timestamp."""
+        if (month := shard_month(timestamp)) not in self.shards:
+            return None
+        return (await self._async_load_shard(month)).get(message_id)
+
+    async def async_contains(self, message_id: int, timestamp: datetime) -> bool:
+        """Return True if a message is stored, in memory or in its shard."""
+        return message_id in self._messages or (
+            await self.async_get_archived(message_id, timestamp) is not None
+        )
+
+    async def async_save_archived(self, message: MessageRecord) -> None:
+        """Write a changed message of a shard, such as a body fetched later."""
+        month = shard_month(message.sort_key[0])
+        messages = await self._async_load_shard(month)
+        messages[message.id] = message
+        self._shards[month].async_schedule_save()
+
+    async def async_apply_retention(self, now: datetime | None = None) -> int:
+        """Move old messages from memory to their shards.
+
+        Returns the number of messages moved. The moved messages are always
+        the oldest ones in memory, so a store within its limits is checked
+        without looking past its oldest message. Unread messages are moved
+        as well, their ids are kept in unread_shards.
+        """
+        cutoff = dt_util.as_local(now or dt_util.now()).replace(
+            tzinfo=None
+        ) - timedelta(days=self._keep_days)
+        excess = len(self._order) - self._keep_messages
+        count = 0
+        for timestamp, _ in self._order:
+            if count >= excess and timestamp >= cutoff:
+                break
+            count += 1
+        if not count:
+            return 0
+        by_month: dict[str, list[MessageRecord]] = {}
+        for timestamp, message_id in self._order[:count]:
+            message = self._messages.pop(message_id)
+            by_month.setdefault(shard_month(timestamp), []).append(message)
+        del self._order[:count]
+        for month, messages in by_month.items():
+            shard_messages = await self._async_load_shard(month)
+            unread_ids = []
+            for message in messages:
+                shard_messages[message.id] = message
+                self.archived.add(message)
+                if message.unread:
+                    del self._unread[bisect_left(self._unread, message.sort_key)]
+                    unread_ids.append(message.id)
+            if unread_ids:
+                self.unread_shards[month] = (
+                    *self.unread_shards.get(month, ()),
+                    *unread_ids,
+                )
+            self.shards[month] = len(shard_messages)
+            self._shards[month].async_schedule_save()
+        self._dirty = True
+        _LOGGER.debug(
+            "Moved %s messages of %s to %s shards", count, self._key, len(by_month)
+        )
+        return count
+
+    def add(self, message: MessageRecord) -> bool:
+        """Insert a message, returning False if its id is already stored."""
+        if message.id in self._messages:
+            return False
+        self._messages[message.id] = message
+        insort(self._order, message.sort_key)
+        if message.unread:
+            insort(self._unread, message.sort_key)
+            self._unread_ids.add(message.id)
+        self.counters.add(message)
+        self.revision += 1
+        self._dirty = True
+        return True
+
+    def remove(self, message_id: int) -> MessageRecord | None:
+        """Remove a message, returning it if it was stored."""
+        if (message := self._messages.pop(message_id, None)) is None:
+            return None
+        del self._order[bisect_left(self._order, message.sort_key)]
+        if message.unread:
+            del self._unread[bisect_left(self._unread, message.sort_key)]
+            self._unread_ids.discard(message.id)
+        self.counters.remove(message)
+        self.revision += 1
+        self._dirty = True
+        return message
+
+    def set_unread(self, message_id: int, unread: bool) -> bool:
+        """Update the read state of a message in memory, True if it changed."""
+        message = self._messages.get(message_id)
+        if message is None or message.unread == unread:
+            return False
+        self.counters.mark(message, unread)
+        message.unread = unread
+        if unread:
+            insort(self._unread, message.sort_key)
+            self._unread_ids.add(message_id)
+        else:
+            del self._unread[bisect_left(self._unread, message.sort_key)]
+            self._unread_ids.discard(message_id)
+        self.revision += 1
+        self._dirty = True
+        return True
+
+    async def _async_set_archived_unread(
+        self, month: str, states: Mapping[int, bool]
+    ) -> dict[int, bool]:
+        """Update the read state of messages in one shard, returning the changes."""
+        if month not in self.shards:
+            return {}
+        messages = await self._async_load_shard(month)
+        changed = {}
+        for message_id, unread in states.items():
+            message = messages.get(message_id)
+            if message is None or message.unread == unread:
+                continue
+            self.archived.mark(message, unread)
+            self.counters.mark(message, unread)
+            message.unread = unread
+            if unread:
+                self._unread_ids.add(message_id)
+            else:
+                self._unread_ids.discard(message_id)
+            changed[message_id] = unread
+        if not changed:
+            return changed
+        unread_ids = [
+            message_id
+            for message_id in self.unread_shards.get(month, ())
+            if changed.get(message_id, True)
+        ]
+        unread_ids.extend(
+            message_id for message_id, unread in changed.items() if unread
+        )
+        if unread_ids:
+            self.unread_shards[month] = tuple(unread_ids)
+        else:
+            self.unread_shards.pop(month, None)
+        self._shards[month].async_schedule_save()
+        self.revision += 1
+        self._dirty = True
+        return changed
+
+    @property
+    def unread_ids(self) -> set[int]:
+        """Return the ids of the unread messages, in memory and in shards.
+
+        The set is the one the store keeps up to date, callers must not mutate
+        it.
+        """
+        return self._unread_ids
+
+    async def async_apply_unread(
+        self,
+        unread: set[int],
+        find_timestamps: Callable[[Iterable[int]], Awaitable[Mapping[int, datetime]]]
+        | None = None,
+    ) -> dict[int, bool]:
+        """Set the read state of every stored message from the unread ids.
+
+        Returns the changed read states by message id. Only the messages
+        whose state differs are visited, not the whole store. Read messages
+        in shards are found by the timestamps ``find_timestamps`` returns for
+        their ids, without it they stay read.
+        """
+        if unread == self._unread_ids:
+            return {}
+        changes = dict.fromkeys(self._unread_ids - unread, False)
+        changes.update(dict.fromkeys(unread - self._unread_ids, True))
+        changed = {}
+        archived = {}
+        for message_id, state in changes.items():
+            if message_id not in self._messages:
+                archived[message_id] = state
+            elif self.set_unread(message_id, state):
+                changed[message_id] = state
+        if not archived:
+            return changed
+        months = {
+            message_id: month
+            for month, message_ids in self.unread_shards.items()
+            for message_id in message_ids
+        }
+        if find_timestamps is not None and (
+            unknown := [
+                message_id
+                for message_id, state in archived.items()
+                if state and message_id not in months
+            ]
+        ):
+            for message_id, timestamp in (await find_timestamps(unknown)).items():
+                months[message_id] = shard_month(timestamp)
+        by_month: dict[str, dict[int, bool]] = {}
+        for message_id, state in archived.items():
+            if (month := months.get(message_id)) is not None:
+                by_month.setdefault(month, {})[message_id] = state
+        # One shard at a time, each is read at most once
+        for month, states in by_month.items():
+            changed.update(await self._async_set_archived_unread(month, states))
+        return changed
+
+    def merge(self, messages: Iterable[MessageRecord]) -> list[int]:
+        """Insert fetched messages idempotently and return the new ids.
+
+        Messages already stored or behind the sync watermark are skipped, and
+        the watermark advances past everything inserted.
+        """
+        # Compare against the watermark from before this batch, a batch is not
+        # necessarily sorted oldest first
+        previous = SyncWatermark(self.watermark.timestamp, set(self.watermark.ids))
+        new_ids = []
+        for message in messages:
+            timestamp = message.sort_key[0]
+            if previous.seen(timestamp, message.id):
+                continue
+            if self.add(message):
+                new_ids.append(message.id)
+            self.watermark.advance(timestamp, message.id)
+            self._dirty = True
+        return new_ids
+
+    def is_known(self, message_id: int, timestamp: Any) -> bool:
+        """Return True if a fetched message was already merged."""
+        return message_id in self._messages or self.watermark.seen(
+            parse_timestamp(timestamp), message_id
+        )
+
+    def get(self, message_id: int) -> MessageRecord | None:
+        """Return a message by id."""
+        return self._messages.get(message_id)
+
+    def set_body(self, message_id: int, content_html: str) -> None:
+        """Store the HTML body of a message fetched after it was merged."""
+        message = self._messages[message_id]
+        if message.content_html != content_html:
+            message.content_html = content_html
+            self.revision += 1
+            self._dirty = True
+
+    async def async_markdown(self, *messages: MessageRecord | None) -> dict[int, str]:
+        """Return the Markdown rendering of the bodies of messages, by id."""
+        bodies = {
+            message.id: content_html
+            for message in messages
+            if message is not None and (content_html := message.content_html)
+        }
+        if not bodies:
+            return {}
+        markdown = await self.markdown.async_convert(self._hass, bodies.values())
+        return {
+            message_id: markdown[content_html]
+            for message_id, content_html in bodies.items()
+        }
+
+    def latest(self) -> MessageRecord | None:
+        """Return the newest message."""
+        if not self._order:
+            return None
+        return self._messages[self._order[-1][1]]
+
+    async def async_latest_unread(self) -> MessageRecord | None:
+        """Return the newest unread message, reading a shard if none is in memory."""
+        if self._unread:
+            return self._messages[self._unread[-1][1]]
+        if not self.unread_shards:
+            return None
+        # Shard messages are all older than the ones in memory
+        month = max(self.unread_shards)
+        messages = await self._async_load_shard(month)
+        return max(
+            (messages[message_id] for message_id in self.unread_shards[month]),
+            key=lambda message: message.sort_key,
+        )
+
+    def range(
+        self, start: datetime | None = None, end: datetime | None = None
+    ) -> list[MessageRecord]:
+        """Return messages with start <= timestamp <= end, oldest first."""
+        low = 0 if start is None else bisect_left(self._order, (start,))
+        high = (
+            len(self._order)
+            if end is None
+            else bisect_right(self._order, (end, float("inf")))
+        )
+        return [self._messages[message_id] for _, message_id in self._order[low:high]]
+
+    def _iter_ascending(self) -> Iterator[MessageRecord]:
+        """Iterate over messages, oldest first."""
+        for _, message_id in self._order:
+            yield self._messages[message_id]
+
+
+async def async_remove_message_stores(hass: HomeAssistant, entry_id: str) -> None:
+    """Delete the message stores and shards of all roles of a removed entry."""
+    prefix = f"{STORAGE_KEY}_{entry_id}"
+
+    def _remove() -> None:
+        directory = hass.config.path(STORAGE_DIR)
+        with suppress(FileNotFoundError):
+            for name in os.listdir(directory):
+                if name == prefix or name.startswith(f"{prefix}_"):
+                    with suppress(FileNotFoundError):
+                        os.unlink(os.path.join(directory, name))
+
+    await hass.async_add_executor_job(_remove)
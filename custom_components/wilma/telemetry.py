@@ -0,0 +1,146 @@
+"""Poll telemetry for the Wilma integration."""
+
+from __future__ import annotations
+
+import cProfile
+import pstats
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any
+
+from homeassistant.util import dt as dt_util
+
+from .client import WilmaTrafficCounter
+
+PHASE_LOGIN = "login"
+PHASE_LIST = "list"
+PHASE_BODIES = "bodies"
+PHASE_CONVERT = "convert"
+PHASE_PERSIST = "persist"
+PHASES = (PHASE_LOGIN, PHASE_LIST, PHASE_BODIES, PHASE_CONVERT, PHASE_PERSIST)
+
+
+@dataclass
+class PollStats:
+    """Timings and counters of one poll."""
+
+    started: datetime
+    duration: float = 0.0
+    phases: dict[str, float] = field(default_factory=lambda: dict.fromkeys(PHASES, 0.0))
+    requests: int = 0
+    bytes_received: int = 0
+    new_messages: int = 0
+    stored_messages: int = 0
+    error: str | None = None
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the stats in diagnostics form, durations in seconds."""
+        return {
+            "started": self.started.isoformat(),
+            "duration": round(self.duration, 3),
+            "phases": {name: round(value, 3) for name, value in self.phases.items()},
+            "requests": self.requests,
+            "bytes_received": self.bytes_received,
+            "new_messages": self.new_messages,
+            "stored_messages": self.stored_messages,
+            "error": self.error,
+        }
+
+
+class PollTelemetry:
+    """Timings and counters of the polls of one coordinator.
+
+    A poll is timed per phase: logging in, listing message headers, fetching
+    bodies, converting them to Markdown and persisting them. The roles of an
+    account are polled concurrently and their phase times are summed, so the
+    phases can add up to more than the poll duration. Requests and bytes are
+    counted on the session of the client, and include the requests of the
+    schedule coordinator if it runs during the poll.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the telemetry."""
+        self.last: PollStats | None = None
+        self.polls = 0
+        self.failures = 0
+        self.requests = 0
+        self.bytes_received = 0
+        self._current: PollStats | None = None
+        self._started = 0.0
+        self._counter: WilmaTrafficCounter | None = None
+        self._traffic = (0, 0)
+
+    def start(self, counter: WilmaTrafficCounter) -> None:
+        """Start timing a poll."""
+        self._current = PollStats(dt_util.utcnow())
+        self._started = time.monotonic()
+        self._counter = counter
+        self._traffic = (counter.requests, counter.bytes_received)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Add the time spent in a block to a phase of the current poll."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            if self._current is not None:
+                self._current.phases[name] += time.monotonic() - started
+
+    def finish(
+        self, new_messages: int, stored_messages: int, error: str | None = None
+    ) -> PollStats | None:
+        """Finish the current poll and return its stats."""
+        if (stats := self._current) is None:
+            return None
+        self._current = None
+        stats.duration = time.monotonic() - self._started
+        if self._counter is not None:
+            stats.requests = self._counter.requests - self._traffic[0]
+            stats.bytes_received = self._counter.bytes_received - self._traffic[1]
+        stats.new_messages = new_messages
+        stats.stored_messages = stored_messages
+        stats.error = error
+        self.polls += 1
+        if error is not None:
+            self.failures += 1
+        self.requests += stats.requests
+        self.bytes_received += stats.bytes_received
+        self.last = stats
+        return stats
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the telemetry in diagnostics form."""
+        return {
+            "polls": self.polls,
+            "failures": self.failures,
+            "requests": self.requests,
+            "bytes_received": self.bytes_received,
+            "last_poll": self.last.as_dict() if self.last else None,
+        }
+
+
+def write_profile(profile: cProfile.Profile, path: str, top: int) -> list[dict]:
+    """Write a poll profile and return its most expensive functions.
+
+    Run in the executor.
+    """
+    stats = pstats.Stats(profile)
+    stats.dump_stats(path)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE)
+    functions = []
+    for function in stats.fcn_list[:top]:  # type: ignore[attr-defined]
+        calls, _, own_time, cumulative, _ = stats.stats[function]  # type: ignore[attr-defined]
+        filename, line, name = function
+        functions.append(
+            {
+                "function": f"{filename}:{line}({name})",
+                "calls": calls,
+                "own_time": round(own_time, 4),
+                "cumulative_time": round(cumulative, 4),
+            }
+        )
+    return functions
@@ -0,0 +1,48 @@
+"""Websocket API for the Wilma integration."""
+
+from __future__ import annotations
+
+from typing import Any
+
+import voluptuous as vol
+from homeassistant.components import websocket_api
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.exceptions import HomeAssistantError, ServiceValidationError
+
+from .const import ATTR_CONFIG_ENTRY_ID, ATTR_MESSAGE_ID
+from .services import async_get_message
+
+
+@callback
+def async_setup_websocket_api(hass: HomeAssistant) -> None:
+    """Register the Wilma websocket commands."""
+    websocket_api.async_register_command(hass, websocket_get_message)
+
+
+@websocket_api.websocket_command(
+    {
+        vol.Required("type"): "wilma/message",
+        vol.Required(ATTR_MESSAGE_ID): int,
+        vol.Optional(ATTR_CONFIG_ENTRY_ID): str,
+    }
+)
+@websocket_api.async_response
+async def websocket_get_message(
+    hass: HomeAssistant,
+    connection: websocket_api.ActiveConnection,
+    msg: dict[str, Any],
+) -> None:
+    """Return one message, including its body."""
+    try:
+        message = await async_get_message(
+            hass, msg.get(ATTR_CONFIG_ENTRY_ID), msg[ATTR_MESSAGE_ID]
+        )
+    except ServiceValidationError as err:
+        connection.send_error(msg["id"], websocket_api.ERR_NOT_FOUND, str(err))
+        return
+    except HomeAssistantError as err:
+        connection.send_error(
+            msg["id"], websocket_api.ERR_HOME_ASSISTANT_ERROR, str(err)
+        )
+        return
+    connection.send_result(msg["id"], message)
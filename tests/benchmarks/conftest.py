@@ -0,0 +1,238 @@
+"""Fixtures and reporting for the Wilma hot path benchmarks.
+
+The benchmarks are skipped unless pytest runs with --run-benchmarks:
+
+    pytest tests/benchmarks --run-benchmarks
+
+Each benchmark reports its latency over a number of rounds, the peak memory
+traced by tracemalloc during one extra round and, for store writes, the size
+of the file on disk. Results are compared with baseline.json. Allocations and
+store size fail a benchmark when they grow past the tolerance, latency depends
+on the machine and is only reported. --update-benchmark-baseline writes the
+results of the run to the baseline.
+"""
+
+from __future__ import annotations
+
+import json
+import statistics
+import time
+import tracemalloc
+from collections.abc import Awaitable, Callable
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any
+
+import pytest
+from homeassistant.helpers import json as json_helper
+
+from custom_components.wilma.const import STORAGE_KEY, STORAGE_VERSION
+from custom_components.wilma.store import MessageRecord, _encode_messages
+
+BASELINE_PATH = Path(__file__).parent / "baseline.json"
+
+# Archive sizes and the timed rounds for each
+SIZES = (100, 10_000, 100_000)
+ROUNDS = {100: 50, 10_000: 10, 100_000: 3}
+
+# Growth over the baseline that fails a benchmark
+MEMORY_TOLERANCE = 1.25
+SIZE_TOLERANCE = 1.05
+# Peak memory differences below this are noise from the loop and the executor
+MEMORY_SLACK = 256 * 1024
+
+BODY = (
+    "<p>Hyvät huoltajat,</p>"
+    "<p>Viesti {id}: luokan {group} retki on {day}.{month}. Lähtö koululta klo"
+    " 8.15 ja paluu noin klo 14. Muistakaa eväät, sadevarusteet ja"
+    " <strong>allekirjoitettu lupalappu</strong>.</p>"
+    "<ul><li>Kustannukset {cost} euroa</li><li>Ilmoittautuminen Wilmassa</li></ul>"
+    "<p>Ystävällisin terveisin,<br>{sender}</p>"
+)
+
+_results: dict[str, BenchmarkResult] = {}
+
+
+def synthetic_messages(
+    count: int, first_id: int = 1, start: datetime = datetime(2020, 1, 1)
+) -> list[dict[str, Any]]:
+    """Return messages shaped like the ones the coordinator stores."""
+    messages = []
+    for message_id in range(first_id, first_id + count):
+        timestamp = start + timedelta(minutes=37 * message_id)
+        sender = f"Opettaja {message_id % 40}"
+        messages.append(
+            {
+                "id": message_id,
+                "subject": f"Tiedote {message_id}",
+                "sender": sender,
+                "timestamp": timestamp.strftime("%Y-%m-%d %H:%M"),
+                "folder": "inbox",
+                "unread": message_id % 10 == 0,
+                "content_html": BODY.format(
+                    id=message_id,
+                    group=f"{message_id % 9 + 1}{'ABC'[message_id % 3]}",
+                    day=message_id % 28 + 1,
+                    month=message_id % 12 + 1,
+                    cost=message_id % 50,
+                    sender=sender,
+                ),
+            }
+        )
+    return messages
+
+
+def seed_storage(
+    hass_storage: dict[str, Any],
+    entry_id: str,
+    messages: list[dict[str, Any]],
+    compress: bool = True,
+) -> str:
+    """Write messages to the mocked storage and return the storage key."""
+    key = f"{STORAGE_KEY}_{entry_id}"
+    hass_storage[key] = {
+        "version": STORAGE_VERSION,
+        "minor_version": 1,
+        "key": key,
+        "data": _encode_messages(
+            [MessageRecord.from_dict(message) for message in messages], compress
+        ),
+    }
+    return key
+
+
+def stored_size(hass_storage: dict[str, Any], key: str) -> int:
+    """Return the size in bytes the stored data takes on disk."""
+    _, data = json_helper.prepare_save_json(hass_storage[key])
+    return len(data if isinstance(data, bytes) else data.encode())
+
+
+@dataclass
+class BenchmarkResult:
+    """Measurements of one benchmark."""
+
+    rounds: int
+    median_ms: float
+    min_ms: float
+    peak_kib: float
+    store_bytes: int | None = None
+
+
+class Benchmark:
+    """Measure an async hot path and check it against the baseline."""
+
+    def __init__(self, name: str, baseline: dict[str, Any] | None) -> None:
+        """Initialize the benchmark."""
+        self.name = name
+        self.baseline = baseline
+
+    async def __call__(
+        self,
+        func: Callable[[], Awaitable[Any]],
+        rounds: int,
+        setup: Callable[[], Awaitable[Any]] | None = None,
+        size: Callable[[], int] | None = None,
+    ) -> BenchmarkResult:
+        """Run func for a warmup round, the timed rounds and a traced round."""
+        timings = []
+        for round_number in range(rounds + 2):
+            if setup is not None:
+                await setup()
+            if round_number == rounds + 1:
+                tracemalloc.start()
+                try:
+                    await func()
+                    _, peak = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+                break
+            started = time.perf_counter()
+            await func()
+            if round_number:
+                timings.append(time.perf_counter() - started)
+
+        result = BenchmarkResult(
+            rounds=rounds,
+            median_ms=round(statistics.median(timings) * 1000, 3),
+            min_ms=round(min(timings) * 1000, 3),
+            peak_kib=round(peak / 1024, 1),
+            store_bytes=size() if size is not None else None,
+        )
+        _results[self.name] = result
+        self._check(result)
+        return result
+
+    def _check(self, result: BenchmarkResult) -> None:
+        """Fail if allocations or the store size grew past the baseline."""
+        if not self.baseline:
+            return
+        allowed_kib = self.baseline["peak_kib"] * MEMORY_TOLERANCE + MEMORY_SLACK / 1024
+        assert result.peak_kib <= allowed_kib, (
+            f"{self.name} peak memory {result.peak_kib} KiB, "
+            f"baseline {self.baseline['peak_kib']} KiB"
+        )
+        if result.store_bytes is not None and self.baseline.get("store_bytes"):
+            assert (
+                result.store_bytes <= self.baseline["store_bytes"] * SIZE_TOLERANCE
+            ), (
+                f"{self.name} store size {result.store_bytes} bytes, "
+                f"baseline {self.baseline['store_bytes']} bytes"
+            )
+
+
+def _load_baseline() -> dict[str, Any]:
+    """Return the stored baseline results."""
+    if not BASELINE_PATH.exists():
+        return {}
+    return json.loads(BASELINE_PATH.read_text())
+
+
+@pytest.fixture(scope="session")
+def benchmark_baseline() -> dict[str, Any]:
+    """Return the stored baseline results."""
+    return _load_baseline()
+
+
+@pytest.fixture
+def benchmark(request, benchmark_baseline) -> Benchmark:
+    """Return a benchmark for the current test."""
+    name = request.node.name
+    if request.config.getoption("--update-benchmark-baseline"):
+        return Benchmark(name, None)
+    return Benchmark(name, benchmark_baseline.get(name))
+
+
+def pytest_collection_modifyitems(config, items):
+    """Skip the benchmarks unless they were asked for."""
+    if config.getoption("--run-benchmarks"):
+        return
+    skip = pytest.mark.skip(reason="benchmarks run with --run-benchmarks")
+    benchmarks = Path(__file__).parent
+    for item in items:
+        if benchmarks in item.path.parents:
+            item.add_marker(skip)
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    """Report the results against the baseline and update it if asked."""
+    if not _results:
+        return
+    baseline = _load_baseline()
+    terminalreporter.section("wilma benchmarks")
+    terminalreporter.write_line(
+        f"{'benchmark':<48} {'median ms':>10} {'baseline':>10} "
+        f"{'peak KiB':>10} {'store bytes':>12}"
+    )
+    for name, result in sorted(_results.items()):
+        previous = baseline.get(name, {}).get("median_ms")
+        terminalreporter.write_line(
+            f"{name:<48} {result.median_ms:>10.3f} "
+            f"{previous if previous is not None else '-':>10} "
+            f"{result.peak_kib:>10.1f} "
+            f"{result.store_bytes if result.store_bytes is not None else '-':>12}"
+        )
+    if config.getoption("--update-benchmark-baseline"):
+        baseline.update({name: asdict(result) for name, result in _results.items()})
+        BASELINE_PATH.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+        terminalreporter.write_line(f"Baseline written to {BASELINE_PATH}")
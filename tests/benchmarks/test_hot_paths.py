@@ -0,0 +1,195 @@
+"""Benchmarks of the coordinator, store and sensor hot paths."""
+
+from unittest.mock import AsyncMock
+
+import pytest
+from homeassistant.core import HomeAssistant
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+
+from custom_components.wilma.client import WilmaResponseCache
+from custom_components.wilma.const import (
+    CONF_COMPRESS_STORAGE,
+    CONF_RETENTION_DAYS,
+    DOMAIN,
+)
+from custom_components.wilma.coordinator import WilmaCoordinator
+from custom_components.wilma.roles import async_list_messages
+from custom_components.wilma.sensor import SENSOR_DESCRIPTIONS, _create_sensor
+from custom_components.wilma.store import MessageRecord, WilmaMessageStore
+
+from ..conftest import MockWilmaMessage, make_wilma_client, patch_wilma_client
+from .conftest import (
+    ROUNDS,
+    SIZES,
+    seed_storage,
+    stored_size,
+    synthetic_messages,
+)
+
+# New messages in each round of the polls that find some
+NEW_PER_POLL = 10
+# Attribute reads in each round of the sensor benchmark
+SENSOR_READS = 1000
+# Messages in a message list, about a school year of a busy class
+LIST_SIZE = 500
+# The synthetic archive starts in 2020, only the message limit applies
+RETENTION_DAYS = 36500
+
+
+def _headers(messages):
+    """Return messages as the library returns them from a listing."""
+    return [
+        MockWilmaMessage(
+            message["id"],
+            message["subject"],
+            message["sender"],
+            message["timestamp"],
+            message["unread"],
+            message["content_html"],
+        )
+        for message in messages
+    ]
+
+
+async def _setup_coordinator(hass, hass_storage, client, size, compress=True):
+    """Return a coordinator whose store holds a synthetic archive."""
+    messages = synthetic_messages(size)
+    seed_storage(hass_storage, "bench", messages, compress)
+    coordinator = WilmaCoordinator(
+        hass,
+        "https://test.inschool.fi",
+        "testuser",
+        "testpass",
+        "bench",
+        {CONF_COMPRESS_STORAGE: compress, CONF_RETENTION_DAYS: RETENTION_DAYS},
+    )
+    # Stored messages are assumed indexed, as after the first start
+    await coordinator.messages.async_load()
+    await coordinator.archive.async_open()
+    await coordinator.messages.async_apply_retention()
+    client.get_messages.return_value = _headers(messages[-5:])
+    # Wilma reports the unread messages of the whole archive, not only the
+    # listed ones
+    client._get_unread_message_ids = AsyncMock(
+        return_value={message["id"] for message in messages if message["unread"]}
+    )
+    return coordinator
+
+
+@pytest.mark.parametrize("compress", [True, False], ids=["compressed", "plain"])
+@pytest.mark.parametrize("size", SIZES)
+async def test_store_load(hass: HomeAssistant, hass_storage, benchmark, size, compress):
+    """Benchmark loading a stored archive."""
+    seed_storage(hass_storage, "bench", synthetic_messages(size), compress)
+
+    async def load():
+        store = WilmaMessageStore(hass, "bench", compress)
+        await store.async_load()
+        assert len(store) == size
+
+    await benchmark(load, ROUNDS[size])
+
+
+@pytest.mark.parametrize("compress", [True, False], ids=["compressed", "plain"])
+@pytest.mark.parametrize("size", SIZES)
+async def test_store_save(hass: HomeAssistant, hass_storage, benchmark, size, compress):
+    """Benchmark writing an archive after one new message."""
+    key = seed_storage(hass_storage, "bench", synthetic_messages(size), compress)
+    store = WilmaMessageStore(hass, "bench", compress)
+    await store.async_load()
+    next_id = size + 1
+
+    async def add_message():
+        nonlocal next_id
+        store.merge(
+            MessageRecord.from_dict(message)
+            for message in synthetic_messages(1, next_id)
+        )
+        next_id += 1
+
+    await benchmark(
+        store.async_flush,
+        ROUNDS[size],
+        setup=add_message,
+        size=lambda: stored_size(hass_storage, key),
+    )
+
+
+@pytest.mark.parametrize("new", [0, NEW_PER_POLL], ids=["unchanged", "new"])
+@pytest.mark.parametrize("size", SIZES)
+async def test_coordinator_update(
+    hass: HomeAssistant, hass_storage, benchmark, size, new
+):
+    """Benchmark a poll against an archive, with and without new messages."""
+    client = make_wilma_client()
+    with patch_wilma_client(client):
+        coordinator = await _setup_coordinator(hass, hass_storage, client, size)
+        next_id = size + 1
+
+        async def new_messages():
+            nonlocal next_id
+            if new:
+                messages = synthetic_messages(new, next_id)
+                client.get_messages.return_value = _headers(messages)
+                client._get_unread_message_ids.return_value.update(
+                    message["id"] for message in messages if message["unread"]
+                )
+                next_id += new
+
+        async def poll():
+            coordinator.data = await coordinator._async_update_data()
+
+        try:
+            await benchmark(poll, ROUNDS[size], setup=new_messages)
+        finally:
+            await coordinator.async_flush()
+            await coordinator.archive.async_close()
+
+    assert len(coordinator.messages) == next_id - 1
+
+
+@pytest.mark.parametrize("changed", [False, True], ids=["unchanged", "changed"])
+async def test_message_list(hass: HomeAssistant, benchmark, changed):
+    """Benchmark listing messages through the response cache."""
+    client = make_wilma_client(_headers(synthetic_messages(LIST_SIZE)))
+    cache = WilmaResponseCache()
+    await async_list_messages(client, cache, None)
+    next_id = LIST_SIZE + 1
+
+    async def new_message():
+        nonlocal next_id
+        if changed:
+            client.get_messages.return_value.append(
+                _headers(synthetic_messages(1, next_id))[0]
+            )
+            next_id += 1
+
+    async def list_messages():
+        await async_list_messages(client, cache, None)
+
+    await benchmark(list_messages, ROUNDS[100], setup=new_message)
+    assert cache.misses == (ROUNDS[100] + 3 if changed else 1)
+
+
+@pytest.mark.parametrize("size", SIZES)
+async def test_sensor_attributes(hass: HomeAssistant, hass_storage, benchmark, size):
+    """Benchmark reading the state and attributes of the message sensors."""
+    client = make_wilma_client()
+    with patch_wilma_client(client):
+        coordinator = await _setup_coordinator(hass, hass_storage, client, size)
+        coordinator.data = await coordinator._async_update_data()
+        await coordinator.archive.async_close()
+
+    entry = MockConfigEntry(domain=DOMAIN, entry_id="bench")
+    sensors = [
+        _create_sensor(coordinator, description, entry)
+        for description in SENSOR_DESCRIPTIONS
+    ]
+
+    async def read_attributes():
+        for _ in range(SENSOR_READS):
+            for sensor in sensors:
+                assert sensor.native_value is not None
+                sensor.extra_state_attributes  # noqa: B018
+
+    await benchmark(read_attributes, ROUNDS[size])
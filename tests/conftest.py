@@ -1,17 +1,47 @@
 """Fixtures for Wilma integration tests."""
+import json
+from contextlib import contextmanager
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 from pytest_homeassistant_custom_component.common import MockConfigEntry
+from wilhelmina import AuthenticationError, WilmaError
 
 from custom_components.wilma.const import (
     CONF_PASSWORD,
     CONF_SERVER_URL,
     CONF_USERNAME,
     DOMAIN,
+    MESSAGE_LIST_PATH,
 )
 
 
+def pytest_addoption(parser):
+    """Add the options of the benchmark suite in tests/benchmarks."""
+    parser.addoption(
+        "--run-benchmarks",
+        action="store_true",
+        help="Run the hot path benchmarks instead of skipping them.",
+    )
+    parser.addoption(
+        "--update-benchmark-baseline",
+        action="store_true",
+        help="Write the benchmark results to tests/benchmarks/baseline.json.",
+    )
+
+
+@pytest.fixture(autouse=True)
+def auto_enable_custom_integrations(enable_custom_integrations):
+    """Enable custom integrations in all tests."""
+    yield
+
+
+@pytest.fixture(autouse=True)
+def isolated_config_dir(hass, tmp_path):
+    """Keep files written outside the mocked storage, like the archive, per test."""
+    hass.config.config_dir = str(tmp_path)
+
+
 @pytest.fixture
 def mock_config_entry():
     """Return a mock config entry."""
@@ -26,6 +56,92 @@ def mock_config_entry():
     )
 
 
+@contextmanager
+def patch_wilma_client(client):
+    """Patch every place the integration creates a Wilma client."""
+    with patch("wilhelmina.WilmaClient", return_value=client):
+        yield client
+
+
+class MockResponse:
+    """Mock JSON response of an authenticated Wilma request."""
+
+    status = 200
+
+    def __init__(self, data, content_type="application/json"):
+        """Initialize the mock response."""
+        self.data = data
+        self.content_type = content_type
+        self.content_length = None
+        self.headers = {}
+        self.content = MagicMock()
+        self.content.iter_chunked = self._iter_chunked
+
+    async def read(self):
+        """Return the body."""
+        if isinstance(self.data, bytes):
+            return self.data
+        return json.dumps(self.data).encode()
+
+    async def _iter_chunked(self, size):
+        """Yield the body in chunks."""
+        body = await self.read()
+        for start in range(0, len(body), size):
+            yield body[start : start + size]
+
+    async def json(self, *args, **kwargs):
+        """Return the decoded body."""
+        return self.data
+
+    def release(self):
+        """Release the connection."""
+
+
+def make_wilma_client(messages=None):
+    """Return a mock Wilma client that logs in and returns messages."""
+    client = MagicMock()
+    client.base_url = "https://test.inschool.fi"
+    client.session = None
+    client.user_id = "!01234"
+    client._sid = "test-sid"
+    client.login = AsyncMock()
+    # The message list of the logged in role, as a list of MockWilmaMessage
+    client.get_messages = AsyncMock(return_value=messages or [])
+    client.listed = []
+    client._get_unread_message_ids = AsyncMock(
+        side_effect=lambda: {message.id for message in client.listed if message.unread}
+    )
+
+    async def get_message_content(message_id):
+        for message in client.get_messages.return_value:
+            if message.id == message_id:
+                return message
+        raise WilmaError(f"Message {message_id} not found")
+
+    client.get_message_content = AsyncMock(side_effect=get_message_content)
+    client.close = AsyncMock()
+
+    # JSON documents served by path, for requests the library has no method for
+    client.responses = {"index_json": {"Roles": []}}
+    # Files served by path, as content type and body
+    client.files = {}
+
+    async def authenticated_request(path, *args, **kwargs):
+        if path == MESSAGE_LIST_PATH:
+            client.listed = await client.get_messages()
+            data = {"Messages": [message.as_list_item() for message in client.listed]}
+        elif path in client.responses:
+            data = client.responses[path]
+        elif path in client.files:
+            return MockResponse(*reversed(client.files[path]))
+        else:
+            raise WilmaError(f"Request failed with status 404: {path}")
+        return MockResponse(data)
+
+    client._authenticated_request = AsyncMock(side_effect=authenticated_request)
+    return client
+
+
 class MockWilmaMessage:
     """Mock Wilma message."""
 
@@ -35,9 +151,22 @@ class MockWilmaMessage:
         self.subject = subject
         self.sender = sender
         self.timestamp = timestamp
+        self.folder = "Saapuneet"
         self.unread = unread
         self.content_html = content_html
 
+    def as_list_item(self):
+        """Return the message as it appears in a message list response."""
+        return {
+            "Id": self.id,
+            "Subject": self.subject,
+            "TimeStamp": self.timestamp,
+            "Folder": self.folder,
+            "SenderId": 1,
+            "SenderType": 1,
+            "Sender": self.sender,
+        }
+
     def format_timestamp(self):
         """Return timestamp."""
         # Mock implementation
@@ -52,8 +181,10 @@ class MockWilmaMessage:
 
 
 @pytest.fixture
-def mock_wilma_client():
+def mock_wilma_client(freezer):
     """Return a mock Wilma client."""
+    # The client lists messages of the last week on the first poll
+    freezer.move_to("2023-01-03 12:00:00+00:00")
     messages = [
         MockWilmaMessage(
             1,
@@ -73,25 +204,19 @@ def mock_wilma_client():
         ),
     ]
 
-    client = MagicMock()
-    client.login = AsyncMock()
-    client.get_messages = AsyncMock(return_value=messages)
-    client.get_message_content = AsyncMock(return_value=messages[0])
-    client.close = AsyncMock()
-    
-    with patch("wilma.WilmaClient", return_value=client):
+    client = make_wilma_client(messages)
+
+    with patch_wilma_client(client):
         yield client
 
 
 @pytest.fixture
 def mock_wilma_exception_client():
     """Return a mock Wilma client that raises exceptions."""
-    from wilma import AuthenticationError
-    
-    client = MagicMock()
+    client = make_wilma_client()
     client.login = AsyncMock(side_effect=AuthenticationError("Auth failed"))
-    
-    with patch("wilma.WilmaClient", return_value=client):
+
+    with patch_wilma_client(client):
         yield client
 
 
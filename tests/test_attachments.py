@@ -0,0 +1,130 @@
+"""Test the Wilma attachment cache."""
+from http import HTTPStatus
+from unittest.mock import patch
+
+from homeassistant.core import HomeAssistant
+
+from custom_components.wilma.attachments import attachment_links
+from custom_components.wilma.const import DOMAIN
+
+from .conftest import MockWilmaMessage
+
+SERVER_URL = "https://test.inschool.fi"
+
+IMAGE = bytes(range(256)) * 4
+
+MESSAGE = MockWilmaMessage(
+    3,
+    "Field trip",
+    "Sender 1",
+    "2023-01-02 14:00",
+    True,
+    '<p><img src="/messages/image/1"> <a href="/attachment/2?name=trip.pdf">'
+    'Permission</a> <a href="/messages/3">Reply</a> '
+    '<a href="https://example.com/attachment/4">Elsewhere</a></p>',
+)
+
+
+def test_attachment_links():
+    """Test finding the Wilma files a message body links or shows."""
+    assert attachment_links(MESSAGE.content_html, SERVER_URL) == [
+        f"{SERVER_URL}/messages/image/1",
+        f"{SERVER_URL}/attachment/2?name=trip.pdf",
+    ]
+    assert attachment_links(
+        f'<img src="{SERVER_URL}/image/1#top"><img src="/image/1">', SERVER_URL
+    ) == [f"{SERVER_URL}/image/1"]
+    assert attachment_links("<p>No files</p>", SERVER_URL) == []
+
+
+async def test_attachments_cached_and_served(
+    hass: HomeAssistant, mock_wilma_client, mock_setup_integration, hass_client
+):
+    """Test that linked files are downloaded once and served to the frontend."""
+    mock_wilma_client.get_messages.return_value.append(MESSAGE)
+    mock_wilma_client.files = {
+        "/messages/image/1": ("image/png", IMAGE),
+        "/attachment/2?name=trip.pdf": ("application/pdf", IMAGE),
+    }
+    entry = await mock_setup_integration()
+    await hass.async_block_till_done(wait_background_tasks=True)
+    coordinator = hass.data[DOMAIN][entry.entry_id]
+
+    message = await coordinator.async_get_message(3)
+    image, pdf = message["attachments"]
+    assert image["url"] == f"{SERVER_URL}/messages/image/1"
+    # Identical files are stored once
+    assert image["path"] == pdf["path"]
+    assert image["path"].startswith("/api/wilma/attachment/")
+    assert coordinator.attachments.as_dict() == {"files": 1, "bytes": len(IMAGE)}
+
+    client = await hass_client()
+    response = await client.get(image["path"])
+    assert response.status == HTTPStatus.OK
+    assert response.headers["Content-Type"] == "image/png"
+    assert response.headers["Content-Disposition"].startswith("inline;")
+    assert response.headers["X-Content-Type-Options"] == "nosniff"
+    assert "immutable" in response.headers["Cache-Control"]
+    assert await response.read() == IMAGE
+
+    response = await client.get(image["path"], headers={"Range": "bytes=0-9"})
+    assert response.status == HTTPStatus.PARTIAL_CONTENT
+    assert await response.read() == IMAGE[:10]
+
+    response = await client.get("/api/wilma/attachment/0123")
+    assert response.status == HTTPStatus.NOT_FOUND
+
+    await hass.config_entries.async_remove(entry.entry_id)
+    assert coordinator.attachments.as_dict() == {"files": 0, "bytes": 0}
+
+
+async def test_attachments_served_as_downloads(
+    hass: HomeAssistant, mock_wilma_client, mock_setup_integration, hass_client
+):
+    """Test that files that could run script are only served as downloads."""
+    svg = b'<svg xmlns="http://www.w3.org/2000/svg"><script>alert(1)</script></svg>'
+    mock_wilma_client.get_messages.return_value.append(MESSAGE)
+    mock_wilma_client.files = {"/messages/image/1": ("image/svg+xml", svg)}
+    entry = await mock_setup_integration()
+    await hass.async_block_till_done(wait_background_tasks=True)
+    coordinator = hass.data[DOMAIN][entry.entry_id]
+
+    message = await coordinator.async_get_message(3)
+    client = await hass_client()
+    response = await client.get(message["attachments"][0]["path"])
+    assert response.status == HTTPStatus.OK
+    assert response.headers["Content-Type"] == "application/octet-stream"
+    assert response.headers["Content-Disposition"] == "attachment; filename*=UTF-8''1"
+    assert response.headers["X-Content-Type-Options"] == "nosniff"
+    assert await response.read() == svg
+
+
+async def test_attachments_skip_pages_and_evict(
+    hass: HomeAssistant, mock_wilma_client, mock_setup_integration
+):
+    """Test that Wilma pages are not cached and old files are evicted."""
+    mock_wilma_client.get_messages.return_value.append(MESSAGE)
+    mock_wilma_client.files = {
+        "/messages/image/1": ("text/html", b"<html>Login</html>"),
+        "/attachment/2?name=trip.pdf": ("application/pdf", IMAGE),
+    }
+    entry = await mock_setup_integration()
+    await hass.async_block_till_done(wait_background_tasks=True)
+    coordinator = hass.data[DOMAIN][entry.entry_id]
+    cache = coordinator.attachments
+
+    assert cache.lookup(entry.entry_id, f"{SERVER_URL}/messages/image/1") is None
+    pdf_url = f"{SERVER_URL}/attachment/2?name=trip.pdf"
+    first = cache.lookup(entry.entry_id, pdf_url)
+    assert first is not None
+
+    mock_wilma_client.files["/image/5"] = ("image/png", IMAGE[::-1])
+    with patch(
+        "custom_components.wilma.attachments.ATTACHMENT_CACHE_SIZE", len(IMAGE)
+    ):
+        await coordinator.async_fetch_attachments([f"{SERVER_URL}/image/5"])
+    # The least recently used file made room for the new one
+    assert cache.lookup(entry.entry_id, f"{SERVER_URL}/image/5") is not None
+    assert cache.lookup(entry.entry_id, pdf_url) is None
+    assert cache.async_use(first) is None
+    assert cache.as_dict() == {"files": 1, "bytes": len(IMAGE)}
@@ -0,0 +1,108 @@
+"""Test the Wilma message history backfill."""
+import asyncio
+from unittest.mock import patch
+
+import pytest
+from homeassistant.core import HomeAssistant
+from pytest_homeassistant_custom_component.common import async_capture_events
+
+from custom_components.wilma.const import DOMAIN, EVENT_NEW_MESSAGE, SERVICE_BACKFILL
+from custom_components.wilma.store import _decode_messages
+
+from .conftest import MockWilmaMessage
+
+OLD_MESSAGES = [
+    MockWilmaMessage(
+        10 + day,
+        f"Old {day}",
+        "Sender 3",
+        f"2022-11-{day:02} 08:00",
+        False,
+        f"<p>Old {day}</p>",
+    )
+    for day in range(1, 6)
+]
+
+
+@pytest.fixture(autouse=True)
+def fast_backfill():
+    """Backfill without waiting between requests, in small batches."""
+    with (
+        patch("custom_components.wilma.backfill.BACKFILL_REQUEST_INTERVAL", 0),
+        patch("custom_components.wilma.backfill.BACKFILL_BATCH_SIZE", 2),
+    ):
+        yield
+
+
+async def test_backfill_service(
+    hass: HomeAssistant, hass_storage, mock_wilma_client, mock_setup_integration
+):
+    """Test that the backfill stores the history the first poll skipped."""
+    mock_wilma_client.get_messages.return_value.extend(OLD_MESSAGES)
+    entry = await mock_setup_integration()
+    coordinator = hass.data[DOMAIN][entry.entry_id]
+    # The first poll imports the last week only
+    assert len(coordinator.messages) == 2
+    events = async_capture_events(hass, EVENT_NEW_MESSAGE)
+
+    response = await hass.services.async_call(
+        DOMAIN, SERVICE_BACKFILL, {}, blocking=True, return_response=True
+    )
+    assert response["active"] is True
+    await hass.async_block_till_done(wait_background_tasks=True)
+
+    assert len(coordinator.messages) == 7
+    assert (await coordinator.async_get_message(11))["content_markdown"] == "Old 1"
+    assert (await coordinator.archive.async_search(query="old"))["total"] == 5
+    # Old messages are not news
+    assert events == []
+    # Every batch is written right away
+    stored = hass_storage[f"wilma_messages_{entry.entry_id}"]["data"]
+    assert len(_decode_messages(stored)) == 7
+    state = hass_storage[f"wilma_backfill_{entry.entry_id}"]["data"]
+    assert state["active"] is False
+    assert state["fetched"] == 5
+    assert state["remaining"] == 0
+    # The polls still start from the watermark of the newest message
+    assert coordinator.messages.watermark.ids == {2}
+
+
+async def test_backfill_resumes_after_restart(
+    hass: HomeAssistant, hass_storage, mock_wilma_client, mock_setup_integration
+):
+    """Test that an interrupted backfill continues with the missing messages."""
+    mock_wilma_client.get_messages.return_value.extend(OLD_MESSAGES)
+    entry = await mock_setup_integration()
+    coordinator = hass.data[DOMAIN][entry.entry_id]
+
+    bodies = mock_wilma_client.get_message_content.side_effect
+
+    async def stop_after_first_batch(message_id):
+        # Newest first, the first batch is messages 15 and 14
+        if message_id >= 14:
+            return await bodies(message_id)
+        raise asyncio.CancelledError
+
+    mock_wilma_client.get_message_content.side_effect = stop_after_first_batch
+    coordinator.backfill.async_start(entry)
+    await hass.async_block_till_done(wait_background_tasks=True)
+    assert 15 in coordinator.messages
+    assert 13 not in coordinator.messages
+    state = hass_storage[f"wilma_backfill_{entry.entry_id}"]["data"]
+    assert state["active"] is True
+    assert state["fetched"] == 2
+
+    mock_wilma_client.get_message_content.side_effect = bodies
+    mock_wilma_client.get_message_content.reset_mock()
+    assert await hass.config_entries.async_reload(entry.entry_id)
+    await hass.async_block_till_done(wait_background_tasks=True)
+
+    coordinator = hass.data[DOMAIN][entry.entry_id]
+    assert len(coordinator.messages) == 7
+    # Only the messages missing from the store were fetched again
+    assert sorted(
+        call.args[0] for call in mock_wilma_client.get_message_content.call_args_list
+    ) == [11, 12, 13]
+    state = hass_storage[f"wilma_backfill_{entry.entry_id}"]["data"]
+    assert state["active"] is False
+    assert state["fetched"] == 5
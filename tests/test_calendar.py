@@ -0,0 +1,156 @@
+"""Test the Wilma schedule calendar."""
+
+from datetime import date, datetime, timedelta
+
+from homeassistant.components.calendar import CalendarEvent
+from homeassistant.core import HomeAssistant
+from homeassistant.util import dt as dt_util
+
+from custom_components.wilma.schedule import EventIndex, parse_exams, parse_schedule
+
+SCHEDULE = {
+    "Schedule": [
+        {
+            "Day": 1,
+            "Start": "8:15",
+            "End": "9:45",
+            "Groups": [
+                {
+                    "ShortCaption": "MA1",
+                    "Caption": "Matematiikka",
+                    "Teachers": [{"Caption": "ABC", "LongCaption": "Anna Opettaja"}],
+                    "Rooms": [{"Caption": "A101"}],
+                }
+            ],
+        },
+        {"Day": 3, "Start": "10:00", "End": "11:00", "Groups": [{"Caption": "Kemia"}]},
+        {"Day": 9, "Start": "10:00", "End": "11:00"},
+    ]
+}
+
+
+def _event(start: datetime, hours: float, summary: str) -> CalendarEvent:
+    return CalendarEvent(
+        start=start, end=start + timedelta(hours=hours), summary=summary
+    )
+
+
+def test_parse_schedule():
+    """Test turning a schedule week into calendar events."""
+    tz = dt_util.get_default_time_zone()
+    events = parse_schedule(SCHEDULE, date(2024, 10, 7), tz, "test")
+
+    assert [event.summary for event in events] == ["Matematiikka", "Kemia"]
+    assert events[0].start == datetime(2024, 10, 7, 8, 15, tzinfo=tz)
+    assert events[0].description == "Anna Opettaja"
+    assert events[0].location == "A101"
+    assert events[1].start == datetime(2024, 10, 9, 10, 0, tzinfo=tz)
+
+
+def test_parse_exams():
+    """Test turning exams into all day and timed events."""
+    tz = dt_util.get_default_time_zone()
+    events = parse_exams(
+        {
+            "Exams": [
+                {"Date": "2024-10-10", "Course": "MA1", "Name": "Derivaatta"},
+                {
+                    "Date": "11.10.2024",
+                    "Course": "KE1",
+                    "Start": "9:00",
+                    "End": "10:30",
+                },
+                {"Date": "someday"},
+            ]
+        },
+        tz,
+        "test",
+    )
+
+    assert [event.summary for event in events] == [
+        "Exam: MA1 - Derivaatta",
+        "Exam: KE1",
+    ]
+    assert events[0].all_day
+    assert events[1].end == datetime(2024, 10, 11, 10, 30, tzinfo=tz)
+
+
+def test_event_index():
+    """Test range queries and per group replacement on the event index."""
+    tz = dt_util.get_default_time_zone()
+    monday = datetime(2024, 10, 7, tzinfo=tz)
+    index = EventIndex()
+    index.replace(
+        "week1",
+        [
+            _event(monday + timedelta(hours=8), 1, "first"),
+            _event(monday + timedelta(hours=10), 1, "second"),
+            _event(monday + timedelta(days=1, hours=8), 1, "tuesday"),
+        ],
+    )
+    index.replace("long", [_event(monday + timedelta(hours=6), 6, "long")])
+
+    def summaries(start, end):
+        return [event.summary for event in index.query(start, end)]
+
+    # Events that started before the range but still overlap it are found
+    assert summaries(
+        monday + timedelta(hours=10, minutes=30), monday + timedelta(hours=11)
+    ) == ["long", "second"]
+    assert summaries(monday, monday + timedelta(days=2)) == [
+        "long",
+        "first",
+        "second",
+        "tuesday",
+    ]
+    assert summaries(monday + timedelta(hours=12), monday + timedelta(hours=13)) == []
+    assert index.next_event(monday + timedelta(hours=12)).summary == "tuesday"
+
+    index.replace("week1", [_event(monday + timedelta(hours=9), 1, "moved")])
+    index.remove("long")
+    assert len(index) == 1
+    assert summaries(monday, monday + timedelta(days=2)) == ["moved"]
+    assert (
+        summaries(
+            monday + timedelta(hours=10, minutes=30), monday + timedelta(hours=11)
+        )
+        == []
+    )
+
+
+async def test_schedule_calendar(
+    hass: HomeAssistant, mock_wilma_client, mock_setup_integration
+):
+    """Test the schedule calendar entity."""
+    mock_wilma_client.responses["{user_id}/schedule/index_json"] = SCHEDULE
+    mock_wilma_client.responses["{user_id}/exams/index_json"] = {
+        "Exams": [{"Date": dt_util.now().date().isoformat(), "Course": "MA1"}]
+    }
+    entry = await mock_setup_integration()
+
+    assert hass.states.get("calendar.schedule") is not None
+
+    now = dt_util.now()
+    monday = dt_util.start_of_local_day(now - timedelta(days=now.weekday()))
+    response = await hass.services.async_call(
+        "calendar",
+        "get_events",
+        {"start_date_time": monday, "end_date_time": monday + timedelta(days=7)},
+        target={"entity_id": "calendar.schedule"},
+        blocking=True,
+        return_response=True,
+    )
+    summaries = [event["summary"] for event in response["calendar.schedule"]["events"]]
+    assert summaries.count("Matematiikka") == 1
+    assert summaries.count("Kemia") == 1
+    assert "Exam: MA1" in summaries
+
+    # Later refreshes only fetch the current week again
+    schedule = hass.data["wilma"][entry.entry_id].schedule
+    calls = mock_wilma_client._authenticated_request.call_count
+    await schedule.async_refresh()
+    paths = [
+        call.args[0]
+        for call in mock_wilma_client._authenticated_request.call_args_list[calls:]
+    ]
+    assert paths == ["{user_id}/schedule/index_json", "{user_id}/exams/index_json"]
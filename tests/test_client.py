@@ -0,0 +1,327 @@
+"""Test the shared Wilma client pool."""
+import asyncio
+import json
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import aiohttp
+import pytest
+from aiohttp import hdrs, web
+from aiohttp.test_utils import TestServer
+from homeassistant.core import HomeAssistant
+from yarl import URL
+
+from custom_components.wilma.client import (
+    WilmaHostGovernor,
+    WilmaHostUnavailable,
+    WilmaResponseCache,
+    WilmaSessionCache,
+    async_get_client_pool,
+    async_get_unread_message_ids,
+)
+from custom_components.wilma.const import (
+    GOVERNOR_CONCURRENCY,
+    GOVERNOR_FAILURE_THRESHOLD,
+)
+from custom_components.wilma.roles import async_list_messages
+
+
+async def test_pool_shares_clients_per_account(hass: HomeAssistant):
+    """Test that clients are shared by server URL and username."""
+    pool = async_get_client_pool(hass)
+    assert async_get_client_pool(hass) is pool
+
+    first = pool.async_acquire("https://test.inschool.fi", "testuser")
+    second = pool.async_acquire("https://test.inschool.fi/", "testuser")
+    other = pool.async_acquire("https://test.inschool.fi", "otheruser")
+
+    assert first is second
+    assert other is not first
+    # Accounts on the same host must not share cookies
+    assert other.session is not first.session
+    assert other.session.cookie_jar is not first.session.cookie_jar
+    # but they share Home Assistant's connector
+    assert other.session.connector is first.session.connector
+
+    await pool.async_release("https://test.inschool.fi", "otheruser")
+    await pool.async_release("https://test.inschool.fi", "testuser")
+    await pool.async_release("https://test.inschool.fi", "testuser")
+
+
+async def test_pool_closes_client_on_last_release(hass: HomeAssistant):
+    """Test that a client is closed only when its last user releases it."""
+    pool = async_get_client_pool(hass)
+    client = pool.async_acquire("https://test.inschool.fi", "testuser")
+    pool.async_acquire("https://test.inschool.fi", "testuser")
+    session = client.session
+    connector = session.connector
+
+    with patch.object(client, "close", AsyncMock()) as close:
+        await pool.async_release("https://test.inschool.fi", "testuser")
+        close.assert_not_called()
+
+        await pool.async_release("https://test.inschool.fi", "testuser")
+        close.assert_called_once()
+
+    # The shared connector stays open for other integrations
+    assert session.connector is None
+    assert not connector.closed
+    assert pool.async_acquire("https://test.inschool.fi", "testuser") is not client
+
+
+async def test_unread_message_ids():
+    """Test that unread messages are found with the library, if it can."""
+    client = MagicMock()
+    client._get_unread_message_ids = AsyncMock(return_value={1, 3})
+    assert await async_get_unread_message_ids(client) == {1, 3}
+
+    # A library version without the private method reports every message read
+    assert await async_get_unread_message_ids(MagicMock(spec=[])) == set()
+
+
+async def test_session_cache_round_trip(hass: HomeAssistant, hass_storage):
+    """Test that a session is persisted encrypted and restored into a client."""
+    pool = async_get_client_pool(hass)
+    client = pool.async_acquire("https://test.inschool.fi", "testuser")
+    client.user_id = "!01234"
+    client._sid = "secret-sid"
+    client.session.cookie_jar.update_cookies(
+        {"Wilma2SID": "secret-sid"}, URL("https://test.inschool.fi")
+    )
+
+    cache = WilmaSessionCache(hass, "test", "testuser", "testpass")
+    await cache.async_save(client)
+    stored = hass_storage["wilma_session_test"]
+    assert "secret-sid" not in str(stored)
+
+    restored = pool.async_acquire("https://test.inschool.fi", "otheruser")
+    assert await WilmaSessionCache(
+        hass, "test", "testuser", "testpass"
+    ).async_restore(restored)
+    assert restored.user_id == "!01234"
+    assert restored._sid == "secret-sid"
+    assert restored.username == "testuser"
+    assert restored.password == "testpass"
+    cookies = restored.session.cookie_jar.filter_cookies(
+        URL("https://test.inschool.fi")
+    )
+    assert cookies["Wilma2SID"].value == "secret-sid"
+
+    # A changed password cannot read the old session
+    assert not await WilmaSessionCache(
+        hass, "test", "testuser", "newpass"
+    ).async_restore(pool.async_acquire("https://test.inschool.fi", "third"))
+
+    await cache.async_clear()
+    assert "wilma_session_test" not in hass_storage
+
+
+async def test_pool_counts_traffic(hass: HomeAssistant, socket_enabled):
+    """Test that the requests and bytes of a client session are counted."""
+
+    async def handler(request):
+        return web.Response(text="x" * 1000)
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    async with TestServer(app) as server:
+        pool = async_get_client_pool(hass)
+        client = pool.async_acquire("https://test.inschool.fi", "testuser")
+        counter = pool.traffic("https://test.inschool.fi", "testuser")
+
+        for _ in range(2):
+            async with client.session.get(server.make_url("/")) as response:
+                await response.read()
+
+        assert counter.requests == 2
+        assert counter.bytes_received == 2000
+
+        await pool.async_release("https://test.inschool.fi", "testuser")
+    assert pool.traffic("https://test.inschool.fi", "testuser") is not counter
+
+
+
+async def test_governor_circuit_breaker(hass: HomeAssistant, socket_enabled, freezer):
+    """Test that a failing host is not sent requests until a probe succeeds."""
+    status = 503
+    served = 0
+
+    async def handler(request):
+        nonlocal served
+        served += 1
+        return web.Response(status=status)
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    async with TestServer(app) as server:
+        pool = async_get_client_pool(hass)
+        client = pool.async_acquire("https://test.inschool.fi", "testuser")
+        other = pool.async_acquire("https://test.inschool.fi", "otheruser")
+        governor = pool.governor("https://test.inschool.fi/")
+
+        for _ in range(3):
+            async with client.session.get(server.make_url("/")):
+                pass
+        assert governor.circuit_open
+        # Every account on the host is refused, without a request
+        with pytest.raises(WilmaHostUnavailable):
+            await other.session.get(server.make_url("/"))
+        assert served == 3
+
+        # After the reset timeout one failed probe opens it for twice as long
+        freezer.tick(61)
+        async with other.session.get(server.make_url("/")):
+            pass
+        assert served == 4
+        assert governor.as_dict()["reset_timeout"] == 120
+        freezer.tick(61)
+        with pytest.raises(WilmaHostUnavailable):
+            await client.session.get(server.make_url("/"))
+
+        # A successful probe closes it
+        status = 200
+        freezer.tick(60)
+        async with client.session.get(server.make_url("/")):
+            pass
+        assert not governor.circuit_open
+        assert governor.as_dict()["consecutive_failures"] == 0
+        assert governor.rejected == 2
+
+        await pool.async_release("https://test.inschool.fi", "otheruser")
+        await pool.async_release("https://test.inschool.fi", "testuser")
+
+
+async def test_governor_cancelled_probe(freezer):
+    """Test that a probe cancelled while it waits for a slot frees the circuit."""
+    governor = WilmaHostGovernor("test.inschool.fi")
+    for _ in range(GOVERNOR_FAILURE_THRESHOLD):
+        governor._record_failure(SimpleNamespace())
+    assert governor.circuit_open
+    freezer.tick(61)
+
+    # Every slot is taken, the probe waits for one
+    for _ in range(GOVERNOR_CONCURRENCY):
+        await governor._slots.acquire()
+    probe = asyncio.ensure_future(
+        governor._async_on_request_start(None, SimpleNamespace(), None)
+    )
+    await asyncio.sleep(0)
+    assert governor.circuit_open
+    probe.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await probe
+
+    # The next request probes the host instead
+    assert not governor.circuit_open
+    governor.check()
+
+
+async def test_governor_rate_limit(hass: HomeAssistant, socket_enabled):
+    """Test that requests beyond the burst wait for the token bucket."""
+
+    async def handler(request):
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    with (
+        patch("custom_components.wilma.client.GOVERNOR_BURST", 2),
+        patch("custom_components.wilma.client.GOVERNOR_RATE", 100.0),
+    ):
+        async with TestServer(app) as server:
+            pool = async_get_client_pool(hass)
+            client = pool.async_acquire("https://test.inschool.fi", "testuser")
+            governor = pool.governor("https://test.inschool.fi")
+
+            for _ in range(3):
+                async with client.session.get(server.make_url("/")):
+                    pass
+
+            assert governor.throttled == 1
+            assert not governor.circuit_open
+            await pool.async_release("https://test.inschool.fi", "testuser")
+
+def _list_item(message_id, timestamp):
+    """Return a message as listed by Wilma."""
+    return {
+        "Id": message_id,
+        "Subject": f"Message {message_id}",
+        "TimeStamp": timestamp,
+        "Folder": "Saapuneet",
+        "SenderId": 1,
+        "SenderType": 1,
+        "Sender": "Opettaja",
+    }
+
+
+@pytest.mark.parametrize("validators", [True, False], ids=["etag", "digest"])
+async def test_response_cache_conditional_list(
+    hass: HomeAssistant, socket_enabled, validators
+):
+    """Test that an unchanged message list is neither sent nor parsed again."""
+    listed = {"Messages": [_list_item(1, "2023-01-01 12:00")]}
+    requests = []
+
+    async def handler(request):
+        body = json.dumps(listed)
+        etag = f'"{len(body)}"'
+        requests.append(dict(request.headers))
+        if validators and request.headers.get(hdrs.IF_NONE_MATCH) == etag:
+            return web.Response(status=304)
+        headers = {hdrs.ETAG: etag} if validators else {}
+        return web.Response(
+            text=body, content_type="application/json", headers=headers
+        )
+
+    app = web.Application()
+    app.router.add_get("/!01234/messages/list", handler)
+    async with TestServer(app) as server:
+        pool = async_get_client_pool(hass)
+        client = pool.async_acquire(str(server.make_url("")), "testuser")
+        client.user_id = "!01234"
+        client._sid = "test-sid"
+        cache = WilmaResponseCache()
+
+        first = await async_list_messages(client, cache, None)
+        assert [message.id for message in first] == [1]
+        assert hdrs.IF_NONE_MATCH not in requests[0]
+
+        with patch(
+            "wilhelmina.Message.from_dict", side_effect=AssertionError
+        ) as from_dict:
+            second = await async_list_messages(client, cache, None)
+        from_dict.assert_not_called()
+        assert second == first
+        assert (hdrs.IF_NONE_MATCH in requests[1]) is validators
+        assert cache.as_dict() == {"paths": 1, "hits": 1, "misses": 1}
+
+        # A new message changes the list, the cursor filters the old one
+        listed["Messages"].append(_list_item(2, "2023-01-02 12:00"))
+        third = await async_list_messages(client, cache, datetime(2023, 1, 1, 12))
+        assert [message.id for message in third] == [2]
+        assert cache.misses == 2
+
+        await pool.async_release(str(server.make_url("")), "testuser")
+
+
+async def test_response_cache_rejected_session(hass: HomeAssistant, socket_enabled):
+    """Test that an HTML answer to the list request is not cached."""
+
+    async def handler(request):
+        return web.Response(text="<html>Login</html>", content_type="text/html")
+
+    app = web.Application()
+    app.router.add_get("/!01234/messages/list", handler)
+    async with TestServer(app) as server:
+        pool = async_get_client_pool(hass)
+        client = pool.async_acquire(str(server.make_url("")), "testuser")
+        client.user_id = "!01234"
+        client._sid = "test-sid"
+        cache = WilmaResponseCache()
+
+        with pytest.raises(aiohttp.ContentTypeError):
+            await async_list_messages(client, cache, None)
+        assert cache.as_dict()["paths"] == 0
+
+        await pool.async_release(str(server.make_url("")), "testuser")
@@ -6,12 +6,17 @@ from homeassistant import config_entries, data_entry_flow
 from pytest_homeassistant_custom_component.common import MockConfigEntry
 
 from custom_components.wilma.const import (
+    CONF_ACTIVE_SCAN_INTERVAL,
+    CONF_BODY_FETCH_CONCURRENCY,
     CONF_PASSWORD,
+    CONF_SCHOOL_DAY_START,
     CONF_SERVER_URL,
     CONF_USERNAME,
     DOMAIN,
 )
 
+from .conftest import make_wilma_client, patch_wilma_client
+
 
 async def test_form(hass, mock_wilma_client):
     """Test we get the form."""
@@ -89,4 +94,58 @@ async def test_duplicate_entries(hass, mock_wilma_client):
     )
 
     # Should still allow creating, as we don't set unique_id in the integration yet
-    assert result["type"] == data_entry_flow.FlowResultType.CREATE_ENTRY
\ No newline at end of file
+    assert result["type"] == data_entry_flow.FlowResultType.CREATE_ENTRY
+
+async def test_form_leaves_running_client_alone(
+    hass, mock_wilma_client, mock_setup_integration
+):
+    """Test that validating a configured account uses a client of its own."""
+    entry = await mock_setup_integration()
+    coordinator = hass.data[DOMAIN][entry.entry_id]
+    mock_wilma_client.login.reset_mock()
+    validating_client = make_wilma_client()
+
+    result = await hass.config_entries.flow.async_init(
+        DOMAIN, context={"source": config_entries.SOURCE_USER}
+    )
+    with (
+        patch_wilma_client(validating_client),
+        patch("custom_components.wilma.async_setup_entry", return_value=True),
+    ):
+        result = await hass.config_entries.flow.async_configure(
+            result["flow_id"],
+            {
+                CONF_SERVER_URL: "https://test.inschool.fi",
+                CONF_USERNAME: "testuser",
+                CONF_PASSWORD: "testpass",
+            },
+        )
+
+    assert result["type"] == data_entry_flow.FlowResultType.CREATE_ENTRY
+    validating_client.login.assert_awaited_once_with("testuser", "testpass")
+    validating_client.close.assert_awaited_once()
+    mock_wilma_client.login.assert_not_called()
+    mock_wilma_client.close.assert_not_called()
+    assert coordinator.client is mock_wilma_client
+
+
+async def test_options_flow(hass, mock_setup_integration):
+    """Test changing the options reloads the entry with the new values."""
+    entry = await mock_setup_integration()
+
+    result = await hass.config_entries.options.async_init(entry.entry_id)
+    assert result["type"] == data_entry_flow.FlowResultType.FORM
+    assert result["step_id"] == "init"
+
+    result = await hass.config_entries.options.async_configure(
+        result["flow_id"],
+        {CONF_BODY_FETCH_CONCURRENCY: 5, CONF_SCHOOL_DAY_START: "08:00:00"},
+    )
+    await hass.async_block_till_done()
+
+    assert result["type"] == data_entry_flow.FlowResultType.CREATE_ENTRY
+    assert entry.options[CONF_BODY_FETCH_CONCURRENCY] == 5
+    assert entry.options[CONF_ACTIVE_SCAN_INTERVAL] == 15
+    coordinator = hass.data[DOMAIN][entry.entry_id]
+    assert coordinator.options == entry.options
+    assert coordinator.scheduler.school_day_start.hour == 8
@@ -1,12 +1,30 @@
 """Test the Wilma data update coordinator."""
-from unittest.mock import AsyncMock, MagicMock, patch
+import asyncio
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
 
+import aiohttp
 import pytest
 from homeassistant.core import HomeAssistant
 from homeassistant.helpers.update_coordinator import UpdateFailed
-from wilma import AuthenticationError, WilmaError
+from homeassistant.util import dt as dt_util
+from pytest_homeassistant_custom_component.common import (
+    async_capture_events,
+    async_fire_time_changed,
+)
+from wilhelmina import AuthenticationError, WilmaError
 
+from custom_components.wilma.const import (
+    CONF_BODY_FETCH_CONCURRENCY,
+    CONF_COMPRESS_STORAGE,
+    CONF_RETENTION_MESSAGES,
+    EVENT_NEW_MESSAGE,
+)
 from custom_components.wilma.coordinator import WilmaCoordinator
+from custom_components.wilma.store import MessageRecord, pack_message, unpack_message
+
+from .conftest import MockWilmaMessage, make_wilma_client, patch_wilma_client
 
 
 async def test_coordinator_update(hass, mock_wilma_client):
@@ -15,63 +33,682 @@ async def test_coordinator_update(hass, mock_wilma_client):
     coordinator = WilmaCoordinator(
         hass, "https://test.inschool.fi", "testuser", "testpass", "test_entry_id"
     )
-    
+    await coordinator._async_setup()
+
     # Test update
     data = await coordinator._async_update_data()
-    
+
     # Verify results
-    assert "messages" in data
-    assert len(data["messages"]) == 2
-    
-    assert data["latest_message"].id == 1
-    assert data["latest_message"].subject == "Test Message 1"
-    
+    assert data["message_count"] == 2
+    assert len(coordinator.messages) == 2
+
+    assert data["latest_message"].id == 2
+    assert data["latest_message"].subject == "Test Message 2"
+
     assert data["latest_unread_message"].id == 1
     assert data["latest_unread_message"].unread is True
-    
-    assert "last_update" in data
-    
+
+    assert data["unread_count"] == 1
+    assert data["latest_id"] == 2
+    assert coordinator.last_update_success_time is not None
+
     # Verify client was initialized and called properly
     assert coordinator.client is not None
     mock_wilma_client.login.assert_called_once_with("testuser", "testpass")
     mock_wilma_client.get_messages.assert_called_once()
+    # Headers are listed without bodies, bodies are fetched per new message
+    assert mock_wilma_client.get_message_content.call_count == 2
+    assert data["markdown"][2] == "Test content 2"
+
+
+async def test_coordinator_stable_snapshot(hass, mock_wilma_client):
+    """Test that polls without changes keep the snapshot and notify no one."""
+    coordinator = WilmaCoordinator(
+        hass, "https://test.inschool.fi", "testuser", "testpass", "test_entry_id"
+    )
+    await coordinator._async_setup()
+    await coordinator.async_refresh()
+    snapshot = coordinator.data
+    updates = []
+    coordinator.async_add_listener(lambda: updates.append(coordinator.data))
+
+    await coordinator.async_refresh()
+    assert coordinator.data is snapshot
+    assert updates == []
+
+    mock_wilma_client.get_messages.return_value = [
+        *mock_wilma_client.get_messages.return_value,
+        MockWilmaMessage(3, "New", "Sender 3", "2023-01-03 08:00", True, "<p>3</p>"),
+    ]
+    await coordinator.async_refresh()
+    assert len(updates) == 1
+    assert coordinator.data["latest_id"] == 3
+    assert coordinator.data["unread_count"] == 2
+    assert coordinator.data["revision"] > snapshot["revision"]
+
+
+async def test_coordinator_dedups_messages(hass, mock_wilma_client):
+    """Test that messages returned again by Wilma are stored only once."""
+    coordinator = WilmaCoordinator(
+        hass, "https://test.inschool.fi", "testuser", "testpass", "test_entry_id"
+    )
+    await coordinator._async_setup()
+
+    await coordinator._async_update_data()
+    assert coordinator.new_message_ids == [1, 2]
+
+    data = await coordinator._async_update_data()
+    assert data["message_count"] == 2
+    assert coordinator.new_message_ids == []
+    # Known messages never have their bodies fetched again
+    assert mock_wilma_client.get_message_content.call_count == 2
+    # The cursor backs off one minute from the watermark so that messages
+    # sharing the newest timestamp are not skipped
+    after = coordinator._cursor(coordinator.messages)
+    assert after.isoformat() == "2023-01-02T11:59:00"
+
+
+async def test_coordinator_watermark_boundary(hass, hass_storage, mock_wilma_client):
+    """Test that a late message in the watermark minute is merged once."""
+    coordinator = WilmaCoordinator(
+        hass, "https://test.inschool.fi", "testuser", "testpass", "test_entry_id"
+    )
+    await coordinator._async_setup()
+    await coordinator._async_update_data()
+
+    mock_wilma_client.get_messages.return_value = [
+        MockWilmaMessage(2, "Test Message 2", "Sender 2", "2023-01-02 12:00"),
+        MockWilmaMessage(3, "Late", "Sender 3", "2023-01-02 12:00", False, "<p>3</p>"),
+    ]
+    data = await coordinator._async_update_data()
+
+    assert coordinator.new_message_ids == [3]
+    assert data["message_count"] == 3
+    await coordinator.messages.async_flush()
+    watermark = hass_storage["wilma_messages_test_entry_id"]["data"]["watermark"]
+    assert watermark == {"timestamp": "2023-01-02T12:00:00", "ids": [2, 3]}
+
+
+async def test_message_store_merge_newest_first(hass):
+    """Test that every new message of a newest first batch is merged."""
+    coordinator = WilmaCoordinator(
+        hass, "https://test.inschool.fi", "testuser", "testpass", "test_entry_id"
+    )
+    store = coordinator.messages
+    assert store.merge(
+        [MessageRecord.from_dict({"id": 1, "timestamp": "2023-01-01 08:00"})]
+    ) == [1]
+
+    # Wilma lists the newest message first
+    batch = [
+        MessageRecord.from_dict({"id": msg_id, "timestamp": timestamp})
+        for msg_id, timestamp in (
+            (4, "2023-01-03 08:00"),
+            (3, "2023-01-02 09:00"),
+            (2, "2023-01-02 08:00"),
+        )
+    ]
+    assert store.merge(batch) == [4, 3, 2]
+    assert [message.id for message in store.range()] == [1, 2, 3, 4]
+    assert store.watermark.timestamp == datetime(2023, 1, 3, 8, 0)
+    assert store.merge(batch) == []
+
+
+async def test_coordinator_body_fetch_concurrency(hass, mock_wilma_client):
+    """Test that body downloads run in parallel under the configured limit."""
+    mock_wilma_client.get_messages.return_value = [
+        MockWilmaMessage(i, f"Subject {i}", "Sender", f"2023-01-01 12:{i:02}")
+        for i in range(10)
+    ]
+    running = peak = 0
+
+    async def get_message_content(message_id):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0)
+        running -= 1
+        return MockWilmaMessage(
+            message_id, "", "", "", content_html=f"<p>{message_id}</p>"
+        )
+
+    mock_wilma_client.get_message_content.side_effect = get_message_content
+    coordinator = WilmaCoordinator(
+        hass,
+        "https://test.inschool.fi",
+        "testuser",
+        "testpass",
+        "test_entry_id",
+        options={CONF_BODY_FETCH_CONCURRENCY: 4},
+    )
+    await coordinator._async_setup()
+
+    data = await coordinator._async_update_data()
+
+    assert data["message_count"] == 10
+    assert peak == 4
+    assert coordinator.messages.get(7).content_html == "<p>7</p>"
+
+
+async def test_coordinator_fetches_missing_body_lazily(hass, mock_wilma_client):
+    """Test that a body that failed to download is fetched when it is read."""
+    for message in mock_wilma_client.get_messages.return_value:
+        message.content_html = None
+    mock_wilma_client.get_message_content.side_effect = WilmaError("Timeout")
+    coordinator = WilmaCoordinator(
+        hass, "https://test.inschool.fi", "testuser", "testpass", "test_entry_id"
+    )
+    await coordinator._async_setup()
+
+    data = await coordinator._async_update_data()
+    assert data["message_count"] == 2
+    assert coordinator.messages.get(1).content_html is None
+
+    mock_wilma_client.get_message_content.side_effect = None
+    mock_wilma_client.get_message_content.return_value = MockWilmaMessage(
+        1, "", "", "", content_html="<p>Body</p>"
+    )
+    message = await coordinator.async_get_message(1)
+
+    assert message["content_html"] == "<p>Body</p>"
+    assert message["content_markdown"] == "Body"
+    assert await coordinator.async_get_message(99) is None
+
+
+async def test_coordinator_loads_store_once(hass, hass_storage, mock_wilma_client):
+    """Test that the persisted messages are read at setup and kept in memory."""
+    hass_storage["wilma_messages_test_entry_id"] = {
+        "version": 1,
+        "key": "wilma_messages_test_entry_id",
+        "data": {
+            "messages": [
+                {
+                    "id": 3,
+                    "subject": "Stored",
+                    "sender": "Sender 3",
+                    "timestamp": "2023-01-03 08:00",
+                }
+            ]
+        },
+    }
+    coordinator = WilmaCoordinator(
+        hass, "https://test.inschool.fi", "testuser", "testpass", "test_entry_id"
+    )
+    await coordinator._async_setup()
+    mock_wilma_client.get_messages.return_value = []
+
+    data = await coordinator._async_update_data()
+
+    assert data["latest_message"].id == 3
+    assert coordinator.messages.watermark.ids == {3}
+    # Messages stored before the archive existed are indexed at setup
+    assert (await coordinator.archive.async_search(query="stored"))["total"] == 1
+    after = coordinator._cursor(coordinator.messages)
+    assert after.isoformat() == "2023-01-03T07:59:00"
+    # The version 1 store is migrated to the compact schema
+    stored = hass_storage["wilma_messages_test_entry_id"]
+    assert stored["version"] == 2
+    assert stored["data"]["messages"] == [
+        {"i": 3, "s": "Stored", "f": "Sender 3", "t": "2023-01-03 08:00"}
+    ]
+
+
+async def test_message_store_delayed_save(hass, hass_storage, mock_wilma_client):
+    """Test that changes are written once, after the save delay."""
+    coordinator = WilmaCoordinator(
+        hass, "https://test.inschool.fi", "testuser", "testpass", "test_entry_id"
+    )
+    await coordinator._async_setup()
+    await coordinator._async_update_data()
+    assert "wilma_messages_test_entry_id" not in hass_storage
+
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=31))
+    await hass.async_block_till_done()
+    stored = hass_storage.pop("wilma_messages_test_entry_id")["data"]
+    assert "messages" not in stored
+    # Renderings are converted again from the bodies, not stored
+    assert "markdown" not in stored
+    assert stored["watermark"]["ids"] == [2]
+
+    # Polls without changes do not write
+    await coordinator._async_update_data()
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=62))
+    await hass.async_block_till_done()
+    assert "wilma_messages_test_entry_id" not in hass_storage
+
+    # Compressed messages round trip without the Markdown renderings
+    hass_storage["wilma_messages_test_entry_id"] = {
+        "version": 2,
+        "key": "wilma_messages_test_entry_id",
+        "data": stored,
+    }
+    restarted = WilmaCoordinator(
+        hass, "https://test.inschool.fi", "testuser", "testpass", "test_entry_id"
+    )
+    await restarted._async_setup()
+    message = restarted.messages.get(1)
+    assert message.content_html == "<p>Test content 1</p>"
+    assert message.unread is True
+    assert (await restarted.async_get_message(1))["content_markdown"] == (
+        "Test content 1"
+    )
+
+
+async def test_message_store_uncompressed(hass, hass_storage, mock_wilma_client):
+    """Test the plain compact schema used when compression is disabled."""
+    coordinator = WilmaCoordinator(
+        hass,
+        "https://test.inschool.fi",
+        "testuser",
+        "testpass",
+        "test_entry_id",
+        options={CONF_COMPRESS_STORAGE: False},
+    )
+    await coordinator._async_setup()
+    await coordinator._async_update_data()
+    await coordinator.messages.async_flush()
+
+    stored = hass_storage["wilma_messages_test_entry_id"]["data"]
+    assert stored["messages"][1] == {
+        "i": 2,
+        "s": "Test Message 2",
+        "f": "Sender 2",
+        "t": "2023-01-02 12:00",
+        "d": "Saapuneet",
+        "h": "<p>Test content 2</p>",
+    }
+
+
+def test_message_record():
+    """Test the compact message record and its storage schema."""
+    body = "<p>" + "Retkipäivä " * 200 + "</p>"
+    message = MockWilmaMessage(1, "Subject", "Opettaja " + "A", "2023-01-02 08:00")
+    message.content_html = body
+    record = MessageRecord.from_message(message)
+
+    # The library message is left as it was
+    assert message.timestamp == "2023-01-02 08:00"
+    assert record.timestamp == datetime(2023, 1, 2, 8, 0)
+    assert record.sender is MessageRecord(2, sender="Opettaja A").sender
+    # Long bodies are compressed in memory
+    assert isinstance(record._body, bytes)
+    assert len(record._body) < len(body)
+    assert record.content_html == body
+    assert record.has_body
+
+    packed = pack_message(record)
+    assert packed == {
+        "i": 1,
+        "s": "Subject",
+        "f": "Opettaja A",
+        "t": "2023-01-02 08:00",
+        "d": "Saapuneet",
+        "h": body,
+    }
+    restored = unpack_message(packed)
+    assert restored.as_dict("Markdown") == {
+        "id": 1,
+        "subject": "Subject",
+        "sender": "Opettaja A",
+        "timestamp": "2023-01-02 08:00",
+        "folder": "Saapuneet",
+        "unread": False,
+        "content_html": body,
+        "content_markdown": "Markdown",
+    }
+    assert unpack_message({"i": 2, "t": "invalid"}).timestamp is None
+
+
+async def test_message_store_range(hass):
+    """Test ordered lookups on the message store."""
+    coordinator = WilmaCoordinator(
+        hass, "https://test.inschool.fi", "testuser", "testpass", "test_entry_id"
+    )
+    store = coordinator.messages
+    for msg_id, timestamp in (
+        (1, "2023-01-03 08:00"),
+        (2, "2023-01-01 08:00"),
+        (3, "2023-01-02 08:00"),
+    ):
+        message = MockWilmaMessage(msg_id, f"Subject {msg_id}", "Sender", timestamp)
+        assert store.add(MessageRecord.from_message(message))
+    assert not store.add(MessageRecord.from_dict({"id": 1, "timestamp": "2023-01-04"}))
+
+    assert store.latest().id == 1
+    assert [m.id for m in store.range()] == [2, 3, 1]
+    assert [
+        m.id
+        for m in store.range(datetime(2023, 1, 2, 8, 0), datetime(2023, 1, 3, 8, 0))
+    ] == [3, 1]
+
+
+async def test_message_store_counters(hass):
+    """Test that the aggregate counts follow inserts, removals and reads."""
+    coordinator = WilmaCoordinator(
+        hass, "https://test.inschool.fi", "testuser", "testpass", "test_entry_id"
+    )
+    store = coordinator.messages
+    for msg_id, sender, timestamp, unread in (
+        (1, "Opettaja A", "2023-01-02 08:00", True),
+        (2, "Opettaja A", "2023-01-02 09:00", False),
+        (3, "Opettaja B", "2023-01-03 08:00", True),
+    ):
+        store.add(
+            MessageRecord.from_message(
+                MockWilmaMessage(msg_id, f"Subject {msg_id}", sender, timestamp, unread)
+            )
+        )
+    counters = store.counters
+
+    assert store.unread_count == 2
+    assert (await store.async_latest_unread()).id == 3
+    assert counters.senders == {"Opettaja A": 2, "Opettaja B": 1}
+    assert counters.unread_senders == {"Opettaja A": 1, "Opettaja B": 1}
+    assert counters.on_day(date(2023, 1, 2)) == 2
+    assert counters.on_day(date(2023, 1, 4)) == 0
+
+    revision = store.revision
+    assert store.set_unread(1, False)
+    assert not store.set_unread(1, False)
+    assert store.revision == revision + 1
+    assert store.unread_count == 1
+    assert counters.unread_senders == {"Opettaja B": 1}
+    assert store.set_unread(2, True)
+    assert (await store.async_latest_unread()).id == 3
+    assert store.set_unread(2, False)
+
+    assert store.remove(3).id == 3
+    assert store.remove(3) is None
+    assert len(store) == 2
+    assert store.unread_count == 0
+    assert counters.senders == {"Opettaja A": 2}
+    assert counters.on_day(date(2023, 1, 3)) == 0
+    assert store.latest().id == 2
+    assert await store.async_latest_unread() is None
+
+
+async def test_message_store_retention(hass, hass_storage, mock_wilma_client):
+    """Test that old messages move to monthly shards read on demand."""
+    coordinator = WilmaCoordinator(
+        hass,
+        "https://test.inschool.fi",
+        "testuser",
+        "testpass",
+        "test_entry_id",
+        options={CONF_RETENTION_MESSAGES: 1},
+    )
+    await coordinator._async_setup()
+    data = await coordinator._async_update_data()
+    await coordinator.messages.async_flush()
+
+    store = coordinator.messages
+    # The older, unread message moved to its shard, the counts cover both
+    assert store.in_memory == 1
+    assert len(store) == 2
+    assert 1 not in store
+    assert store.unread_count == 1
+    assert store.counters.senders == {"Sender 1": 1, "Sender 2": 1}
+    assert data["latest_unread_id"] == 1
+    # Within its limits, the store has nothing more to move
+    assert await store.async_apply_retention() == 0
+    stored = hass_storage["wilma_messages_test_entry_id"]["data"]
+    assert stored["shards"] == {"202301": 1}
+    assert stored["unread_shards"] == {"202301": [1]}
+    shard = hass_storage["wilma_messages_test_entry_id_202301"]["data"]
+    assert "messages" not in shard
+
+    restarted = WilmaCoordinator(
+        hass,
+        "https://test.inschool.fi",
+        "testuser",
+        "testpass",
+        "test_entry_id",
+        options={CONF_RETENTION_MESSAGES: 1},
+    )
+    await restarted._async_setup()
+    assert len(restarted.messages) == 2
+    assert restarted.messages.unread_count == 1
+    assert restarted.messages.counters.on_day(date(2023, 1, 1)) == 1
+    # Shards are only read when an old message is looked up
+    assert not restarted.messages._loaded_shards
+    assert await restarted.async_has_message(1)
+    message = await restarted.async_get_message(1)
+    assert message["content_html"] == "<p>Test content 1</p>"
+    assert message["unread"] is True
+    assert list(restarted.messages._loaded_shards) == ["202301"]
+    assert (await restarted.messages.async_latest_unread()).id == 1
+    assert await restarted.async_get_message(3) is None
+
+
+async def test_coordinator_updates_read_state_in_shards(
+    hass, hass_storage, mock_wilma_client
+):
+    """Test that read state changes reach the messages moved to shards."""
+    coordinator = WilmaCoordinator(
+        hass,
+        "https://test.inschool.fi",
+        "testuser",
+        "testpass",
+        "test_entry_id",
+        options={CONF_RETENTION_MESSAGES: 1},
+    )
+    await coordinator._async_setup()
+    await coordinator.async_refresh()
+    store = coordinator.messages
+    assert 1 not in store
+    assert store.unread_shards == {"202301": (1,)}
+
+    # Message 1 was read in Wilma after it moved to its shard
+    mock_wilma_client.get_messages.return_value[0].unread = False
+    await coordinator.async_refresh()
+
+    assert coordinator.data["unread_count"] == 0
+    assert coordinator.data["latest_unread_id"] is None
+    assert store.unread_shards == {}
+    message = await store.async_get_archived(1, datetime(2023, 1, 1, 12))
+    assert message.unread is False
+    await store.async_flush()
+    stored = hass_storage["wilma_messages_test_entry_id"]["data"]
+    assert stored["archived"]["unread"] == 0
+    assert stored["unread_shards"] == {}
+
+    # Marked unread again, the message is found by its indexed timestamp
+    mock_wilma_client.get_messages.return_value[0].unread = True
+    await coordinator.async_refresh()
+
+    assert coordinator.data["unread_count"] == 1
+    assert coordinator.data["latest_unread_id"] == 1
+    assert store.unread_shards == {"202301": (1,)}
+    results = await coordinator.archive.async_search(query="Test")
+    assert {message["id"]: message["unread"] for message in results["messages"]} == {
+        1: True,
+        2: False,
+    }
+
+
+async def test_coordinator_updates_read_state(hass, mock_wilma_client):
+    """Test that a message listed again with a new read state updates counts."""
+    coordinator = WilmaCoordinator(
+        hass, "https://test.inschool.fi", "testuser", "testpass", "test_entry_id"
+    )
+    await coordinator._async_setup()
+    mock_wilma_client.get_messages.return_value[1].unread = True
+    await coordinator.async_refresh()
+    assert coordinator.data["unread_count"] == 2
+
+    # Message 2 was read in Wilma and is listed again in the cursor overlap
+    mock_wilma_client.get_messages.return_value[1].unread = False
+    await coordinator.async_refresh()
+
+    assert coordinator.data["unread_count"] == 1
+    assert coordinator.data["latest_unread_id"] == 1
+    assert coordinator.messages.get(2).unread is False
+    results = await coordinator.archive.async_search(query="Test")
+    assert {message["id"]: message["unread"] for message in results["messages"]} == {
+        1: True,
+        2: False,
+    }
+
+
+async def test_coordinator_updates_read_state_of_older_messages(
+    hass, mock_wilma_client
+):
+    """Test that reading a message older than the listed ones updates counts."""
+    coordinator = WilmaCoordinator(
+        hass, "https://test.inschool.fi", "testuser", "testpass", "test_entry_id"
+    )
+    await coordinator._async_setup()
+    await coordinator.async_refresh()
+    mock_wilma_client.get_messages.return_value = [
+        *mock_wilma_client.get_messages.return_value,
+        MockWilmaMessage(3, "New", "Sender 3", "2023-01-03 08:00", False, "<p>3</p>"),
+    ]
+    await coordinator.async_refresh()
+    assert coordinator.data["unread_count"] == 1
+    assert coordinator.data["latest_unread_id"] == 1
+
+    # Message 1 was read in Wilma, it is older than the cursor overlap
+    mock_wilma_client.get_messages.return_value[0].unread = False
+    await coordinator.async_refresh()
+
+    assert coordinator.data["unread_count"] == 0
+    assert coordinator.data["latest_unread_id"] is None
+    assert coordinator.messages.counters.unread_senders == {}
+    results = await coordinator.archive.async_search(query="Test")
+    assert not any(message["unread"] for message in results["messages"])
+
+
+async def test_coordinator_reuses_persisted_session(hass, mock_wilma_client):
+    """Test that a restarted coordinator skips the login round-trip."""
+    coordinator = WilmaCoordinator(
+        hass, "https://test.inschool.fi", "testuser", "testpass", "test_entry_id"
+    )
+    await coordinator._async_setup()
+    await coordinator._async_update_data()
+    await coordinator.async_close_client()
+    mock_wilma_client.login.reset_mock()
+
+    restarted = WilmaCoordinator(
+        hass, "https://test.inschool.fi", "testuser", "testpass", "test_entry_id"
+    )
+    await restarted._async_setup()
+    await restarted._async_update_data()
+
+    mock_wilma_client.login.assert_not_called()
+    assert mock_wilma_client._sid == "test-sid"
+    assert mock_wilma_client.user_id == "!01234"
+
+
+async def test_coordinator_concurrent_login(hass, mock_wilma_client):
+    """Test that concurrent callers share one login and get a logged in client."""
+    coordinator = WilmaCoordinator(
+        hass, "https://test.inschool.fi", "testuser", "testpass", "test_entry_id"
+    )
+    logged_in = asyncio.Event()
+
+    async def login(*args):
+        await logged_in.wait()
+
+    mock_wilma_client.login.side_effect = login
+
+    first = hass.async_create_task(coordinator.async_ensure_client())
+    second = hass.async_create_task(coordinator.async_ensure_client())
+    await asyncio.sleep(0)
+    assert coordinator.client is None
+    assert not first.done() and not second.done()
+
+    logged_in.set()
+    assert await first is await second is mock_wilma_client
+    mock_wilma_client.login.assert_called_once()
+
+    # A failed login leaves no client behind, the next caller logs in again
+    await coordinator.async_close_client()
+    mock_wilma_client.login.side_effect = AuthenticationError("Auth failed")
+    with pytest.raises(AuthenticationError):
+        await coordinator.async_ensure_client()
+    assert coordinator.client is None
+
+
+async def test_coordinator_rejected_session_logs_in(hass, mock_wilma_client):
+    """Test that a rejected persisted session falls back to a full login."""
+    coordinator = WilmaCoordinator(
+        hass, "https://test.inschool.fi", "testuser", "testpass", "test_entry_id"
+    )
+    await coordinator._async_setup()
+    await coordinator._async_update_data()
+    await coordinator.async_close_client()
+    mock_wilma_client.login.reset_mock()
+
+    messages = mock_wilma_client.get_messages.return_value
+    mock_wilma_client.get_messages.side_effect = [
+        aiohttp.ContentTypeError(MagicMock(), ()),
+        messages,
+    ]
+    await coordinator._async_update_data()
+
+    mock_wilma_client.login.assert_called_once_with("testuser", "testpass")
+    assert mock_wilma_client.get_messages.call_count == 3
 
 
 async def test_coordinator_auth_error(hass):
     """Test authentication error handling in coordinator."""
-    client = MagicMock()
+    client = make_wilma_client()
     client.login = AsyncMock(side_effect=AuthenticationError("Auth failed"))
-    
-    with patch("wilma.WilmaClient", return_value=client):
+
+    with patch_wilma_client(client):
         # Create coordinator
         coordinator = WilmaCoordinator(
             hass, "https://test.inschool.fi", "testuser", "testpass", "test_entry_id"
         )
-        
+
         # Test update with auth error
         with pytest.raises(UpdateFailed, match="Authentication failed"):
             await coordinator._async_update_data()
-        
+
         # Verify client was cleared
         assert coordinator.client is None
 
 
 async def test_coordinator_wilma_error(hass):
     """Test general Wilma error handling in coordinator."""
-    client = MagicMock()
-    client.login = AsyncMock()
+    client = make_wilma_client()
     client.get_messages = AsyncMock(side_effect=WilmaError("API Error"))
-    
-    with patch("wilma.WilmaClient", return_value=client):
+
+    with patch_wilma_client(client):
         # Create coordinator
         coordinator = WilmaCoordinator(
             hass, "https://test.inschool.fi", "testuser", "testpass", "test_entry_id"
         )
-        
+
         # Test update with API error
         with pytest.raises(UpdateFailed, match="Error communicating with Wilma"):
             await coordinator._async_update_data()
 
+        # The next poll is backed off
+        assert coordinator.scheduler.consecutive_failures == 1
+        assert coordinator.update_interval >= timedelta(minutes=27)
+
+
+
+async def test_coordinator_host_unavailable(hass, mock_wilma_client):
+    """Test that polls are short-circuited while the host is down."""
+    coordinator = WilmaCoordinator(
+        hass, "https://test.inschool.fi", "testuser", "testpass", "test_entry_id"
+    )
+    other = WilmaCoordinator(
+        hass, "https://test.inschool.fi", "otheruser", "testpass", "other_entry_id"
+    )
+    # Accounts on the same host share the governor
+    assert other.governor is coordinator.governor
+    for _ in range(3):
+        coordinator.governor._record_failure(SimpleNamespace())
+
+    with pytest.raises(UpdateFailed, match="is unavailable"):
+        await other._async_update_data()
+
+    mock_wilma_client.login.assert_not_called()
+    mock_wilma_client.get_messages.assert_not_called()
+    assert other.scheduler.consecutive_failures == 1
 
 async def test_coordinator_close(hass, mock_wilma_client):
     """Test the coordinator's close method."""
@@ -79,14 +716,55 @@ async def test_coordinator_close(hass, mock_wilma_client):
     coordinator = WilmaCoordinator(
         hass, "https://test.inschool.fi", "testuser", "testpass", "test_entry_id"
     )
-    
+    await coordinator._async_setup()
+
     # Update to initialize client
     await coordinator._async_update_data()
     assert coordinator.client is not None
-    
+
     # Close client
     await coordinator.async_close_client()
-    
+
     # Verify client was closed and reset
     mock_wilma_client.close.assert_called_once()
-    assert coordinator.client is None
\ No newline at end of file
+    assert coordinator.client is None
+
+
+async def test_coordinator_new_message_events(hass, mock_wilma_client):
+    """Test that every new message fires one event, except on the first import."""
+    events = async_capture_events(hass, EVENT_NEW_MESSAGE)
+    coordinator = WilmaCoordinator(
+        hass, "https://test.inschool.fi", "testuser", "testpass", "test_entry_id"
+    )
+    await coordinator._async_setup()
+    await coordinator._async_update_data()
+    await hass.async_block_till_done()
+    assert events == []
+
+    mock_wilma_client.get_messages.return_value = [
+        MockWilmaMessage(4, "Second", "Sender 4", "2023-01-03 09:00"),
+        MockWilmaMessage(3, "First", "Sender 3", "2023-01-03 08:00"),
+        MockWilmaMessage(2, "Test Message 2", "Sender 2", "2023-01-02 12:00"),
+    ]
+    await coordinator._async_update_data()
+    await coordinator._async_update_data()
+    await hass.async_block_till_done()
+
+    assert [event.data for event in events] == [
+        {
+            "config_entry_id": "test_entry_id",
+            "role": None,
+            "id": 3,
+            "subject": "First",
+            "sender": "Sender 3",
+            "timestamp": "2023-01-03 08:00",
+        },
+        {
+            "config_entry_id": "test_entry_id",
+            "role": None,
+            "id": 4,
+            "subject": "Second",
+            "sender": "Sender 4",
+            "timestamp": "2023-01-03 09:00",
+        },
+    ]
@@ -0,0 +1,35 @@
+"""Test the Wilma diagnostics."""
+from homeassistant.core import HomeAssistant
+
+from custom_components.wilma.diagnostics import async_get_config_entry_diagnostics
+
+
+async def test_diagnostics(hass: HomeAssistant, mock_setup_integration):
+    """Test that diagnostics report the poll telemetry without credentials."""
+    entry = await mock_setup_integration()
+
+    diagnostics = await async_get_config_entry_diagnostics(hass, entry)
+
+    assert diagnostics["entry"]["data"]["username"] == "**REDACTED**"
+    assert diagnostics["entry"]["data"]["password"] == "**REDACTED**"
+    assert "testpass" not in str(diagnostics)
+
+    telemetry = diagnostics["telemetry"]
+    assert telemetry["polls"] == 1
+    assert telemetry["failures"] == 0
+    last_poll = telemetry["last_poll"]
+    assert set(last_poll["phases"]) == {
+        "login",
+        "list",
+        "bodies",
+        "convert",
+        "persist",
+    }
+    assert last_poll["new_messages"] == 2
+    assert last_poll["stored_messages"] == 2
+    assert last_poll["error"] is None
+    assert diagnostics["response_cache"] == {"paths": 1, "hits": 0, "misses": 1}
+
+    assert diagnostics["store"]["messages"] == 2
+    assert diagnostics["store"]["unread"] == 1
+    assert diagnostics["roles"] == {}
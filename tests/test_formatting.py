@@ -0,0 +1,57 @@
+"""Test the Wilma message body formatting."""
+import threading
+from unittest.mock import patch
+
+from homeassistant.core import HomeAssistant
+
+from custom_components.wilma import formatting
+from custom_components.wilma.formatting import MarkdownCache
+
+
+async def test_convert_runs_in_executor(hass: HomeAssistant):
+    """Test that conversions run off the event loop, in batches."""
+    loop_thread = threading.get_ident()
+    threads = []
+    batches = []
+    convert_batch = formatting._convert_batch
+
+    def _record(bodies):
+        threads.append(threading.get_ident())
+        batches.append(len(bodies))
+        return convert_batch(bodies)
+
+    bodies = [f"<p>Body <b>{i}</b></p>" for i in range(30)]
+    cache = MarkdownCache()
+    with patch.object(formatting, "_convert_batch", _record):
+        result = await cache.async_convert(hass, bodies + bodies[:5])
+
+    assert result[bodies[3]] == "Body **3**"
+    assert len(result) == 30
+    assert batches == [25, 5]
+    assert loop_thread not in threads
+
+
+async def test_cache_hits_skip_conversion(hass: HomeAssistant):
+    """Test that cached bodies are not converted again."""
+    cache = MarkdownCache()
+    await cache.async_convert(hass, ["<p>One</p>", "<p>Two</p>"])
+
+    with patch.object(formatting, "_convert_batch") as convert_batch:
+        result = await cache.async_convert(hass, ["<p>Two</p>"])
+
+    convert_batch.assert_not_called()
+    assert result == {"<p>Two</p>": "Two"}
+    assert cache.get("<p>One</p>") == "One"
+
+
+async def test_cache_evicts_least_recently_used(hass: HomeAssistant):
+    """Test that the cache stays within its size limit."""
+    cache = MarkdownCache(max_size=2)
+    await cache.async_convert(hass, ["<p>One</p>", "<p>Two</p>"])
+    assert cache.get("<p>One</p>") == "One"
+
+    await cache.async_convert(hass, ["<p>Three</p>"])
+
+    assert len(cache) == 2
+    assert cache.get("<p>Two</p>") is None
+    assert cache.get("<p>One</p>") == "One"
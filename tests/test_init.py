@@ -1,9 +1,12 @@
 """Test the Wilma integration initialization."""
+import asyncio
 from unittest.mock import patch
 
 import pytest
+from homeassistant.config_entries import ConfigEntryState
 from homeassistant.core import HomeAssistant
 from homeassistant.helpers.entity_registry import async_get as get_entity_registry
+from wilhelmina import WilmaError
 
 from custom_components.wilma.const import DOMAIN, SENSOR_LATEST_MESSAGE
 
@@ -32,4 +35,78 @@ async def test_setup_and_unload_entry(hass: HomeAssistant, mock_setup_integratio
     await hass.async_block_till_done()
     
     # Verify coordinator is removed from hass.data
-    assert entry.entry_id not in hass.data[DOMAIN]
\ No newline at end of file
+    assert entry.entry_id not in hass.data[DOMAIN]
+
+async def test_remove_entry_clears_session(
+    hass: HomeAssistant, hass_storage, mock_setup_integration
+):
+    """Test that removing an entry forgets its persisted Wilma session."""
+    entry = await mock_setup_integration()
+    assert f"wilma_session_{entry.entry_id}" in hass_storage
+
+    assert await hass.config_entries.async_remove(entry.entry_id)
+    await hass.async_block_till_done()
+
+    assert f"wilma_session_{entry.entry_id}" not in hass_storage
+    assert f"wilma_roles_{entry.entry_id}" not in hass_storage
+
+
+async def test_setup_restores_persisted_messages(
+    hass: HomeAssistant, mock_wilma_client, mock_setup_integration
+):
+    """Test that a restart sets up from the store before Wilma answers."""
+    entry = await mock_setup_integration()
+    assert await hass.config_entries.async_unload(entry.entry_id)
+    await hass.async_block_till_done()
+
+    messages = mock_wilma_client.get_messages.return_value
+    answer = asyncio.Event()
+
+    async def slow_get_messages(*args, **kwargs):
+        await answer.wait()
+        raise WilmaError("Server down")
+
+    mock_wilma_client.get_messages.side_effect = slow_get_messages
+    await hass.config_entries.async_setup(entry.entry_id)
+    await hass.async_block_till_done()
+
+    # The sensors are set up from the store while the poll is waiting
+    assert entry.state is ConfigEntryState.LOADED
+    assert hass.states.get("sensor.latest_message").state == "Test Message 2"
+    assert hass.states.get("sensor.latest_unread_message").state == "Test Message 1"
+
+    # A failed background poll keeps the restored data
+    answer.set()
+    await hass.async_block_till_done(wait_background_tasks=True)
+    coordinator = hass.data[DOMAIN][entry.entry_id]
+    assert coordinator.last_update_success is False
+    assert coordinator.data["latest_message"].id == 2
+
+    mock_wilma_client.get_messages.side_effect = None
+    mock_wilma_client.get_messages.return_value = messages
+    await coordinator.async_refresh()
+    assert hass.states.get("sensor.latest_message").state == "Test Message 2"
+
+
+async def test_setup_reloads_when_roles_change(
+    hass: HomeAssistant, mock_wilma_client, mock_setup_integration
+):
+    """Test that a restored entry is reloaded when the account gains a role."""
+    entry = await mock_setup_integration()
+    assert hass.states.get("sensor.latest_message_aino") is None
+    assert await hass.config_entries.async_unload(entry.entry_id)
+    await hass.async_block_till_done()
+
+    mock_wilma_client.responses["index_json"] = {
+        "Roles": [
+            {"Name": "Huoltaja", "Slug": "/!01234"},
+            {"Name": "Aino", "Slug": "/!05678"},
+        ]
+    }
+    mock_wilma_client.responses["!05678/messages/list"] = {"Messages": []}
+    await hass.config_entries.async_setup(entry.entry_id)
+    await hass.async_block_till_done(wait_background_tasks=True)
+    await hass.async_block_till_done(wait_background_tasks=True)
+
+    assert entry.state is ConfigEntryState.LOADED
+    assert hass.states.get("sensor.latest_message_aino") is not None
@@ -0,0 +1,59 @@
+"""Test the Wilma change probe."""
+from datetime import timedelta
+
+from homeassistant.core import HomeAssistant
+from pytest_homeassistant_custom_component.common import async_fire_time_changed
+
+from custom_components.wilma.const import DOMAIN, MESSAGE_LIST_PATH
+
+from .conftest import MockWilmaMessage
+
+
+def _list_requests(client):
+    """Return how often the message list was requested."""
+    return [
+        call.args[0] for call in client._authenticated_request.call_args_list
+    ].count(MESSAGE_LIST_PATH)
+
+
+async def test_probe_polls_on_change(
+    hass: HomeAssistant, freezer, mock_wilma_client, mock_setup_integration
+):
+    """Test that only a changed message list starts a poll."""
+    entry = await mock_setup_integration()
+    coordinator = hass.data[DOMAIN][entry.entry_id]
+    polls = mock_wilma_client._get_unread_message_ids.await_count
+
+    # An unchanged list is neither parsed again nor polled
+    assert await coordinator.probe.async_probe() is False
+    assert coordinator.response_cache.hits == 1
+    assert mock_wilma_client._get_unread_message_ids.await_count == polls
+
+    mock_wilma_client.get_messages.return_value.append(
+        MockWilmaMessage(3, "New", "Sender 1", "2023-01-03 11:00", True, "<p>New</p>")
+    )
+    requests = _list_requests(mock_wilma_client)
+    # The first poll found new messages, the lists are checked every minute
+    freezer.tick(timedelta(minutes=2))
+    async_fire_time_changed(hass)
+    await hass.async_block_till_done(wait_background_tasks=True)
+
+    assert 3 in coordinator.messages
+    assert mock_wilma_client._get_unread_message_ids.await_count == polls + 1
+    # The poll found the list in the cache of the probe
+    assert _list_requests(mock_wilma_client) == requests + 2
+    assert coordinator.probe.as_dict()["changes"] == 1
+
+
+async def test_probe_skipped_while_failing(
+    hass: HomeAssistant, mock_wilma_client, mock_setup_integration
+):
+    """Test that the probe leaves a failing Wilma to the backed off polls."""
+    entry = await mock_setup_integration()
+    coordinator = hass.data[DOMAIN][entry.entry_id]
+    coordinator.last_update_success = False
+    requests = _list_requests(mock_wilma_client)
+
+    assert await coordinator.probe.async_probe() is False
+    assert _list_requests(mock_wilma_client) == requests
+    assert coordinator.probe.probes == 0
@@ -0,0 +1,102 @@
+"""Test the Wilma adaptive polling schedule."""
+from datetime import datetime, timedelta
+
+from custom_components.wilma.const import (
+    CONF_ACTIVE_SCAN_INTERVAL,
+    CONF_IDLE_SCAN_INTERVAL,
+)
+from custom_components.wilma.scheduler import PollScheduler
+
+# Monday
+SCHOOL_MORNING = datetime(2023, 1, 2, 9, 0)
+SCHOOL_EVENING = datetime(2023, 1, 2, 20, 0)
+# Saturday
+WEEKEND = datetime(2023, 1, 7, 12, 0)
+
+
+def _unjittered(scheduler, interval):
+    """Remove the per-entry jitter from an interval."""
+    return interval / scheduler._jitter
+
+
+def test_profile_intervals():
+    """Test school hours and off hours intervals."""
+    scheduler = PollScheduler(
+        "entry", {CONF_ACTIVE_SCAN_INTERVAL: 10, CONF_IDLE_SCAN_INTERVAL: 120}
+    )
+
+    assert _unjittered(
+        scheduler, scheduler.on_success(0, SCHOOL_MORNING)
+    ) == timedelta(minutes=10)
+    assert _unjittered(
+        scheduler, scheduler.on_success(0, SCHOOL_EVENING)
+    ) == timedelta(minutes=120)
+    assert _unjittered(scheduler, scheduler.on_success(0, WEEKEND)) == timedelta(
+        minutes=120
+    )
+    # The idle interval does not run past the start of the school day
+    assert _unjittered(
+        scheduler, scheduler.on_success(0, datetime(2023, 1, 2, 6, 30))
+    ) == timedelta(minutes=30)
+
+
+def test_recent_messages_speed_up_polling():
+    """Test that new messages shorten the interval for a while."""
+    scheduler = PollScheduler("entry", {})
+
+    assert _unjittered(
+        scheduler, scheduler.on_success(2, SCHOOL_EVENING)
+    ) == timedelta(minutes=5)
+    assert _unjittered(
+        scheduler, scheduler.on_success(0, SCHOOL_EVENING + timedelta(minutes=30))
+    ) == timedelta(minutes=5)
+    assert _unjittered(
+        scheduler, scheduler.on_success(0, SCHOOL_EVENING + timedelta(hours=2))
+    ) == timedelta(minutes=120)
+
+
+def test_probe_intervals():
+    """Test that the lists are checked more often during school hours."""
+    scheduler = PollScheduler("entry", {})
+
+    assert _unjittered(
+        scheduler, scheduler.probe_interval(SCHOOL_MORNING)
+    ) == timedelta(minutes=1)
+    assert _unjittered(scheduler, scheduler.probe_interval(WEEKEND)) == timedelta(
+        minutes=10
+    )
+    # New messages keep the short interval outside school hours as well
+    scheduler.on_success(1, SCHOOL_EVENING)
+    assert _unjittered(
+        scheduler, scheduler.probe_interval(SCHOOL_EVENING + timedelta(minutes=30))
+    ) == timedelta(minutes=1)
+
+
+def test_failures_back_off_exponentially():
+    """Test that failures back off up to a cap and success resets them."""
+    scheduler = PollScheduler("entry", {})
+
+    intervals = [
+        _unjittered(scheduler, scheduler.on_failure(SCHOOL_MORNING)) for _ in range(6)
+    ]
+    assert intervals[:3] == [
+        timedelta(minutes=30),
+        timedelta(minutes=60),
+        timedelta(minutes=120),
+    ]
+    assert intervals[-1] == timedelta(hours=6)
+
+    scheduler.on_success(0, SCHOOL_MORNING)
+    assert scheduler.consecutive_failures == 0
+
+
+def test_jitter_is_stable_per_entry():
+    """Test that entries are spread out but keep their own offset."""
+    first = PollScheduler("first", {})
+    again = PollScheduler("first", {})
+    second = PollScheduler("second", {})
+
+    interval = first.on_success(0, SCHOOL_MORNING)
+    assert interval == again.on_success(0, SCHOOL_MORNING)
+    assert interval != second.on_success(0, SCHOOL_MORNING)
+    assert timedelta(minutes=13.5) <= interval <= timedelta(minutes=16.5)
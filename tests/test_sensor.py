@@ -1,10 +1,13 @@
 """Test the Wilma sensor platform."""
-from unittest.mock import AsyncMock, patch
+from datetime import timedelta
 
 import pytest
 from homeassistant.const import STATE_UNKNOWN
 from homeassistant.core import HomeAssistant
+from homeassistant.helpers import device_registry as dr
+from homeassistant.util import dt as dt_util
 from pytest_homeassistant_custom_component.common import MockConfigEntry
+from wilhelmina import WilmaError
 
 from custom_components.wilma.const import (
     ATTR_CONTENT,
@@ -16,6 +19,8 @@ from custom_components.wilma.const import (
     DOMAIN,
 )
 
+from .conftest import MockWilmaMessage, make_wilma_client, patch_wilma_client
+
 
 async def test_sensors_state(hass: HomeAssistant, mock_setup_integration):
     """Test sensor states."""
@@ -25,13 +30,13 @@ async def test_sensors_state(hass: HomeAssistant, mock_setup_integration):
     # Check latest message sensor
     state = hass.states.get("sensor.latest_message")
     assert state is not None
-    assert state.state == "Test Message 1"
+    assert state.state == "Test Message 2"
     
     # Check attributes
-    assert state.attributes[ATTR_ID] == 1
-    assert state.attributes[ATTR_SUBJECT] == "Test Message 1"
-    assert state.attributes[ATTR_SENDER] == "Sender 1"
-    assert state.attributes[ATTR_TIMESTAMP] == "2023-01-01 12:00"
+    assert state.attributes[ATTR_ID] == 2
+    assert state.attributes[ATTR_SUBJECT] == "Test Message 2"
+    assert state.attributes[ATTR_SENDER] == "Sender 2"
+    assert state.attributes[ATTR_TIMESTAMP] == "2023-01-02 12:00"
     assert ATTR_CONTENT in state.attributes
     assert ATTR_CONTENT_MARKDOWN in state.attributes
     
@@ -49,11 +54,8 @@ async def test_sensors_state(hass: HomeAssistant, mock_setup_integration):
 async def test_sensor_no_messages(hass: HomeAssistant, mock_config_entry):
     """Test sensor behavior when there are no messages."""
     # Set up empty messages return
-    with patch("wilma.WilmaClient") as mock_client:
-        client = mock_client.return_value
-        client.login = AsyncMock()
-        client.get_messages = AsyncMock(return_value=[])
-        
+    client = make_wilma_client()
+    with patch_wilma_client(client):
         # Set up entry
         mock_config_entry.add_to_hass(hass)
         await hass.config_entries.async_setup(mock_config_entry.entry_id)
@@ -67,4 +69,122 @@ async def test_sensor_no_messages(hass: HomeAssistant, mock_config_entry):
     # Check latest unread message sensor - should be unknown
     state = hass.states.get("sensor.latest_unread_message")
     assert state is not None
-    assert state.state == STATE_UNKNOWN
\ No newline at end of file
+    assert state.state == STATE_UNKNOWN
+
+async def test_sensors_per_role(
+    hass: HomeAssistant, mock_wilma_client, mock_config_entry
+):
+    """Test that every other role of the account gets its own sensors."""
+    role_message = {
+        "Id": 10,
+        "Subject": "Retkipäivä",
+        "TimeStamp": (dt_util.now() - timedelta(days=1)).strftime("%Y-%m-%d %H:%M"),
+        "Folder": "Saapuneet",
+        "SenderId": 7,
+        "SenderType": 1,
+        "Sender": "Opettaja",
+    }
+    mock_wilma_client.responses.update(
+        {
+            "index_json": {
+                "Roles": [
+                    {"Name": "Huoltaja", "Slug": "/!01234"},
+                    {"Name": "Aino", "Slug": "/!05678"},
+                ]
+            },
+            "!05678/messages/list": {"Messages": [role_message]},
+            "!05678/messages/10": {
+                "messages": [{**role_message, "ContentHtml": "<p>Retki</p>"}]
+            },
+        }
+    )
+    mock_config_entry.add_to_hass(hass)
+    await hass.config_entries.async_setup(mock_config_entry.entry_id)
+    await hass.async_block_till_done()
+
+    assert hass.states.get("sensor.latest_message").state == "Test Message 2"
+    state = hass.states.get("sensor.latest_message_aino")
+    assert state.state == "Retkipäivä"
+    assert state.attributes[ATTR_CONTENT] == "<p>Retki</p>"
+    assert hass.states.get("sensor.senders_aino").state == "1"
+    # Wilma reports no read state for the other roles
+    assert hass.states.get("sensor.unread_messages") is not None
+    assert hass.states.get("sensor.unread_messages_aino") is None
+    assert hass.states.get("sensor.latest_unread_message_aino") is None
+
+    device = dr.async_get(hass).async_get_device(
+        identifiers={(DOMAIN, f"{mock_config_entry.entry_id}_!05678")}
+    )
+    assert device.name == "Wilma (Aino)"
+    # Both roles are fetched over the one login
+    mock_wilma_client.login.assert_called_once()
+
+
+async def test_unchanged_poll_writes_no_message_state(
+    hass: HomeAssistant, mock_setup_integration, freezer
+):
+    """Test that a poll without changes only updates the last update sensor."""
+    entry = await mock_setup_integration()
+    message_state = hass.states.get("sensor.latest_message")
+    last_update = hass.states.get("sensor.last_update").state
+
+    freezer.tick(timedelta(minutes=30))
+    await hass.data[DOMAIN][entry.entry_id].async_refresh()
+    await hass.async_block_till_done()
+
+    assert hass.states.get("sensor.latest_message").last_reported == (
+        message_state.last_reported
+    )
+    assert hass.states.get("sensor.last_update").state != last_update
+
+
+async def test_telemetry_sensors(
+    hass: HomeAssistant, mock_wilma_client, mock_setup_integration
+):
+    """Test the diagnostic sensors of the last poll, also after a failure."""
+    entry = await mock_setup_integration()
+
+    assert float(hass.states.get("sensor.poll_duration").state) >= 0
+    assert hass.states.get("sensor.poll_requests").state == "0"
+    assert hass.states.get("sensor.poll_data_received").state == "0"
+    assert hass.states.get("sensor.poll_new_messages").state == "2"
+    assert hass.states.get("sensor.stored_messages").state == "2"
+    attributes = hass.states.get("sensor.poll_duration").attributes
+    assert "bodies_duration" in attributes
+    assert attributes["error"] is None
+
+    coordinator = hass.data[DOMAIN][entry.entry_id]
+    mock_wilma_client.get_messages.side_effect = WilmaError("Server error")
+    await coordinator.async_refresh()
+    await hass.async_block_till_done()
+
+    assert hass.states.get("sensor.poll_new_messages").state == "0"
+    assert "Server error" in hass.states.get("sensor.poll_duration").attributes["error"]
+    assert coordinator.telemetry.failures == 1
+
+
+async def test_counter_sensors(
+    hass: HomeAssistant, mock_wilma_client, mock_setup_integration
+):
+    """Test the sensors counting stored messages."""
+    today = dt_util.now().strftime("%Y-%m-%d 08:00")
+    mock_wilma_client.get_messages.return_value.append(
+        MockWilmaMessage(3, "Today", "Sender 1", today, True, "<p>Today</p>")
+    )
+    entry = await mock_setup_integration()
+
+    assert hass.states.get("sensor.unread_messages").state == "2"
+    assert hass.states.get("sensor.messages_today").state == "1"
+    state = hass.states.get("sensor.senders")
+    assert state.state == "2"
+    assert state.attributes["messages"] == {"Sender 1": 2, "Sender 2": 1}
+    assert state.attributes["unread"] == {"Sender 1": 2}
+
+    coordinator = hass.data[DOMAIN][entry.entry_id]
+    # Read in Wilma, the next poll lists it again as read
+    mock_wilma_client.get_messages.return_value[-1].unread = False
+    await coordinator.async_refresh()
+    await hass.async_block_till_done()
+
+    assert hass.states.get("sensor.unread_messages").state == "1"
+    assert hass.states.get("sensor.senders").attributes["unread"] == {"Sender 1": 1}
@@ -0,0 +1,196 @@
+"""Test the Wilma services and websocket API."""
+import os
+
+import aiohttp
+import pytest
+from homeassistant.core import HomeAssistant
+from homeassistant.exceptions import HomeAssistantError, ServiceValidationError
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+
+from custom_components.wilma.client import WilmaHostUnavailable
+from custom_components.wilma.const import (
+    ATTR_CONTENT,
+    ATTR_CONTENT_MARKDOWN,
+    ATTR_MESSAGE_ID,
+    CONF_LEAN_ATTRIBUTES,
+    DOMAIN,
+    SERVICE_GET_MESSAGE,
+    SERVICE_PROFILE_POLL,
+    SERVICE_SEARCH_MESSAGES,
+)
+
+
+async def test_get_message_service(hass: HomeAssistant, mock_setup_integration):
+    """Test reading a message body through the service."""
+    await mock_setup_integration()
+
+    response = await hass.services.async_call(
+        DOMAIN,
+        SERVICE_GET_MESSAGE,
+        {ATTR_MESSAGE_ID: 1},
+        blocking=True,
+        return_response=True,
+    )
+
+    assert response == {
+        "id": 1,
+        "subject": "Test Message 1",
+        "sender": "Sender 1",
+        "timestamp": "2023-01-01 12:00",
+        "unread": True,
+        "content": "<p>Test content 1</p>",
+        "content_markdown": "Test content 1",
+        "attachments": [],
+    }
+
+    with pytest.raises(ServiceValidationError):
+        await hass.services.async_call(
+            DOMAIN,
+            SERVICE_GET_MESSAGE,
+            {ATTR_MESSAGE_ID: 99},
+            blocking=True,
+            return_response=True,
+        )
+
+
+async def test_get_message_websocket(
+    hass: HomeAssistant, mock_setup_integration, hass_ws_client
+):
+    """Test reading a message body through the websocket API."""
+    entry = await mock_setup_integration()
+    client = await hass_ws_client(hass)
+
+    await client.send_json_auto_id(
+        {"type": "wilma/message", "message_id": 2, "config_entry_id": entry.entry_id}
+    )
+    msg = await client.receive_json()
+    assert msg["success"]
+    assert msg["result"]["content"] == "<p>Test content 2</p>"
+
+    await client.send_json_auto_id({"type": "wilma/message", "message_id": 99})
+    msg = await client.receive_json()
+    assert not msg["success"]
+    assert msg["error"]["code"] == "not_found"
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        aiohttp.ClientConnectionError("Connection reset"),
+        TimeoutError(),
+        WilmaHostUnavailable("test.inschool.fi", 30),
+    ],
+)
+async def test_get_message_communication_error(
+    hass: HomeAssistant,
+    mock_setup_integration,
+    mock_wilma_client,
+    hass_ws_client,
+    error,
+):
+    """Test that a failed body fetch is reported as a Home Assistant error."""
+    entry = await mock_setup_integration()
+    hass.data[DOMAIN][entry.entry_id].messages.get(1).content_html = None
+    mock_wilma_client.get_message_content.side_effect = error
+
+    with pytest.raises(HomeAssistantError) as exc_info:
+        await hass.services.async_call(
+            DOMAIN,
+            SERVICE_GET_MESSAGE,
+            {ATTR_MESSAGE_ID: 1},
+            blocking=True,
+            return_response=True,
+        )
+    assert exc_info.value.translation_key == "communication_error"
+
+    client = await hass_ws_client(hass)
+    await client.send_json_auto_id({"type": "wilma/message", "message_id": 1})
+    msg = await client.receive_json()
+    assert not msg["success"]
+    assert msg["error"]["code"] == "home_assistant_error"
+
+
+async def test_message_bodies_are_not_recorded(
+    hass: HomeAssistant, mock_setup_integration
+):
+    """Test that body attributes are excluded from the recorder."""
+    await mock_setup_integration()
+
+    entity = hass.data["entity_components"]["sensor"].get_entity(
+        "sensor.latest_message"
+    )
+    assert {ATTR_CONTENT, ATTR_CONTENT_MARKDOWN} <= entity._unrecorded_attributes
+
+
+async def test_lean_attributes(hass: HomeAssistant, mock_wilma_client):
+    """Test that lean attributes leave the body out of the state."""
+    entry = MockConfigEntry(
+        domain=DOMAIN,
+        data={
+            "server_url": "https://test.inschool.fi",
+            "username": "testuser",
+            "password": "testpass",
+        },
+        options={CONF_LEAN_ATTRIBUTES: True},
+    )
+    entry.add_to_hass(hass)
+    await hass.config_entries.async_setup(entry.entry_id)
+    await hass.async_block_till_done()
+
+    state = hass.states.get("sensor.latest_message")
+    assert state.attributes["id"] == 2
+    assert ATTR_CONTENT not in state.attributes
+    assert ATTR_CONTENT_MARKDOWN not in state.attributes
+
+
+async def test_search_messages_service(hass: HomeAssistant, mock_setup_integration):
+    """Test searching the message archive."""
+    await mock_setup_integration()
+
+    async def search(**data):
+        return await hass.services.async_call(
+            DOMAIN, SERVICE_SEARCH_MESSAGES, data, blocking=True, return_response=True
+        )
+
+    response = await search(query="content")
+    assert response["total"] == 2
+    assert [m["id"] for m in response["messages"]] == [2, 1]
+    assert response["messages"][1]["snippet"] == "Test **content** 1"
+
+    response = await search(query="content", limit=1, offset=1)
+    assert response["total"] == 2
+    assert [m["id"] for m in response["messages"]] == [1]
+
+    response = await search(sender="Sender 2")
+    assert [m["id"] for m in response["messages"]] == [2]
+
+    response = await search(start_date="2023-01-01", end_date="2023-01-01")
+    assert [m["id"] for m in response["messages"]] == [1]
+
+    response = await search(query="missing")
+    assert response == {"total": 0, "offset": 0, "messages": []}
+
+    with pytest.raises(ServiceValidationError):
+        await search(query='"unbalanced')
+
+
+async def test_profile_poll_service(hass: HomeAssistant, mock_setup_integration):
+    """Test recording a profile of one poll."""
+    await mock_setup_integration()
+
+    response = await hass.services.async_call(
+        DOMAIN, SERVICE_PROFILE_POLL, {"top": 5}, blocking=True, return_response=True
+    )
+
+    assert os.path.exists(response["path"])
+    assert response["path"].endswith(".prof")
+    assert len(response["functions"]) == 5
+    assert response["functions"][0]["cumulative_time"] >= 0
+    assert response["poll"]["new_messages"] == 0
+    assert set(response["poll"]["phases"]) == {
+        "login",
+        "list",
+        "bodies",
+        "convert",
+        "persist",
+    }